@@ -0,0 +1,182 @@
+import time
+import heapq
+import asyncio
+from collections import deque
+
+from search_index import normalize_title
+
+# Инвентарь аккаунтов для аренды. Свободные аккаунты лежат в очередях по (платформа, игра),
+# занятые — в куче по времени освобождения. Выдача свободного аккаунта — O(1) в среднем,
+# освобождение по истечении аренды происходит само, без обхода всех аккаунтов
+
+
+def game_key(title):
+    return normalize_title(title)
+
+
+def platform_key(platform):
+    return str(platform or '').strip().upper()
+
+
+class AccountPool:
+    """Аккаунты accounts/{id}: {'number', 'platform', 'email', 'password', 'games': {название: true},
+    'busy_until': unix-время окончания аренды (0 — свободен), 'order_number'}"""
+
+    def __init__(self):
+        self._accounts = {}
+        self._by_number = {}
+        # (платформа, игра) -> очередь id; аккаунт числится в очереди каждой своей игры,
+        # поэтому записи занятых аккаунтов удаляются лениво при выдаче; _queued не дает
+        # аккаунту попасть в одну очередь дважды
+        self._free = {}
+        self._queued = {}
+        self._busy = []  # (busy_until, id)
+        self._wakeup = asyncio.Event()
+        self.loaded = False
+        self.allocations = 0
+        self.releases = 0
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def load(self, records):
+        """Перестраивает индексы по всем аккаунтам, прочитанным из базы одним запросом"""
+        self._accounts = {}
+        self._by_number = {}
+        self._free = {}
+        self._queued = {}
+        self._busy = []
+        for account_id, record in (records or {}).items():
+            self.add(account_id, record)
+        self.loaded = True
+
+    def add(self, account_id, record):
+        self._accounts[account_id] = record
+        self._by_number[str(record.get('number'))] = account_id
+        busy_until = record.get('busy_until') or 0
+        if busy_until > time.time():
+            heapq.heappush(self._busy, (busy_until, account_id))
+            self._wakeup.set()
+        else:
+            self._push_free(account_id)
+
+    def get(self, account_id):
+        return self._accounts.get(account_id)
+
+    def find_by_number(self, number):
+        return self._by_number.get(str(number))
+
+    def _push_free(self, account_id):
+        record = self._accounts[account_id]
+        platform = platform_key(record.get('platform'))
+        for title in record.get('games') or {}:
+            key = (platform, game_key(title))
+            queued = self._queued.setdefault(key, set())
+            if account_id not in queued:
+                queued.add(account_id)
+                self._free.setdefault(key, deque()).append(account_id)
+
+    def _is_free(self, account_id, now):
+        record = self._accounts.get(account_id)
+        return record is not None and (record.get('busy_until') or 0) <= now
+
+    def allocate(self, platform, game_title, busy_until, order_number=None):
+        """Занимает свободный аккаунт с игрой до busy_until. Возвращает (id, запись) или None"""
+        key = (platform_key(platform), game_key(game_title))
+        queue = self._free.get(key)
+        now = time.time()
+        while queue:
+            account_id = queue.popleft()
+            self._queued[key].discard(account_id)
+            if self._is_free(account_id, now):
+                self.occupy(account_id, busy_until, order_number)
+                self.allocations += 1
+                return account_id, self._accounts[account_id]
+        return None
+
+    def occupy(self, account_id, busy_until, order_number=None):
+        """Отмечает аккаунт занятым (выданным автоматически или вручную).
+        Возвращает False, если аккаунт уже занят другой арендой"""
+        record = self._accounts[account_id]
+        if not self._is_free(account_id, time.time()):
+            return False
+        record['busy_until'] = busy_until
+        record['order_number'] = order_number
+        heapq.heappush(self._busy, (busy_until, account_id))
+        self._wakeup.set()
+        return True
+
+    def undo_allocation(self, account_id):
+        """Отменяет выдачу, которую не удалось сохранить в базе: аккаунт снова свободен"""
+        record = self._accounts[account_id]
+        record['busy_until'] = 0
+        record['order_number'] = None
+        self._push_free(account_id)
+        self.allocations -= 1
+
+    def release(self, account_id):
+        """Досрочно освобождает аккаунт (возврат до окончания аренды)"""
+        record = self._accounts[account_id]
+        if (record.get('busy_until') or 0) <= time.time():
+            return False
+        record['busy_until'] = 0
+        record['order_number'] = None
+        self._push_free(account_id)
+        self.releases += 1
+        return True
+
+    def release_due(self, now=None):
+        """Возвращает в свободные аккаунты, чья аренда закончилась. Возвращает их id"""
+        now = time.time() if now is None else now
+        released = []
+        while self._busy and self._busy[0][0] <= now:
+            busy_until, account_id = heapq.heappop(self._busy)
+            record = self._accounts.get(account_id)
+            # Аренду могли продлить — тогда в куче есть более поздняя запись
+            if record is None or (record.get('busy_until') or 0) != busy_until:
+                continue
+            record['busy_until'] = 0
+            record['order_number'] = None
+            self._push_free(account_id)
+            released.append(account_id)
+        self.releases += len(released)
+        return released
+
+    async def run(self):
+        """Фоновый цикл: спит до ближайшего окончания аренды и освобождает аккаунты"""
+        while True:
+            self.release_due()
+            timeout = max(0.0, self._busy[0][0] - time.time()) if self._busy else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def format_stats(self):
+        now = time.time()
+        lines = [f"🎮 Аккаунтов: {len(self._accounts)}, выдано автоматически {self.allocations}, "
+                 f"освобождено {self.releases}"]
+        per_platform = {}
+        for account_id, record in self._accounts.items():
+            counts = per_platform.setdefault(platform_key(record.get('platform')) or '?', [0, 0])
+            counts[0 if self._is_free(account_id, now) else 1] += 1
+        for platform, (free, busy) in sorted(per_platform.items()):
+            lines.append(f"• {platform}: свободно {free}, занято {busy}")
+        return "\n".join(lines)
+
+    def format_game(self, game_title):
+        """Свободные и занятые аккаунты с игрой (для /accounts <игра>)"""
+        now = time.time()
+        key = game_key(game_title)
+        lines = []
+        for account_id, record in self._accounts.items():
+            if key not in {game_key(title) for title in record.get('games') or {}}:
+                continue
+            busy_until = record.get('busy_until') or 0
+            if busy_until > now:
+                until = time.strftime('%d.%m.%Y %H:%M', time.gmtime(busy_until + 3 * 3600))
+                lines.append(f"• №{record.get('number')} {record.get('platform')} — занят до {until}")
+            else:
+                lines.append(f"• №{record.get('number')} {record.get('platform')} — свободен")
+        return "\n".join(lines)
@@ -0,0 +1,147 @@
+"""Микробенчмарки горячих путей бота.
+
+Запуск: python bench.py [search] [fuzzy] [parser]
+Без аргументов выполняются все бенчмарки. Бот при этом не запускается.
+"""
+import sys
+import time
+import logging
+import warnings
+
+import catalog
+import order_parser
+from search_index import SearchIndex
+
+SEARCH_QUERIES = [
+    'god of war', 'fifa', 'spider-man', 'spider-man (ps5)', 'cyberpunk', 'silent hill f',
+    'ps5', 'mafia', 'call of duty', 'аренда', 'покупка', 'zzz не существует', '+', 'resident evil 4',
+]
+
+
+def _timeit(func, queries, repeats):
+    """Время одного запроса в микросекундах: (среднее, p99)"""
+    samples = []
+    for _ in range(repeats):
+        for query in queries:
+            started = time.perf_counter()
+            func(query)
+            samples.append((time.perf_counter() - started) * 1_000_000)
+    samples.sort()
+    return sum(samples) / len(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def bench_search(repeats=200):
+    cat = catalog.get_catalog() or catalog.load_catalog()
+    df = cat.df
+
+    def pandas_search(query):
+        # Прежний путь search_game: регулярное выражение по заново приведенной к нижнему регистру колонке
+        try:
+            return df[df['Title'].str.lower().str.contains(query.lower(), na=False)].head(25)
+        except Exception:
+            return None
+
+    def index_search(query):
+        return cat.search_index.search(query, limit=25)
+
+    print(f"Поиск по каталогу из {len(cat)} игр, {len(SEARCH_QUERIES)} запросов x {repeats}")
+    for name, func in (('pandas str.contains', pandas_search), ('SearchIndex.search', index_search)):
+        mean_us, p99_us = _timeit(func, SEARCH_QUERIES, repeats)
+        print(f"  {name:<22} среднее {mean_us:9.1f} мкс   p99 {p99_us:9.1f} мкс")
+
+
+FUZZY_QUERIES = [
+    'гта', 'cyberpank', 'киберпанк', 'god of wor', 'gow', 'spidermen', 'silnt hil', 'мафия',
+    'ragnarock', 'resident evel', 'batmen arkham', 'zzzz', 'assasins creed', 'metro exodos',
+]
+
+
+def bench_fuzzy(repeats=100):
+    cat = catalog.get_catalog() or catalog.load_catalog()
+    # Каталог в 10 раз больше: те же названия с разными номерами частей и изданий
+    large_titles = [f"{title} {edition}" for edition in range(10) for title in cat.titles]
+
+    for name, index in (('1x', cat.search_index), ('10x', SearchIndex(large_titles))):
+        size = len(index.normalized)
+        mean_us, p99_us = _timeit(lambda query: index.suggest(query, limit=10), FUZZY_QUERIES, repeats)
+        print(f"Нечеткий поиск, каталог {name} ({size} игр): среднее {mean_us:9.1f} мкс   p99 {p99_us:9.1f} мкс")
+
+
+# Обезличенные тексты заказов и аккаунтов в том виде, в каком их пересылают админы.
+# Правильность разбора проверяют тесты tests/test_order_parser.py, здесь — только время
+ORDER_SAMPLES = [
+    """Заказ №1547382901
+Оплата: Банковская карта
+Состав заказа:
+1. God of War Ragnarök: 1290 (Платформа: PS5, Позиция: П3 7 дн.)
+Сумма: 1290
+Промокод: LETO25
+Скидка: 10
+Информация о покупателе:
+Name: Алексей
+Email: client1@example.com
+Phone: +7 900 000-00-01
+Ник_в_Telegram_или_Вконтакте: @client_one
+Date: 29.07.2025
+Дополнительные данные: Payment ID 0000000001""",
+    """Заказ №2001
+Состав заказа:
+1. Marvel's Spider-Man 2: Deluxe Edition: 990 (Платформа: PS5, П2 14 дн)
+Сумма: 990
+Информация о покупателе:
+Name: Мария
+Phone: +7 900 000-00-02
+Date: 01.08.2025 12:30""",
+    """Новый заказ! Заказ №77
+  2. FIFA 23 (П3 30дн)
+Информация о покупателе:
+name:   Иван П.
+DATE: 2025-08-03""",
+    """Заказ №90210
+1. Silent Hill f: 1490 (Платформа: PS5, П3 30 дн.)
+Информация о покупателе:
+Name:
+Ольга
+Ник_в_Telegram_или_Вконтакте: @client_four
+Date: 05.10.2025""",
+]
+
+ACCOUNT_SAMPLES = [
+    """Аккаунт: 15
+PS5
+mail15@example.com
+Qwerty123
+✅ активация""",
+    """ЛОТ 42 ps4
+почта: lot42@example.ru
+пароль: abc
+Zx9!pass""",
+    """Аккаунт: A-7 PS5
+acc7@example.com Passw0rd""",
+    """Лот 3
+ps4
+secretpass""",
+]
+
+
+def bench_parser(repeats=2000):
+    print(f"Разбор заказов: {len(ORDER_SAMPLES)} заказов, {len(ACCOUNT_SAMPLES)} аккаунтов")
+    for name, func, samples in (('parse_order_info', order_parser.parse_order_info, ORDER_SAMPLES),
+                                ('parse_account_info', order_parser.parse_account_info, ACCOUNT_SAMPLES)):
+        mean_us, p99_us = _timeit(func, samples, repeats)
+        print(f"  {name:<22} среднее {mean_us:9.1f} мкс   p99 {p99_us:9.1f} мкс")
+
+
+BENCHMARKS = {
+    'search': bench_search,
+    'fuzzy': bench_fuzzy,
+    'parser': bench_parser,
+}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    # pandas предупреждает о группах в регулярках из пользовательских запросов
+    warnings.filterwarnings('ignore', category=UserWarning)
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
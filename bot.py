@@ -1,20 +1,27 @@
 import os
 import logging
 import time
-import pandas as pd
-import requests
-from io import BytesIO
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, InputMediaPhoto
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes,
     MessageHandler, filters, ConversationHandler, CallbackQueryHandler
 )
 import firebase_admin
-from firebase_admin import credentials, db
+from firebase_admin import credentials
 from datetime import datetime, timezone, timedelta
 import random
 import re
 import asyncio
+import catalog
+import recommender
+from broadcast import call_with_retries, MessagePayload, BroadcastJob, DeletionJob, MediaCache, ChannelMirror, CHECKPOINT_SIZE, DELETE_WINDOW
+from rental_outbox import RentalOutbox
+from accounts import AccountPool
+from router import Router, Screen
+from rental_reminders import RentalReminders, STAGE_NONE, STAGE_REMINDED
+from order_parser import parse_order_info, parse_account_info, is_order_text, split_account_blocks
+from scheduler import MessageScheduler
+from firebase_repo import FirebaseRepository, WriteBehindBuffer, LibraryCache, generate_push_id
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
@@ -32,131 +39,154 @@ if firebase_json:
 else:
     logging.warning("FIREBASE_CREDENTIALS_JSON не установлен, бот будет работать без Firebase")
 
-GITHUB_RAW_URL = 'https://github.com/chekoli911/AGSGM_BOT/raw/main/store-8370478-Vse_igri-202507290225_fixed.xlsx'
-df = pd.read_excel(BytesIO(requests.get(GITHUB_RAW_URL).content), usecols=['Title', 'Url'])
+# Каталог стартует с локального снимка, свежая версия подтягивается в фоне после запуска.
+# Текущая версия каталога — catalog.get_catalog()
+catalog.load_catalog()
+CATALOG_REFRESH_INTERVAL = int(os.getenv('CATALOG_REFRESH_INTERVAL', 900))  # секунд между проверками
+
+# Все обращения к Firebase из обработчиков идут через пул потоков репозитория
+repo = FirebaseRepository()
+# Лог запросов пишется пачками в фоне, ответ пользователю его не ждет
+write_buffer = WriteBehindBuffer(repo)
+# Отметки пользователей читаются из базы один раз, дальше — из кэша
+library_cache = LibraryCache(repo)
+# Курсоры рекомендаций без повторов: читаются один раз, сохраняются через буфер записи
+advice_streams = recommender.RecommendationStreams(
+    load_cursor=repo.get_advice_cursor,
+    save_cursor=lambda user_id, cursor: write_buffer.put(f'users/{user_id}/advice_cursor', cursor),
+)
+# Картинки рассылок загружаются в Telegram один раз, дальше отправляются по file_id
+media_cache = MediaCache(
+    load_file_id=repo.get_media_file_id,
+    save_file_id=lambda key, record: write_buffer.put(f'media_cache/{key}', record),
+)
 
 CHANNEL_CHAT_ID = -1002773793511  # ID канала для сообщений пользователей
+# Запросы пользователей уходят в канал пачками в фоне, ответ пользователю их не ждет
+channel_mirror = ChannelMirror(CHANNEL_CHAT_ID)
+# Результаты аренды пишутся в локальный outbox и отправляются в базу arenarental в фоне
+rental_outbox = RentalOutbox()
+# Инвентарь аккаунтов: индекс строится при запуске одним чтением accounts, свободный аккаунт
+# под пересланный заказ выдается сразу и сам освобождается по окончании аренды
+account_pool = AccountPool()
 ADMIN_IDS = {5381215134, 6280405854}  # Множество админов
 
 ASKING_IF_WANT_NEW = 1
 WAITING_FOR_ACCOUNT_DATA = 2
 
-# Функции для создания клавиатур
-def get_main_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("🏠 Аренда"), KeyboardButton("🛒 Покупка")],
-        [KeyboardButton("📚 Мои игры"), KeyboardButton("🎮 Во что поиграть?")],
-        [KeyboardButton("⚙️ Функции бота"), KeyboardButton("🆕 Новинки")],
-        [KeyboardButton("❓ Помощь")]
-    ], resize_keyboard=True, is_persistent=True)
-
-def get_search_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔍 Поиск игры", callback_data="search_game")]
-    ])
-
-def get_library_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
-        [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
-        [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_completed_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
-        [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_played_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
-        [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_not_interested_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
-        [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_advice_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔄 Еще совет", callback_data="advice")],
-        [InlineKeyboardButton("✅ Уже играл", callback_data="advice_played")],
-        [InlineKeyboardButton("🏆 Уже прошел", callback_data="advice_completed")],
-        [InlineKeyboardButton("❌ Неинтересно", callback_data="advice_not_interested")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_new_advice_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔄 Еще совет", callback_data="advice")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_rental_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎮 Арендовать игру", callback_data="rent_game")],
-        [InlineKeyboardButton("🎯 Арендовать PS Plus", callback_data="rent_ps_plus")],
-        [InlineKeyboardButton("✅ Продлить аренду профиля", callback_data="extend_rental_profile")],
-        [InlineKeyboardButton("✅ Завершить аренду", callback_data="end_rental")],
-        [InlineKeyboardButton("🔐 Получить код 2FA", callback_data="get_2fa")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_purchase_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎮 Купить игры", callback_data="buy_games")],
-        [InlineKeyboardButton("📱 Купить Подписку", callback_data="buy_subscription")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
-    ])
-
-def get_buy_games_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💰 Купить дешевле", callback_data="buy_cheaper")],
-        [InlineKeyboardButton("💎 Полная покупка", callback_data="buy_full")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="purchase")]
-    ])
-
-def get_buy_full_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔥 Распродажа", callback_data="buy_sale")],
-        [InlineKeyboardButton("🎯 Игра вне распродажи", callback_data="buy_outside_sale")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="buy_games")]
-    ])
-
-def get_buy_subscription_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎮 Купить PS Plus", callback_data="buy_ps_plus")],
-        [InlineKeyboardButton("🎯 Купить EA Play", callback_data="buy_ea_play")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="purchase")]
-    ])
-
-def get_end_rental_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("⏰ Закончился срок", callback_data="rental_expired")],
-        [InlineKeyboardButton("📤 Сдать игру досрочно", callback_data="early_return")],
-        [InlineKeyboardButton("💳 Продлить игру со скидкой", callback_data="extend_rental")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="rental")]
-    ])
-
-def get_console_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎮 У меня PS4", callback_data="ps4_guide")],
-        [InlineKeyboardButton("🎮 У меня PS5", callback_data="ps5_guide")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="end_rental")]
-    ])
-
-def get_early_return_confirm_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Понял(а)", callback_data="early_return_confirm")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="end_rental")]
-    ])
+SEARCH_RESULTS_LIMIT = 50  # сколько совпадений запоминаем для пролистывания
+NEW_RELEASES_COUNT = 25
+RESULTS_PAGE_SIZE = 10
+MAX_MESSAGE_LENGTH = 4096  # лимит Telegram на длину сообщения
+
+# Клавиатуры собираются один раз при импорте (объекты Telegram неизменяемы)
+MAIN_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("🏠 Аренда"), KeyboardButton("🛒 Покупка")],
+    [KeyboardButton("📚 Мои игры"), KeyboardButton("🎮 Во что поиграть?")],
+    [KeyboardButton("⚙️ Функции бота"), KeyboardButton("🆕 Новинки")],
+    [KeyboardButton("❓ Помощь")]
+], resize_keyboard=True, is_persistent=True)
+
+SEARCH_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔍 Поиск игры", callback_data="search_game")]
+])
+
+LIBRARY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
+    [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
+    [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+COMPLETED_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
+    [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+PLAYED_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
+    [InlineKeyboardButton("❌ Неинтересные игры", callback_data="not_interested")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+NOT_INTERESTED_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎯 Сыгранные игры", callback_data="played")],
+    [InlineKeyboardButton("✅ Пройденные игры", callback_data="completed")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+ADVICE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Еще совет", callback_data="advice")],
+    [InlineKeyboardButton("✅ Уже играл", callback_data="advice_played")],
+    [InlineKeyboardButton("🏆 Уже прошел", callback_data="advice_completed")],
+    [InlineKeyboardButton("❌ Неинтересно", callback_data="advice_not_interested")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+NEW_ADVICE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Еще совет", callback_data="advice")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+RENTAL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Арендовать игру", callback_data="rent_game")],
+    [InlineKeyboardButton("🎯 Арендовать PS Plus", callback_data="rent_ps_plus")],
+    [InlineKeyboardButton("✅ Продлить аренду профиля", callback_data="extend_rental_profile")],
+    [InlineKeyboardButton("✅ Завершить аренду", callback_data="end_rental")],
+    [InlineKeyboardButton("🔐 Получить код 2FA", callback_data="get_2fa")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+PURCHASE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Купить игры", callback_data="buy_games")],
+    [InlineKeyboardButton("📱 Купить Подписку", callback_data="buy_subscription")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_main")]
+])
+
+BUY_GAMES_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Купить дешевле", callback_data="buy_cheaper")],
+    [InlineKeyboardButton("💎 Полная покупка", callback_data="buy_full")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="purchase")]
+])
+
+BUY_FULL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔥 Распродажа", callback_data="buy_sale")],
+    [InlineKeyboardButton("🎯 Игра вне распродажи", callback_data="buy_outside_sale")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="buy_games")]
+])
+
+BUY_SUBSCRIPTION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 Купить PS Plus", callback_data="buy_ps_plus")],
+    [InlineKeyboardButton("🎯 Купить EA Play", callback_data="buy_ea_play")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="purchase")]
+])
+
+END_RENTAL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏰ Закончился срок", callback_data="rental_expired")],
+    [InlineKeyboardButton("📤 Сдать игру досрочно", callback_data="early_return")],
+    [InlineKeyboardButton("💳 Продлить игру со скидкой", callback_data="extend_rental")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="rental")]
+])
+
+CONSOLE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎮 У меня PS4", callback_data="ps4_guide")],
+    [InlineKeyboardButton("🎮 У меня PS5", callback_data="ps5_guide")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="end_rental")]
+])
+
+EARLY_RETURN_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Понял(а)", callback_data="early_return_confirm")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="end_rental")]
+])
+
+# Инструкция по сдаче игры: кнопка «Закончился срок» и уведомление об окончании аренды
+RENTAL_EXPIRED_TEXT = (
+    "📌 **Важно!** Если при деактивации или выключении общего доступа вы видите QR-код и запрос на вход в сеть – это значит, что консоль или аккаунт были офлайн.\n\n"
+    "✅ В таком случае сначала подключитесь к интернету и войдите в аккаунт, а потом повторите процедуру деактивации.\n"
+    "❌ Просто удалить аккаунт с консоли недостаточно – это может привести к проблемам с системой и консолью!\n\n"
+    "**Как правильно сдать игру?**"
+)
 
 advice_texts = [
     "Вот отличный вариант для твоего досуга:",
@@ -188,19 +218,23 @@ passed_triggers = ['пройденные', 'пройденное', 'пройде
 played_triggers = ['уже играл', 'сыграл', 'played']
 not_interested_triggers = ['неинтересно', 'не интересно', 'неинтересные игры']
 
-def add_game_mark(user_id: int, game_title: str, mark_type: str):
-    ref = db.reference(f'users/{user_id}/{mark_type}')
-    ref.update({game_title: True})
+# Игры с этими отметками не попадают в рекомендации
+EXCLUDED_MARK_TYPES = ('completed_games', 'played_games', 'not_interested_games')
+
+async def add_game_mark(user_id: int, game_title: str, mark_type: str):
+    write_buffer.put(f'subscribers/{user_id}', True)
+    await library_cache.add(user_id, game_title, mark_type)
 
-def get_marked_games(user_id: int, mark_type: str):
-    ref = db.reference(f'users/{user_id}/{mark_type}')
-    data = ref.get()
-    return list(data.keys()) if data else []
+async def get_marked_games(user_id: int, mark_type: str):
+    return await library_cache.get(user_id, mark_type)
 
 def log_user_query(user_id: int, username: str, query: str):
-    ref = db.reference(f'users/{user_id}/queries')
     now_iso = datetime.now(timezone.utc).isoformat()
-    ref.push({
+    write_buffer.put(f'subscribers/{user_id}', True)
+    if username and username != "no_username":
+        # Индекс ника: по нику из заказа находим клиента для напоминаний об аренде
+        write_buffer.put(f'usernames/{username.lower()}', user_id)
+    write_buffer.put(f'users/{user_id}/queries/{generate_push_id()}', {
         'query': query,
         'timestamp': now_iso,
         'username': username
@@ -211,21 +245,127 @@ def normalize_text(text):
     text = re.sub(r'[?]+', '', text)
     return text
 
-def pick_random_game(exclude_titles=set()):
-    available = df[~df['Title'].isin(exclude_titles)]
-    if available.empty:
+async def get_excluded_rows(user_id: int, cat):
+    """Номера строк каталога, которые пользователь отметил как пройденные, сыгранные или неинтересные"""
+    marked = await asyncio.gather(*(get_marked_games(user_id, mark_type) for mark_type in EXCLUDED_MARK_TYPES))
+    excluded_rows = set()
+    for titles in marked:
+        excluded_rows |= cat.rows_for_titles(titles)
+    return excluded_rows
+
+async def pick_random_game(user_id: int, cat, excluded_rows=frozenset()):
+    """Следующая игра из персонального потока рекомендаций (без повторов)"""
+    row = await advice_streams.next_row(user_id, cat, excluded_rows)
+    if row is None:
         return None, None
-    row = available.sample(1).iloc[0]
-    return row['Title'], row['Url']
+    return cat.titles[row], cat.urls[row]
+
+def split_message(parts, separator='\n\n', limit=MAX_MESSAGE_LENGTH):
+    """Склеивает части в минимальное число сообщений, не превышая лимит Telegram"""
+    messages = []
+    current = ''
+    for part in parts:
+        part = part[:limit]
+        candidate = f"{current}{separator}{part}" if current else part
+        if len(candidate) > limit:
+            messages.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+def render_results_page(cat, results, offset):
+    """Страница результатов: тексты сообщений и кнопки пролистывания"""
+    rows = results['rows']
+    page = rows[offset:offset + RESULTS_PAGE_SIZE]
+    header = results['title']
+    if len(rows) > RESULTS_PAGE_SIZE:
+        header += f"\n{offset + 1}–{offset + len(page)} из {len(rows)}"
+    messages = split_message([header] + [cat.entries[row] for row in page])
 
-async def notify_channel(app, text: str):
-    # Отправка сообщений пользователей в канал
-    await app.bot.send_message(chat_id=CHANNEL_CHAT_ID, text=text)
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"results:{max(0, offset - RESULTS_PAGE_SIZE)}"))
+    next_offset = offset + RESULTS_PAGE_SIZE
+    if next_offset < len(rows):
+        next_count = min(RESULTS_PAGE_SIZE, len(rows) - next_offset)
+        buttons.append(InlineKeyboardButton(f"Следующие {next_count} ▶️", callback_data=f"results:{next_offset}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return messages, reply_markup
+
+async def send_results(update: Update, context: ContextTypes.DEFAULT_TYPE, cat, rows, title):
+    """Отправляет найденные игры одним сообщением (или несколькими в пределах лимита) с пролистыванием"""
+    results = {'rows': rows, 'version': cat.version, 'title': title}
+    context.user_data['results'] = results
+    await show_results_page(update, context, cat, results, 0)
+
+async def show_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE, cat, results, offset):
+    messages, reply_markup = render_results_page(cat, results, offset)
+    query = update.callback_query
+    for i, text in enumerate(messages):
+        markup = reply_markup if i == len(messages) - 1 else None
+        if query and i == 0:
+            await query.edit_message_text(text, reply_markup=markup, disable_web_page_preview=True)
+        elif query:
+            await query.message.reply_text(text, reply_markup=markup, disable_web_page_preview=True)
+        else:
+            await update.message.reply_text(text, reply_markup=markup, disable_web_page_preview=True)
+
+async def results_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, offset: int):
+    cat = catalog.get_catalog()
+    results = context.user_data.get('results')
+    if not results or results['version'] != cat.version:
+        # Каталог обновился — номера строк из старой выдачи больше не действительны
+        await update.callback_query.edit_message_text("Результаты устарели, повтори поиск.")
+        return
+    await show_results_page(update, context, cat, results, offset)
+
+def notify_channel(text: str):
+    # Отправка сообщений пользователей в канал (через очередь, пачками)
+    channel_mirror.put(text)
 
 async def notify_admin(app, text: str):
-    # Отправка операционных сообщений всем админам
-    for admin_id in ADMIN_IDS:
-        await app.bot.send_message(chat_id=admin_id, text=text)
+    # Отправка операционных сообщений всем админам параллельно, ошибка у одного не мешает остальным
+    admin_ids = list(ADMIN_IDS)
+    results = await asyncio.gather(
+        *(app.bot.send_message(chat_id=admin_id, text=text) for admin_id in admin_ids),
+        return_exceptions=True
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            logging.error(f"Не удалось отправить уведомление админу {admin_id}: {result}")
+
+# Частые однотипные уведомления копятся и уходят одной сводкой за окно
+ADMIN_DIGEST_WINDOW = 60  # секунд
+ADMIN_DIGEST_MAX_LINES = 20
+admin_digest = {}  # заголовок сводки -> [(полный текст, строка сводки)]
+
+def notify_admin_digest(title: str, text: str, line: str):
+    """Добавляет уведомление в сводку. Если за окно оно окажется единственным, уйдет как text"""
+    admin_digest.setdefault(title, []).append((text, line))
+
+async def flush_admin_digest(app):
+    entries = list(admin_digest.items())
+    admin_digest.clear()
+    for title, items in entries:
+        if len(items) == 1:
+            await notify_admin(app, items[0][0])
+            continue
+        lines = [f"{title}: {len(items)}"]
+        lines += [f"• {line}" for _, line in items[:ADMIN_DIGEST_MAX_LINES]]
+        if len(items) > ADMIN_DIGEST_MAX_LINES:
+            lines.append(f"…и еще {len(items) - ADMIN_DIGEST_MAX_LINES}")
+        await notify_admin(app, "\n".join(lines))
+
+async def admin_digest_worker(app):
+    while True:
+        await asyncio.sleep(ADMIN_DIGEST_WINDOW)
+        try:
+            await flush_admin_digest(app)
+        except Exception as e:
+            logging.error(f"Ошибка отправки сводки админам: {e}")
 
 async def greet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.info(f"Пользователь {update.effective_user.id} поздоровался")
@@ -237,7 +377,7 @@ async def greet(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📚 Хранить твою библиотеку пройденных и сыгранных игр, чтобы не советовать их повторно\n"
         "🆕 Показывать последние новинки — их всегда можно арендовать у нас!\n\n"
         "Выбери действие или напиши любое название игры:",
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
 
 async def send_advice(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -245,13 +385,14 @@ async def send_advice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or "no_username"
     log_user_query(user_id, username, "requested advice")
 
-    completed_games = set(get_marked_games(user_id, 'completed_games'))
-    title, url = pick_random_game(exclude_titles=completed_games)
+    cat = catalog.get_catalog()
+    excluded_rows = await get_excluded_rows(user_id, cat)
+    title, url = await pick_random_game(user_id, cat, excluded_rows)
     if not title:
         if update.callback_query:
-            await update.callback_query.edit_message_text("Все игры из базы у вас уже пройдены!", reply_markup=get_main_keyboard())
+            await update.callback_query.edit_message_text("Все игры из базы у вас уже отмечены!")
         else:
-            await update.message.reply_text("Все игры из базы у вас уже пройдены!")
+            await update.message.reply_text("Все игры из базы у вас уже отмечены!")
         return ConversationHandler.END
 
     advice = random.choice(advice_texts)
@@ -259,64 +400,57 @@ async def send_advice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = f"{advice}\n{title}\n{url}\n\nЧто думаешь об этой игре?"
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(msg, reply_markup=get_advice_keyboard())
+        await update.callback_query.edit_message_text(msg, reply_markup=ADVICE_KEYBOARD)
     else:
-        await update.message.reply_text(msg, reply_markup=get_advice_keyboard())
+        await update.message.reply_text(msg, reply_markup=ADVICE_KEYBOARD)
     return ASKING_IF_WANT_NEW
 
 async def passed_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    completed = get_marked_games(user_id, 'completed_games')
+    completed = await get_marked_games(user_id, 'completed_games')
     if completed:
         response = "✅ **Пройденные игры:**\n\n" + "\n".join(f"• {game}" for game in completed)
     else:
         response = "Вы пока не отметили ни одной пройденной игры."
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(response, reply_markup=get_completed_keyboard())
+        await update.callback_query.edit_message_text(response, reply_markup=COMPLETED_KEYBOARD)
     else:
-        await update.message.reply_text(response, reply_markup=get_completed_keyboard())
+        await update.message.reply_text(response, reply_markup=COMPLETED_KEYBOARD)
 
 async def played_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    played = get_marked_games(user_id, 'played_games')
+    played = await get_marked_games(user_id, 'played_games')
     if played:
         response = "🎯 **Сыгранные игры:**\n\n" + "\n".join(f"• {game}" for game in played)
     else:
         response = "Вы пока не отметили ни одной игры как сыгранной."
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(response, reply_markup=get_played_keyboard())
+        await update.callback_query.edit_message_text(response, reply_markup=PLAYED_KEYBOARD)
     else:
-        await update.message.reply_text(response, reply_markup=get_played_keyboard())
+        await update.message.reply_text(response, reply_markup=PLAYED_KEYBOARD)
 
 async def not_interested_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    not_interested = get_marked_games(user_id, 'not_interested_games')
+    not_interested = await get_marked_games(user_id, 'not_interested_games')
     if not_interested:
         response = "❌ **Неинтересные игры:**\n\n" + "\n".join(f"• {game}" for game in not_interested)
     else:
         response = "Вы пока не отметили ни одной игры как неинтересную."
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(response, reply_markup=get_not_interested_keyboard())
+        await update.callback_query.edit_message_text(response, reply_markup=NOT_INTERESTED_KEYBOARD)
     else:
-        await update.message.reply_text(response, reply_markup=get_not_interested_keyboard())
+        await update.message.reply_text(response, reply_markup=NOT_INTERESTED_KEYBOARD)
 
 async def whattoplay_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await send_advice(update, context)
 
 async def new_releases_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    last_25 = df.tail(25)
-    messages = [f"{row['Title']}\n{row['Url']}" for _, row in last_25.iterrows()]
-    
-    if update.callback_query:
-        await update.callback_query.edit_message_text("🆕 **Последние новинки:**\n\nОтправляю список...")
-        for msg in messages:
-            await update.callback_query.message.reply_text(msg)
-    else:
-        for msg in messages:
-            await update.message.reply_text(msg)
+    cat = catalog.get_catalog()
+    rows = list(range(max(0, len(cat) - NEW_RELEASES_COUNT), len(cat)))
+    await send_results(update, context, cat, rows, "🆕 **Последние новинки:**")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -329,80 +463,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📚 Хранить твою библиотеку пройденных и сыгранных игр, чтобы не советовать их повторно\n"
         "🆕 Показывать последние новинки — их всегда можно арендовать у нас!\n\n"
         "Выбери действие или напиши любое название игры:",
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KEYBOARD
     )
 
 async def handle_button_press(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на закрепленные кнопки"""
-    text = update.message.text
-    user_id = update.effective_user.id
-    
-    if text == "🆕 Новинки":
-        await new_releases_command(update, context)
-    elif text == "🎮 Во что поиграть?":
-        context.user_data['last_recommended_game'] = None
-        await send_advice(update, context)
-    elif text == "📚 Мои игры":
-        await update.message.reply_text(
-            "📚 **Моя библиотека игр**\n\nВыбери категорию:",
-            reply_markup=get_library_keyboard()
-        )
-    elif text == "❓ Помощь":
-        await update.message.reply_text(
-            "❓ **Помощь:**\n\n"
-            "🎮 **Во что поиграть?** - получить персональную рекомендацию игры\n"
-            "🆕 **Новинки** - показать последние 25 игр\n"
-            "📚 **Мои игры** - посмотреть пройденные, сыгранные и неинтересные игры\n"
-            "🏠 **Аренда** - аренда игр, PS Plus, продление аренды\n"
-            "🛒 **Покупка** - купить игры и подписки навсегда\n"
-            "⚙️ **Функции бота** - описание всех возможностей\n\n"
-            "💡 **Советы по использованию:**\n"
-            "• Напиши название игры для поиска\n"
-            "• Используй кнопки для быстрой навигации\n"
-            "• Отмечай игры, чтобы получать более точные рекомендации\n"
-            "• В разделе 'Аренда' можно продлить игру промокодом ARENALOVE\n"
-            "• В разделе 'Покупка' можно купить игры дешевле или навсегда\n\n"
-            "🔗 **Полезные ссылки:**\n"
-            "• Купить навсегда: https://arenapsgm.ru/P2P3\n"
-            "• Группа покупки: @StorePSGM\n"
-            "• Группа аренды: @ArenaPSGMrent\n"
-            "• По вопросам: @ArenaPSGMadmin"
-        )
-    elif text == "⚙️ Функции бота":
-        await update.message.reply_text(
-            "Привет! 👋\n"
-            "Я помогу найти игры для PlayStation: просто напиши название игры или её часть, и я пришлю ссылку на аренду или покупку.\n"
-            "Кроме того, я могу:\n"
-            "🎮 Посоветовать интересные игры, если не знаешь, во что поиграть\n"
-            "📚 Хранить твою библиотеку пройденных и сыгранных игр, чтобы не советовать их повторно\n"
-            "🆕 Показывать последние новинки — их всегда можно арендовать у нас!\n\n"
-            "Выбери действие или напиши любое название игры:"
-        )
-    elif text == "🏠 Аренда":
-        await update.message.reply_text(
-            "🏠 **Аренда игр**\n\nВыбери действие:",
-            reply_markup=get_rental_keyboard()
-        )
-    elif text == "🛒 Покупка":
-        await update.message.reply_text(
-            "🛒 **Покупка игр**\n\nВыбери категорию:",
-            reply_markup=get_purchase_keyboard()
-        )
-    else:
-        # Если это не кнопка, обрабатываем как поиск игры
-        await search_game(update, context)
+    await button_router.dispatch(update.message.text, update, context)
 
 async def search_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     username = update.effective_user.username or "no_username"
     raw_text = update.message.text
     text = normalize_text(raw_text)
+    cat = catalog.get_catalog()
 
     logging.info(f"Получено сообщение: {raw_text} от пользователя {user_id} (@{username})")
     log_user_query(user_id, username, raw_text.lower())
 
     # Отправляем текст запроса пользователя в канал
-    await notify_channel(context.application, f"Пользователь {user_id} (@{username}) написал запрос:\n{raw_text}")
+    notify_channel(f"Пользователь {user_id} (@{username}) написал запрос:\n{raw_text}")
 
     if text == 'пока':
         await update.message.reply_text(
@@ -453,15 +532,15 @@ async def search_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if last_game:
         if text == 'неинтересно':
-            add_game_mark(user_id, last_game, 'not_interested_games')
+            await add_game_mark(user_id, last_game, 'not_interested_games')
             await update.message.reply_text("Понял, отмечаю эту игру как неинтересную. Вот новая рекомендация:")
             return await send_advice(update, context)
         elif text in ['уже играл', 'играл']:
-            add_game_mark(user_id, last_game, 'played_games')
+            await add_game_mark(user_id, last_game, 'played_games')
             await update.message.reply_text("Отлично, отметил как сыгранную. Вот новая рекомендация:")
             return await send_advice(update, context)
         elif text == 'уже прошел':
-            add_game_mark(user_id, last_game, 'completed_games')
+            await add_game_mark(user_id, last_game, 'completed_games')
             await update.message.reply_text("Отлично, отметил как пройденную. Вот новая рекомендация:")
             return await send_advice(update, context)
 
@@ -479,13 +558,14 @@ async def search_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await update.message.reply_text(f"Пожалуйста, укажи название игры после слова '{keyword}'.")
                     return ConversationHandler.END
 
-                results = df[df['Title'].str.lower().str.startswith(game_title)]
-                if results.empty:
+                rows = cat.search_index.prefix(game_title)
+                if not rows:
                     await update.message.reply_text("Игра не найдена в базе. Проверь правильность написания.")
                     return ConversationHandler.END
 
-                add_game_mark(user_id, results.iloc[0]['Title'], mark_type)
-                await update.message.reply_text(f"Игра '{results.iloc[0]['Title']}' отмечена как {mark_type.replace('_', ' ')}.")
+                found_title = cat.titles[rows[0]]
+                await add_game_mark(user_id, found_title, mark_type)
+                await update.message.reply_text(f"Игра '{found_title}' отмечена как {mark_type.replace('_', ' ')}.")
                 return ConversationHandler.END
 
     if text in ['да', 'конечно', 'давай']:
@@ -503,13 +583,19 @@ async def search_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Отлично. Спасибо, что написал. Я буду здесь, если понадоблюсь.")
         return ConversationHandler.END
 
-    results = df[df['Title'].str.lower().str.contains(text, na=False)]
-    if results.empty:
-        await update.message.reply_text("Игра не найдена, попробуй другое название.")
-        return ConversationHandler.END
+    # Индекс все равно собирает все совпадения, поэтому общее число берется до обрезки
+    rows = cat.search_index.search(text)
+    title = f"🔍 Найдено игр: {len(rows)}"
+    rows = rows[:SEARCH_RESULTS_LIMIT]
+    if not rows:
+        # Точных совпадений нет — пробуем найти похожие названия (опечатки, транслит)
+        rows = cat.search_index.suggest(text, limit=RESULTS_PAGE_SIZE)
+        if not rows:
+            await update.message.reply_text("Игра не найдена, попробуй другое название.")
+            return ConversationHandler.END
+        title = "Точного совпадения нет, возможно, ты имел в виду:"
 
-    for _, row in results.head(25).iterrows():
-        await update.message.reply_text(f"{row['Title']}\n{row['Url']}")
+    await send_results(update, context, cat, rows, title)
 
     return ConversationHandler.END
 
@@ -532,69 +618,15 @@ async def sendto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Неверный формат user_id. Он должен быть числом.")
         return
 
-    message_text = " ".join(args[1:])
-    photo_url = None
-    buttons = []
-    
-    # Сначала парсим кнопки в формате [Текст|URL] или [Текст|callback]
-    import re
-    button_pattern = r'\[([^\]]+)\|([^\]]+)\]'
-    button_matches = re.findall(button_pattern, message_text)
-    
-    for button_text, button_data in button_matches:
-        if button_data.startswith('http'):
-            # URL кнопка
-            buttons.append(InlineKeyboardButton(button_text, url=button_data))
-        else:
-            # Callback кнопка
-            buttons.append(InlineKeyboardButton(button_text, callback_data=button_data))
-    
-    # Убираем кнопки из текста сообщения
-    message_text = re.sub(button_pattern, '', message_text).strip()
-    message_text = re.sub(r'\s+', ' ', message_text)
-    
-    # Теперь ищем URL фото (ищем все URL и берем первый, который не является кнопкой)
-    url_pattern = r'https?://[^\s]+'
-    all_urls = re.findall(url_pattern, message_text)
-    
-    # Получаем URL кнопок
-    button_urls = [button.url for button in buttons if hasattr(button, 'url') and button.url]
-    
-    # Ищем URL фото (первый URL, который не является кнопкой)
-    for url in all_urls:
-        if url not in button_urls:
-            photo_url = url
-            break
-    
-    # Убираем URL фото из текста сообщения
-    if photo_url:
-        message_text = re.sub(re.escape(photo_url), '', message_text).strip()
-        # Убираем лишние пробелы
-        message_text = re.sub(r'\s+', ' ', message_text)
-    
-    # Создаем клавиатуру если есть кнопки
-    reply_markup = None
-    if buttons:
-        # Размещаем кнопки по одной в ряд
-        keyboard = [[button] for button in buttons]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Разбираем кнопки в формате [Текст|URL] или [Текст|callback] и URL фото
+    payload = MessagePayload.parse(" ".join(args[1:]))
 
     try:
-        if photo_url:
-            await context.application.bot.send_photo(
-                chat_id=target_user_id, 
-                photo=photo_url, 
-                caption=message_text,
-                reply_markup=reply_markup
-            )
+        await payload.send(context.application.bot, target_user_id, payload.reply_markup(), media_cache)
+        if payload.photo_url:
             await update.message.reply_text(f"Сообщение с фото и кнопками успешно отправлено пользователю {target_user_id}.")
             await notify_admin(context.application, f"✅ Сообщение с фото и кнопками отправлено пользователю {target_user_id} админом {user_id}.")
         else:
-            await context.application.bot.send_message(
-                chat_id=target_user_id, 
-                text=message_text,
-                reply_markup=reply_markup
-            )
             await update.message.reply_text(f"Сообщение с кнопками успешно отправлено пользователю {target_user_id}.")
             await notify_admin(context.application, f"✅ Сообщение с кнопками отправлено пользователю {target_user_id} админом {user_id}.")
     except Exception as e:
@@ -613,127 +645,215 @@ async def sendtoall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Примеры кнопок:\n• [Кнопка1|url1] [Кнопка2|url2]\n• [Кнопка1|callback1] [Кнопка2|callback2]")
         return
 
-    message_text = " ".join(args)
-    photo_url = None
-    buttons = []
-    
-    # Сначала парсим кнопки в формате [Текст|URL] или [Текст|callback]
-    import re
-    button_pattern = r'\[([^\]]+)\|([^\]]+)\]'
-    button_matches = re.findall(button_pattern, message_text)
-    
-    for button_text, button_data in button_matches:
-        if button_data.startswith('http'):
-            # URL кнопка
-            buttons.append(InlineKeyboardButton(button_text, url=button_data))
+    # Разбираем кнопки в формате [Текст|URL] или [Текст|callback] и URL фото
+    payload = MessagePayload.parse(" ".join(args))
+
+    # Рассылка — durable-задача: запись о ней создается до первой отправки, прогресс
+    # сохраняется после каждой страницы получателей, после перезапуска бот продолжит с нее
+    status_message = await update.message.reply_text("📤 Рассылка запущена.")
+    broadcast_id = generate_push_id()
+    job_state = {
+        **payload.to_dict(),
+        'admin_id': user_id,
+        'timestamp': int(time.time()),
+        'status_chat_id': status_message.chat_id,
+        'cursor': None,
+        'sent_count': 0,
+        'failed_count': 0,
+    }
+    try:
+        await repo.update_paths({
+            f'broadcast_jobs/{broadcast_id}': job_state,
+            f'broadcast_summaries/{user_id}/{broadcast_id}': {
+                'admin_id': user_id,
+                'timestamp': job_state['timestamp'],
+                'message_text': payload.text,
+                'photo_url': payload.photo_url,
+                'has_buttons': bool(payload.buttons),
+                'status': 'running',
+                'sent_count': 0,
+                'failed_count': 0,
+            },
+        })
+    except Exception as e:
+        await status_message.reply_text(f"Ошибка при массовой рассылке: {e}")
+        return
+
+    start_broadcast_task(context.application, broadcast_id, job_state, status_message)
+
+# Фоновые задачи рассылок. Создаются через asyncio, а не app.create_task, чтобы остановка бота
+# не ждала конца рассылки: задачи отменяются, продолжение — с последней контрольной точки
+broadcast_tasks = set()
+# После ошибки рассылка перезапускается с контрольной точки с растущей паузой,
+# а если ошибки не прекращаются — приостанавливается до /resumebroadcast
+BROADCAST_MAX_RESTARTS = 3
+BROADCAST_RESTART_DELAY = 30  # секунд перед первым перезапуском
+
+def start_broadcast_task(app, broadcast_id: str, job_state: dict, status_message, restarts: int = 0):
+    payload = MessagePayload.from_dict(job_state)
+    # Курсор — последний ключ страницы в серверном порядке (firebase_key_order) в исходном виде,
+    # а не id после int(): контрольная точка страницы сохраняется до чтения следующей
+    cursor = {'key': job_state.get('cursor')}
+
+    async def subscriber_pages():
+        async for keys in repo.iter_subscriber_pages(cursor['key'], CHECKPOINT_SIZE):
+            cursor['key'] = keys[-1]
+            yield [int(user_id_key) for user_id_key in keys]
+
+    pages = subscriber_pages()
+
+    summary_path = f'broadcast_summaries/{job_state["admin_id"]}/{broadcast_id}'
+
+    async def checkpoint(job, last_recipient, sent_to):
+        # Одна multi-path запись: новые получатели, курсор и счетчики
+        updates = {
+            f'broadcast_recipients/{broadcast_id}/{entry["user_id"]}': entry['message_id'] for entry in sent_to
+        }
+        updates[f'broadcast_jobs/{broadcast_id}/cursor'] = cursor['key']
+        for counter in ('sent_count', 'failed_count'):
+            updates[f'broadcast_jobs/{broadcast_id}/{counter}'] = getattr(job, counter)
+            updates[f'{summary_path}/{counter}'] = getattr(job, counter)
+        await repo.update_paths(updates)
+
+    job = BroadcastJob(app.bot, payload, pages, status_message, media_cache, checkpoint,
+                       sent_count=job_state.get('sent_count', 0), failed_count=job_state.get('failed_count', 0))
+    task = asyncio.create_task(run_broadcast(app, job, job_state['admin_id'], broadcast_id, restarts))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
+
+async def run_broadcast(app, job: BroadcastJob, admin_id: int, broadcast_id: str, restarts: int = 0):
+    """Выполняет рассылку и отмечает ее завершенной"""
+    payload = job.payload
+    try:
+        await job.run()
+    except asyncio.CancelledError:
+        logging.info(f"Рассылка {broadcast_id} прервана, продолжится после перезапуска")
+        raise
+    except Exception as e:
+        logging.error(f"Ошибка при массовой рассылке {broadcast_id}: {e}")
+        await restart_broadcast(app, job, admin_id, broadcast_id, restarts, e)
+        return
+
+    sent_count = job.sent_count
+    failed_count = job.failed_count
+    try:
+        summary_path = f'broadcast_summaries/{admin_id}/{broadcast_id}'
+        await repo.update_paths({
+            f'broadcast_jobs/{broadcast_id}': None,
+            f'{summary_path}/status': 'done',
+            f'{summary_path}/sent_count': sent_count,
+            f'{summary_path}/failed_count': failed_count,
+        })
+        logging.info(f"Рассылка {broadcast_id} завершена")
+    except Exception as e:
+        logging.error(f"Ошибка сохранения информации о рассылке: {e}")
+
+    if sent_count + failed_count == 0:
+        await job.status_message.reply_text("Пользователи не найдены в базе данных.")
+        return
+
+    # Формируем сообщение о результате
+    result_message = f"Сообщение отправлено {sent_count} пользователям. Ошибок: {failed_count}."
+    if payload.photo_url and payload.buttons:
+        result_message = f"Сообщение с фото и кнопками отправлено {sent_count} пользователям. Ошибок: {failed_count}."
+    elif payload.photo_url:
+        result_message = f"Сообщение с фото отправлено {sent_count} пользователям. Ошибок: {failed_count}."
+    elif payload.buttons:
+        result_message = f"Сообщение с кнопками отправлено {sent_count} пользователям. Ошибок: {failed_count}."
+
+    await job.status_message.reply_text(f"{result_message}\nID рассылки: {broadcast_id}")
+    await notify_admin(app, f"✅ Массовая рассылка выполнена админом {admin_id}. Отправлено: {sent_count}, ошибок: {failed_count}.")
+
+async def restart_broadcast(app, job: BroadcastJob, admin_id: int, broadcast_id: str, restarts: int, error):
+    """Перезапускает упавшую рассылку с контрольной точки или приостанавливает ее"""
+    if restarts < BROADCAST_MAX_RESTARTS:
+        delay = BROADCAST_RESTART_DELAY * 2 ** restarts
+        await job.status_message.reply_text(
+            f"Ошибка при массовой рассылке: {error}\nПовторная попытка через {delay} с."
+        )
+        await asyncio.sleep(delay)
+        try:
+            job_state = await repo.get_broadcast_job(broadcast_id)
+        except Exception as e:
+            logging.error(f"Не удалось прочитать состояние рассылки {broadcast_id}: {e}")
         else:
-            # Callback кнопка
-            buttons.append(InlineKeyboardButton(button_text, callback_data=button_data))
-    
-    # Убираем кнопки из текста сообщения
-    message_text = re.sub(button_pattern, '', message_text).strip()
-    message_text = re.sub(r'\s+', ' ', message_text)
-    
-    # Теперь ищем URL фото (ищем все URL и берем первый, который не является кнопкой)
-    url_pattern = r'https?://[^\s]+'
-    all_urls = re.findall(url_pattern, message_text)
-    
-    # Получаем URL кнопок
-    button_urls = [button.url for button in buttons if hasattr(button, 'url') and button.url]
-    
-    # Ищем URL фото (первый URL, который не является кнопкой)
-    for url in all_urls:
-        if url not in button_urls:
-            photo_url = url
-            break
-    
-    # Убираем URL фото из текста сообщения
-    if photo_url:
-        message_text = re.sub(re.escape(photo_url), '', message_text).strip()
-        # Убираем лишние пробелы
-        message_text = re.sub(r'\s+', ' ', message_text)
-    
-    # Создаем клавиатуру если есть кнопки
-    reply_markup = None
-    if buttons:
-        # Размещаем кнопки по одной в ряд
-        keyboard = [[button] for button in buttons]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+            if job_state:
+                start_broadcast_task(app, broadcast_id, job_state, job.status_message, restarts + 1)
+                return
 
+    summary_path = f'broadcast_summaries/{admin_id}/{broadcast_id}'
     try:
-        # Получаем список всех пользователей из Firebase
-        ref = db.reference('users')
-        users = ref.get()
-        
-        if not users:
-            await update.message.reply_text("Пользователи не найдены в базе данных.")
-            return
+        await repo.update_paths({
+            f'broadcast_jobs/{broadcast_id}/status': 'paused',
+            f'{summary_path}/status': 'paused',
+        })
+    except Exception as e:
+        logging.error(f"Не удалось приостановить рассылку {broadcast_id}: {e}")
+    await job.status_message.reply_text(
+        f"⏸️ Рассылка {broadcast_id} приостановлена после ошибок: {error}\n"
+        f"Уже отправлено: {job.sent_count}.\n"
+        f"Продолжить: /resumebroadcast {broadcast_id}\n"
+        f"Удалить отправленное: /deletebroadcast {broadcast_id}"
+    )
 
-        sent_count = 0
-        failed_count = 0
-        
-        # Сохраняем информацию о рассылке для возможности удаления
-        broadcast_info = {
-            'admin_id': user_id,
-            'timestamp': int(time.time()),
-            'message_text': message_text,
-            'photo_url': photo_url,
-            'has_buttons': bool(buttons),
-            'sent_to': []
-        }
-        
-        for user_id_key in users.keys():
-            try:
-                target_user_id = int(user_id_key)
-                if photo_url:
-                    sent_message = await context.application.bot.send_photo(
-                        chat_id=target_user_id, 
-                        photo=photo_url, 
-                        caption=message_text,
-                        reply_markup=reply_markup
-                    )
-                else:
-                    sent_message = await context.application.bot.send_message(
-                        chat_id=target_user_id, 
-                        text=message_text,
-                        reply_markup=reply_markup
-                    )
-                
-                # Сохраняем информацию о сообщении для возможности удаления
-                broadcast_info['sent_to'].append({
-                    'user_id': target_user_id,
-                    'message_id': sent_message.message_id,
-                    'chat_id': target_user_id
-                })
-                
-                sent_count += 1
-            except Exception as e:
-                failed_count += 1
-                logging.error(f"Ошибка отправки сообщения пользователю {user_id_key}: {e}")
-        
-        # Сохраняем информацию о рассылке в Firebase
+async def resume_broadcasts(app):
+    """Переносит старые записи рассылок и продолжает рассылки, прерванные остановкой бота"""
+    try:
+        await repo.migrate_legacy_broadcasts()
+        jobs = await repo.get_broadcast_jobs()
+    except Exception as e:
+        logging.error(f"Не удалось прочитать незавершенные рассылки: {e}")
+        return
+    for broadcast_id, job_state in (jobs or {}).items():
+        if job_state.get('status') == 'paused':
+            # Приостановленные после ошибок продолжаются только по /resumebroadcast
+            continue
         try:
-            ref = db.reference('broadcasts')
-            broadcast_id = ref.push(broadcast_info)
-            broadcast_info['id'] = broadcast_id.key
-            logging.info(f"Информация о рассылке сохранена: {broadcast_id.key}")
+            status_message = await app.bot.send_message(
+                chat_id=job_state['status_chat_id'],
+                text=f"📤 Рассылка {broadcast_id} возобновлена после перезапуска: уже отправлено {job_state.get('sent_count', 0)}."
+            )
         except Exception as e:
-            logging.error(f"Ошибка сохранения информации о рассылке: {e}")
-
-        # Формируем сообщение о результате
-        result_message = f"Сообщение отправлено {sent_count} пользователям. Ошибок: {failed_count}."
-        if photo_url and buttons:
-            result_message = f"Сообщение с фото и кнопками отправлено {sent_count} пользователям. Ошибок: {failed_count}."
-        elif photo_url:
-            result_message = f"Сообщение с фото отправлено {sent_count} пользователям. Ошибок: {failed_count}."
-        elif buttons:
-            result_message = f"Сообщение с кнопками отправлено {sent_count} пользователям. Ошибок: {failed_count}."
-
-        await update.message.reply_text(result_message)
-        await notify_admin(context.application, f"✅ Массовая рассылка выполнена админом {user_id}. Отправлено: {sent_count}, ошибок: {failed_count}.")
-        
+            logging.error(f"Не удалось возобновить рассылку {broadcast_id}: {e}")
+            continue
+        start_broadcast_task(app, broadcast_id, job_state, status_message)
+
+# --- Команда /resumebroadcast ---
+async def resumebroadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Продолжает рассылку, приостановленную после ошибок"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    if not context.args:
+        await update.message.reply_text("Использование: /resumebroadcast <broadcast_id>")
+        return
+    broadcast_id = context.args[0]
+
+    try:
+        job_state = await repo.get_broadcast_job(broadcast_id)
+        if not job_state:
+            await update.message.reply_text(f"Незавершенная рассылка с ID {broadcast_id} не найдена.")
+            return
+        if job_state.get('admin_id') != user_id:
+            await update.message.reply_text("Ты можешь продолжать только свои рассылки.")
+            return
+        if job_state.get('status') != 'paused':
+            await update.message.reply_text("Рассылка не приостановлена — она еще идет.")
+            return
+        await repo.update_paths({
+            f'broadcast_jobs/{broadcast_id}/status': 'running',
+            f'broadcast_summaries/{user_id}/{broadcast_id}/status': 'running',
+        })
     except Exception as e:
-        await update.message.reply_text(f"Ошибка при массовой рассылке: {e}")
+        await update.message.reply_text(f"Ошибка при возобновлении рассылки: {e}")
+        return
+
+    status_message = await update.message.reply_text(
+        f"📤 Рассылка {broadcast_id} возобновлена: уже отправлено {job_state.get('sent_count', 0)}."
+    )
+    start_broadcast_task(context.application, broadcast_id, {**job_state, 'status': 'running'}, status_message)
 
 # --- Команда /deletebroadcast ---
 async def deletebroadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -752,42 +872,79 @@ async def deletebroadcast_command(update: Update, context: ContextTypes.DEFAULT_
     broadcast_id = args[0]
 
     try:
-        # Получаем информацию о рассылке из Firebase
-        ref = db.reference(f'broadcasts/{broadcast_id}')
-        broadcast_info = ref.get()
+        # Получаем краткую запись о рассылке из Firebase
+        broadcast_info = await repo.get_broadcast_summary(user_id, broadcast_id)
 
         if not broadcast_info:
+            # Проверяем, не принадлежит ли рассылка другому админу
+            for admin_id in ADMIN_IDS - {user_id}:
+                if await repo.get_broadcast_summary(admin_id, broadcast_id):
+                    await update.message.reply_text("Ты можешь удалять только свои рассылки.")
+                    return
             await update.message.reply_text(f"Рассылка с ID {broadcast_id} не найдена.")
             return
 
-        # Проверяем, что это админ, который создал рассылку
-        if broadcast_info.get('admin_id') != user_id:
-            await update.message.reply_text("Ты можешь удалять только свои рассылки.")
+        if broadcast_info.get('status') == 'running':
+            await update.message.reply_text("Рассылка еще идет, удалить ее можно после завершения.")
+            return
+
+        if broadcast_id in deleting_broadcasts:
+            await update.message.reply_text("Эта рассылка уже удаляется.")
             return
 
-        # Удаляем сообщения у всех пользователей
-        deleted_count = 0
-        failed_count = 0
+        recipients = await repo.get_broadcast_recipients(broadcast_id)
+        messages = [(key, int(key), message_id) for key, message_id in recipients.items()]
+        deadline = broadcast_info.get('timestamp', 0) + DELETE_WINDOW
+        if messages and time.time() >= deadline:
+            await update.message.reply_text(
+                f"Рассылке больше 48 часов: Telegram не позволяет удалять такие сообщения. "
+                f"Не удалено сообщений: {len(messages)}."
+            )
+            return
+    except Exception as e:
+        await update.message.reply_text(f"Ошибка при удалении рассылки: {e}")
+        return
 
-        for message_info in broadcast_info.get('sent_to', []):
-            try:
-                await context.application.bot.delete_message(
-                    chat_id=message_info['chat_id'],
-                    message_id=message_info['message_id']
-                )
-                deleted_count += 1
-            except Exception as e:
-                failed_count += 1
-                logging.error(f"Ошибка удаления сообщения {message_info['message_id']} у пользователя {message_info['user_id']}: {e}")
+    # Удаление идет в фоне, обработчик команды сразу освобождается
+    status_message = await update.message.reply_text(f"🗑️ Удаление запущено: {len(messages)} сообщений.")
+
+    async def checkpoint(job, deleted_keys):
+        # Удаленные сразу убираем из записи, повторный /deletebroadcast займется только оставшимися
+        await repo.update_paths({f'broadcast_recipients/{broadcast_id}/{key}': None for key in deleted_keys})
 
-        # Удаляем информацию о рассылке из Firebase
-        ref.delete()
+    job = DeletionJob(context.application.bot, messages, deadline, status_message, checkpoint)
+    deleting_broadcasts.add(broadcast_id)
+    task = asyncio.create_task(run_broadcast_deletion(context.application, job, user_id, broadcast_id))
+    broadcast_tasks.add(task)
+    task.add_done_callback(broadcast_tasks.discard)
 
-        await update.message.reply_text(f"Рассылка удалена. Удалено сообщений: {deleted_count}, ошибок: {failed_count}.")
-        await notify_admin(context.application, f"🗑️ Рассылка {broadcast_id} удалена админом {user_id}. Удалено: {deleted_count}, ошибок: {failed_count}.")
+# Рассылки, которые сейчас удаляются
+deleting_broadcasts = set()
 
+async def run_broadcast_deletion(app, job: DeletionJob, admin_id: int, broadcast_id: str):
+    try:
+        await job.run()
+        remaining = job.failed_count + job.expired_count
+        if remaining == 0:
+            # Удаляем информацию о рассылке из Firebase
+            await repo.delete_broadcast(admin_id, broadcast_id)
     except Exception as e:
-        await update.message.reply_text(f"Ошибка при удалении рассылки: {e}")
+        logging.error(f"Ошибка при удалении рассылки {broadcast_id}: {e}")
+        await job.status_message.reply_text(f"Ошибка при удалении рассылки: {e}")
+        return
+    finally:
+        deleting_broadcasts.discard(broadcast_id)
+
+    result_message = f"Рассылка удалена. Удалено сообщений: {job.deleted_count}, ошибок: {job.failed_count}."
+    if remaining:
+        result_message = (f"Рассылка удалена частично. Удалено сообщений: {job.deleted_count}, "
+                          f"ошибок: {job.failed_count}.")
+        if job.expired_count:
+            result_message += f"\nИстекли 48 часов, не удалено: {job.expired_count}."
+        if job.failed_count:
+            result_message += f"\nПовтори /deletebroadcast {broadcast_id}, чтобы удалить оставшиеся."
+    await job.status_message.reply_text(result_message)
+    await notify_admin(app, f"🗑️ Рассылка {broadcast_id} удалена админом {admin_id}. Удалено: {job.deleted_count}, ошибок: {job.failed_count}.")
 
 # --- Команда /listbroadcasts ---
 async def listbroadcasts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -798,30 +955,16 @@ async def listbroadcasts_command(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     try:
-        # Получаем список рассылок из Firebase
-        ref = db.reference('broadcasts')
-        broadcasts = ref.get()
-
-        if not broadcasts:
-            await update.message.reply_text("Рассылок не найдено.")
-            return
-
-        # Фильтруем только рассылки текущего админа
-        admin_broadcasts = []
-        for broadcast_id, broadcast_info in broadcasts.items():
-            if broadcast_info.get('admin_id') == user_id:
-                admin_broadcasts.append((broadcast_id, broadcast_info))
+        # Последние 10 рассылок текущего админа, новые сверху — один индексированный запрос
+        admin_broadcasts = await repo.get_recent_broadcasts(user_id, limit=10)
 
         if not admin_broadcasts:
             await update.message.reply_text("У тебя нет рассылок.")
             return
 
-        # Сортируем по времени (новые сверху)
-        admin_broadcasts.sort(key=lambda x: x[1].get('timestamp', 0), reverse=True)
-
         # Формируем список
         message = "📋 **Твои рассылки:**\n\n"
-        for i, (broadcast_id, broadcast_info) in enumerate(admin_broadcasts[:10]):  # Показываем только последние 10
+        for i, (broadcast_id, broadcast_info) in enumerate(admin_broadcasts):
             timestamp = broadcast_info.get('timestamp', 0)
             from datetime import datetime
             date_str = datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y %H:%M')
@@ -830,7 +973,7 @@ async def listbroadcasts_command(update: Update, context: ContextTypes.DEFAULT_T
             if len(broadcast_info.get('message_text', '')) > 50:
                 message_text += "..."
             
-            sent_count = len(broadcast_info.get('sent_to', []))
+            sent_count = broadcast_info.get('sent_count', 0)
             has_photo = bool(broadcast_info.get('photo_url'))
             has_buttons = broadcast_info.get('has_buttons', False)
             
@@ -842,10 +985,13 @@ async def listbroadcasts_command(update: Update, context: ContextTypes.DEFAULT_T
                 message += " 📸"
             if has_buttons:
                 message += " 🔘"
+            if broadcast_info.get('status') == 'paused':
+                message += " ⏸️ приостановлена"
             message += "\n\n"
 
         message += "💡 **Использование:**\n"
         message += "• `/deletebroadcast <ID>` - удалить рассылку\n"
+        message += "• `/resumebroadcast <ID>` - продолжить приостановленную\n"
         message += "• `/listbroadcasts` - обновить список"
 
         await update.message.reply_text(message)
@@ -853,159 +999,142 @@ async def listbroadcasts_command(update: Update, context: ContextTypes.DEFAULT_T
     except Exception as e:
         await update.message.reply_text(f"Ошибка при получении списка рассылок: {e}")
 
-# --- Функции для обработки заказов ---
-def save_rental_to_firebase(rental_text):
-    """Сохраняет результат аренды в Firebase через HTTP API (как в HTML)"""
+# --- Команда /dbstats ---
+async def dbstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает статистику обращений к Firebase"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    await update.message.reply_text(f"{repo.format_stats()}\n\n{write_buffer.format_stats()}\n{library_cache.format_stats()}\n{rental_outbox.format_stats()}\n{rental_reminders.format_stats()}\n{account_pool.format_stats()}")
+
+# --- Инвентарь аккаунтов ---
+async def run_account_pool():
+    """Загружает аккаунты из базы и освобождает их по окончании аренды"""
     try:
-        # URL вашей Firebase Realtime Database из HTML
-        firebase_url = "https://arenarental-8eb7f-default-rtdb.firebaseio.com"
-        
-        # Данные для сохранения (точно как в HTML)
-        data = {
-            'text': rental_text,
-            'timestamp': int(time.time() * 1000)  # timestamp в миллисекундах
-        }
-        
-        # Отправляем POST запрос в Firebase
-        response = requests.post(
-            f"{firebase_url}/rentals.json",
-            json=data,
-            headers={'Content-Type': 'application/json'}
+        account_pool.load(await repo.get_accounts())
+        logging.info(f"Инвентарь аккаунтов загружен: {len(account_pool)}")
+    except Exception as e:
+        logging.error(f"Ошибка загрузки инвентаря аккаунтов: {e}")
+    await account_pool.run()
+
+def rental_end_timestamp(order_info):
+    """Момент окончания аренды: через days суток от выдачи (по умолчанию 7)"""
+    return int(time.time()) + order_info.get('days', 7) * 86400
+
+async def persist_busy_accounts(busy):
+    """Сохраняет занятость аккаунтов; False — если запись в базу не удалась"""
+    try:
+        await repo.set_accounts_busy(busy)
+        return True
+    except Exception as e:
+        logging.error(f"Ошибка сохранения занятости аккаунтов {list(busy)}: {e}")
+        return False
+
+async def allocate_account(order_info):
+    """Выдает под заказ свободный аккаунт из инвентаря. Возвращает (данные аккаунта, конец аренды) или None"""
+    if not account_pool.loaded or not order_info.get('game_name'):
+        return None
+    busy_until = rental_end_timestamp(order_info)
+    allocation = account_pool.allocate(order_info.get('platform', 'PS5'), order_info.get('game_name'),
+                                       busy_until, order_info.get('order_number'))
+    if allocation is None:
+        return None
+    account_id, record = allocation
+    # Аккаунт выдается только после записи в базу, иначе после перезапуска его выдали бы повторно
+    if not await persist_busy_accounts({account_id: (busy_until, order_info.get('order_number'))}):
+        account_pool.undo_allocation(account_id)
+        return None
+    account_info = {
+        'account_number': record.get('number'),
+        'platform': record.get('platform'),
+        'email': record.get('email'),
+        'password': record.get('password'),
+    }
+    return account_info, busy_until
+
+# --- Команда /addaccount ---
+async def addaccount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляет аккаунт в инвентарь: /addaccount <номер> <платформа> <почта> <пароль> <игра>[; <игра>...]"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    if len(context.args) < 5:
+        await update.message.reply_text(
+            "Использование: /addaccount <номер> <платформа> <почта> <пароль> <игра>[; <игра>...]\n"
+            "Пример: /addaccount 123 PS5 mail@example.com pass123 God of War Ragnarök; Spider-Man 2"
         )
-        
-        if response.status_code == 200:
-            logging.info("Результат аренды сохранен в Firebase (arenarental-8eb7f)")
-            logging.info(f"Firebase ответ: {response.json()}")
-        else:
-            logging.error(f"Ошибка Firebase API: {response.status_code} - {response.text}")
-            
+        return
+
+    number, platform, email, password = context.args[:4]
+    games = [title.strip() for title in " ".join(context.args[4:]).split(';') if title.strip()]
+    if account_pool.find_by_number(number):
+        await update.message.reply_text(f"Аккаунт №{number} уже есть в инвентаре.")
+        return
+
+    account_id = generate_push_id()
+    record = {
+        'number': number,
+        'platform': platform.upper(),
+        'email': email,
+        'password': password,
+        'games': {title: True for title in games},
+        'busy_until': 0,
+    }
+    try:
+        await repo.save_account(account_id, record)
     except Exception as e:
-        logging.error(f"Ошибка сохранения в Firebase: {e}")
-        # Fallback: попробуем использовать существующую конфигурацию
-        try:
-            if firebase_json:
-                ref = db.reference('rentals')
-                ref.push({
-                    'text': rental_text,
-                    'timestamp': int(time.time() * 1000)
-                })
-                logging.info("Результат сохранен через fallback конфигурацию")
-        except Exception as e2:
-            logging.error(f"Fallback также не сработал: {e2}")
-def parse_order_info(text):
-    """Парсит информацию о заказе из пересланного сообщения (улучшенная версия)"""
-    order_info = {}
-    
-    # Извлекаем номер заказа
-    order_match = re.search(r'Заказ №(\d+)', text)
-    if order_match:
-        order_info['order_number'] = order_match.group(1)
-    
-    # Извлекаем название игры - берем до цены с цифрами (учитывая двоеточия в названии)
-    line_match = re.search(r'^\s*\d+\.\s*.*$', text, re.MULTILINE)
-    if line_match:
-        line = line_match.group(0)
-        # Ищем паттерн ": цифры (" для определения конца названия
-        price_match = re.search(r':\s*\d+\s*\(', line)
-        if price_match:
-            # Берем все до цены, убираем номер в начале
-            title_part = line[:price_match.start()].strip()
-            title_part = re.sub(r'^\d+\.\s*', '', title_part)
-            order_info['game_name'] = title_part
-        else:
-            # Fallback: берем до первого двоеточия
-            title_part = line.split(':')[0].replace(r'^\s*\d+\.', '', count=1).strip()
-            order_info['game_name'] = title_part
-        
-        # Извлекаем платформу из той же строки
-        platform_match = re.search(r'Платформа\s*:\s*([^,\n]+)', line, re.IGNORECASE)
-        if platform_match:
-            order_info['platform'] = platform_match.group(1).strip()
-        
-        # Извлекаем позицию и дни
-        pos_match = re.search(r'(П[23])\s*(\d+)\s*дн', line, re.IGNORECASE)
-        if pos_match:
-            order_info['rental_type'] = pos_match.group(1).upper()
-            order_info['days'] = int(pos_match.group(2))
-    
-    # Извлекаем имя покупателя
-    name_match = re.search(r'\bName\s*:\s*([^\n\r]+)', text, re.IGNORECASE)
-    if name_match:
-        order_info['customer_name'] = name_match.group(1).strip()
-    
-    # Извлекаем дату
-    date_match = re.search(r'\bDate\s*:\s*([^\n\r]+)', text, re.IGNORECASE)
-    if date_match:
-        order_info['order_date'] = date_match.group(1).strip()
-    
-    # Извлекаем промокод (если есть)
-    promo_match = re.search(r'Промокод:\s+([^\n]+)', text)
-    if promo_match:
-        order_info['promo_code'] = promo_match.group(1).strip()
-    
-    # Извлекаем скидку (если есть)
-    discount_match = re.search(r'Скидка:\s+(\d+)', text)
-    if discount_match:
-        order_info['discount'] = discount_match.group(1)
-    
-    # Извлекаем ник в Telegram
-    telegram_match = re.search(r'Ник_в_Telegram_или_Вконтакте:\s+([^\n]+)', text)
-    if telegram_match:
-        order_info['telegram_nick'] = telegram_match.group(1).strip()
-    
-    return order_info
+        await update.message.reply_text(f"Ошибка при сохранении аккаунта: {e}")
+        return
+    account_pool.add(account_id, record)
+    await update.message.reply_text(f"✅ Аккаунт №{number} ({record['platform']}) добавлен, игр: {len(games)}")
 
-def parse_account_info(text):
-    """Парсит информацию об аккаунте (улучшенная версия)"""
-    account_info = {}
-    
-    if not text:
-        return account_info
-    
-    # Извлекаем номер аккаунта (поддерживаем "Аккаунт:" и "Лот")
-    acc_match = re.search(r'Аккаунт\s*:\s*(\S+)', text, re.IGNORECASE)
-    if acc_match:
-        account_info['account_number'] = acc_match.group(1)
-    else:
-        # Ищем формат "Лот X" или "ЛОТ X"
-        lot_match = re.search(r'Л[Оо]т\s*(\d+)', text, re.IGNORECASE)
-        if lot_match:
-            account_info['account_number'] = f"ЛОТ {lot_match.group(1)}"
-    
-    # Определяем платформу
-    if re.search(r'PS5', text, re.IGNORECASE):
-        account_info['platform'] = 'PS5'
-    elif re.search(r'PS4', text, re.IGNORECASE):
-        account_info['platform'] = 'PS4'
-    
-    # Извлекаем email
-    email_match = re.search(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-zА-Яа-я]{2,}', text)
-    if email_match:
-        account_info['email'] = email_match.group(0)
-        
-        # Ищем пароль после email
-        after_email = text[email_match.end():]
-        lines_after = [s.strip() for s in after_email.split('\n') if s.strip()]
-        
-        # Ищем строку без пробелов, без @, длиной >= 4
-        for line in lines_after:
-            if not re.search(r'\s', line) and '@' not in line and len(line) >= 4:
-                account_info['password'] = line
-                break
-    else:
-        # Если email не найден, ищем пароль в конце
-        lines = [s.strip() for s in text.split('\n') if s.strip()]
-        for line in reversed(lines):
-            if not re.search(r'\s', line) and '@' not in line and len(line) >= 4:
-                account_info['password'] = line
-                break
-    
-    # Проверяем наличие активации
-    if '✅ активация' in text or 'активация' in text:
-        account_info['activation'] = '✅'
-    
-    return account_info
+# --- Команда /accounts ---
+async def accounts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка по инвентарю или аккаунты с игрой: /accounts [игра]"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    if not context.args:
+        await update.message.reply_text(account_pool.format_stats())
+        return
+    game_title = " ".join(context.args)
+    lines = account_pool.format_game(game_title)
+    await update.message.reply_text(lines or f"Аккаунтов с игрой «{game_title}» нет.")
 
+# --- Команда /releaseaccount ---
+async def releaseaccount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Досрочно освобождает аккаунт: /releaseaccount <номер>"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    if not context.args:
+        await update.message.reply_text("Использование: /releaseaccount <номер>")
+        return
+    number = context.args[0]
+    account_id = account_pool.find_by_number(number)
+    if account_id is None:
+        await update.message.reply_text(f"Аккаунта №{number} нет в инвентаре.")
+        return
+    record = account_pool.get(account_id)
+    busy = (record.get('busy_until'), record.get('order_number'))
+    if not account_pool.release(account_id):
+        await update.message.reply_text(f"Аккаунт №{number} и так свободен.")
+        return
+    if not await persist_busy_accounts({account_id: (0, None)}):
+        account_pool.occupy(account_id, *busy)
+        await update.message.reply_text(f"Не удалось сохранить освобождение аккаунта №{number}, попробуйте еще раз.")
+        return
+    await update.message.reply_text(f"✅ Аккаунт №{number} освобожден.")
+
+# --- Функции для обработки заказов ---
 def parse_russian_date(date_str):
     """Парсит русскую дату в формате dd.mm.yyyy"""
     try:
@@ -1017,18 +1146,10 @@ def parse_russian_date(date_str):
         pass
     return None
 
-def calculate_end_date(start_date_str, days):
-    """Вычисляет дату окончания аренды (всегда от текущей даты)"""
-    try:
-        # Всегда используем текущую дату как дату начала аренды
-        start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        end_date = start_date + timedelta(days=days)
-        return end_date.strftime("%d.%m.%Y")
-    except:
-        return "неизвестно"
+def format_msk(timestamp, fmt):
+    return (datetime.fromtimestamp(timestamp, timezone.utc) + timedelta(hours=3)).strftime(fmt)
 
-def format_order_message(order_info, account_info):
+def format_order_message(order_info, account_info, end_ts):
     """Форматирует финальное сообщение для админа (улучшенная версия)"""
     customer_name = order_info.get('customer_name', 'Клиент')
     
@@ -1054,16 +1175,12 @@ def format_order_message(order_info, account_info):
         if not account_info.get('activation') or account_info.get('activation') == '✅':
             rental_with_activation += ' ✅'
     
-    # Вычисляем дату окончания
-    order_date = order_info.get('order_date', '')
-    days = order_info.get('days', 7)  # По умолчанию 7 дней
-    end_date = calculate_end_date(order_date, days)
-    
-    # Время выдачи (текущее время + 3 часа)
-    current_time = (datetime.now() + timedelta(hours=3)).strftime('%H:%M')
+    # Дата и время окончания по Москве
+    end_date = format_msk(end_ts, '%d.%m.%Y')
+    end_time = format_msk(end_ts, '%H:%M')
     
     message = f"""Любимый клиент: {customer_name}
-Арендовал(а) до {end_date} в {current_time}
+Арендовал(а) до {end_date} в {end_time}
 "{game_name}", {platform}, {rental_with_activation}
 Занят аккаунт №: {account_number}
 почта: {email}
@@ -1071,7 +1188,32 @@ def format_order_message(order_info, account_info):
     
     return message
 
+def make_rental(order_info, account_info, end_ts):
+    """Карточка заказа для админа и структурированная запись аренды для базы"""
+    card = format_order_message(order_info, account_info, end_ts)
+    rental = {
+        'text': card,
+        'order_number': order_info.get('order_number'),
+        'game_name': order_info.get('game_name'),
+        'platform': account_info.get('platform') or order_info.get('platform', 'PS5'),
+        'rental_type': order_info.get('rental_type'),
+        'customer_name': order_info.get('customer_name'),
+        'telegram_nick': order_info.get('telegram_nick'),
+        'account_number': account_info.get('account_number'),
+        'end_ts': end_ts,
+        'reminder_stage': STAGE_NONE,
+    }
+    return card, {field: value for field, value in rental.items() if value is not None}
+
+def save_rentals(rentals):
+    """Ставит записи аренды в outbox и сразу планирует по ним напоминания"""
+    timestamp = int(time.time() * 1000)
+    for key, rental in zip(rental_outbox.add_many(rentals), rentals):
+        rental_reminders.add(key, {**rental, 'timestamp': timestamp})
+
 # --- Обработчик пересланных сообщений ---
+# Заказы копятся в очереди: можно переслать несколько подряд (или альбомом),
+# затем одним сообщением прислать столько же аккаунтов — бот сопоставит их по порядку
 async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает пересланные сообщения с заказами"""
     user_id = update.effective_user.id
@@ -1084,52 +1226,119 @@ async def handle_forwarded_message(update: Update, context: ContextTypes.DEFAULT
     if not update.message.forward_from and not update.message.forward_from_chat:
         return ConversationHandler.END
     
-    message_text = update.message.text
+    # У сообщений из альбома текст заказа лежит в подписи
+    message_text = update.message.text or update.message.caption
     if not message_text:
         await update.message.reply_text("Пересланное сообщение не содержит текста.")
         return ConversationHandler.END
     
     # Проверяем, что это сообщение с заказом
-    if 'Заказ №' in message_text and 'Информация о покупателе:' in message_text:
-        # Парсим информацию о заказе
+    if is_order_text(message_text):
         order_info = parse_order_info(message_text)
         
-        # Сохраняем информацию о заказе в контексте пользователя
-        context.user_data['pending_order'] = order_info
+        # Если в инвентаре есть свободный аккаунт с этой игрой — выдаем его сразу
+        allocation = await allocate_account(order_info)
+        if allocation:
+            card, rental = make_rental(order_info, *allocation)
+            await update.message.reply_text(card)
+            save_rentals([rental])
+            await update.message.reply_text(f"🎮 Аккаунт для заказа {describe_order(order_info)} выдан из инвентаря автоматически.")
+            if context.user_data.get('pending_orders'):
+                return WAITING_FOR_ACCOUNT_DATA
+            return ConversationHandler.END
+        
+        # Свободного аккаунта нет — добавляем заказ в очередь
+        pending_orders = context.user_data.setdefault('pending_orders', [])
+        pending_orders.append(order_info)
         
         # Просим данные аккаунта
-        await update.message.reply_text("А теперь пришли мне данные аккаунта")
+        if len(pending_orders) == 1:
+            await update.message.reply_text("А теперь пришли мне данные аккаунта")
+        else:
+            await update.message.reply_text(
+                f"Заказ №{order_info.get('order_number', '?')} добавлен, заказов в очереди: {len(pending_orders)}.\n"
+                f"Перешли еще заказы или пришли данные {len(pending_orders)} аккаунтов одним сообщением в том же порядке."
+            )
         
         # Устанавливаем состояние ожидания данных аккаунта
         return WAITING_FOR_ACCOUNT_DATA
     else:
         await update.message.reply_text("Это не похоже на сообщение с заказом. Перешлите сообщение с заказом, содержащее 'Заказ №' и 'Информация о покупателе:'.")
+        if context.user_data.get('pending_orders'):
+            return WAITING_FOR_ACCOUNT_DATA
         return ConversationHandler.END
 
+def describe_order(order_info):
+    return f"№{order_info.get('order_number', '?')} «{order_info.get('game_name', 'Игра')}»"
+
 # --- Обработчик данных аккаунта ---
 async def handle_account_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает данные аккаунта"""
+    """Обрабатывает данные одного или нескольких аккаунтов для заказов из очереди"""
     user_id = update.effective_user.id
     
     # Проверяем, что это админ
     if user_id not in ADMIN_IDS:
         return ConversationHandler.END
     
+    message_text = update.message.text
+    # Пока ждем аккаунты, пересланный заказ просто добавляется в очередь
+    if update.message.forward_date and is_order_text(message_text):
+        return await handle_forwarded_message(update, context)
+    
     # Проверяем, что есть ожидающий заказ
-    if 'pending_order' not in context.user_data:
+    pending_orders = context.user_data.get('pending_orders')
+    if not pending_orders:
         await update.message.reply_text("Нет ожидающего заказа. Перешлите сначала сообщение с заказом.")
         return ConversationHandler.END
     
-    message_text = update.message.text
     if not message_text:
         await update.message.reply_text("Пришлите текстовые данные аккаунта.")
         return WAITING_FOR_ACCOUNT_DATA
     
-    # Парсим данные аккаунта
-    account_info = parse_account_info(message_text)
+    # Один заказ — весь текст относится к одному аккаунту, несколько — делим на блоки
+    blocks = [message_text] if len(pending_orders) == 1 else split_account_blocks(message_text)
     
-    # Проверяем, что удалось извлечь основные данные
-    if not account_info.get('account_number') or not account_info.get('email') or not account_info.get('password'):
+    cards = []
+    rentals = []
+    problems = []
+    remaining_orders = []
+    busy_accounts = {}
+    inventory_warnings = []
+    for index, order_info in enumerate(pending_orders):
+        if index >= len(blocks):
+            remaining_orders.append(order_info)
+            continue
+        # Парсим данные аккаунта
+        account_info = parse_account_info(blocks[index])
+        
+        # Проверяем, что удалось извлечь основные данные
+        missing = [name for field, name in (('account_number', 'номер'), ('email', 'email'), ('password', 'пароль'))
+                   if not account_info.get(field)]
+        if missing:
+            problems.append(f"• {describe_order(order_info)}: не найдено — {', '.join(missing)}")
+            remaining_orders.append(order_info)
+            continue
+        
+        # Форматируем финальное сообщение и запись аренды
+        end_ts = rental_end_timestamp(order_info)
+        card, rental = make_rental(order_info, account_info, end_ts)
+        cards.append(card)
+        rentals.append(rental)
+        
+        # Аккаунт из инвентаря, выданный вручную, тоже отмечаем занятым до конца аренды
+        account_id = account_pool.find_by_number(account_info.get('account_number'))
+        if account_id:
+            if account_pool.occupy(account_id, end_ts, order_info.get('order_number')):
+                busy_accounts[account_id] = (end_ts, order_info.get('order_number'))
+            else:
+                record = account_pool.get(account_id)
+                inventory_warnings.append(
+                    f"⚠️ Аккаунт №{record.get('number')} по инвентарю уже занят до "
+                    f"{format_msk(record['busy_until'], '%d.%m.%Y %H:%M')} (заказ №{record.get('order_number') or '?'}), "
+                    f"для заказа {describe_order(order_info)} занятость не изменена."
+                )
+    
+    if len(pending_orders) == 1 and not cards:
         await update.message.reply_text(
             "Не удалось извлечь все необходимые данные аккаунта (номер, email, пароль). Попробуйте еще раз.",
             reply_markup=InlineKeyboardMarkup([
@@ -1138,22 +1347,91 @@ async def handle_account_data(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return WAITING_FOR_ACCOUNT_DATA
     
-    # Получаем информацию о заказе
-    order_info = context.user_data['pending_order']
+    # Отправляем админу карточки (каждую отдельным сообщением, чтобы их было удобно пересылать)
+    for final_message in cards:
+        await update.message.reply_text(final_message)
     
-    # Форматируем финальное сообщение
-    final_message = format_order_message(order_info, account_info)
+    # Сохраняем все результаты в Firebase одной пачкой (через outbox, отправка в фоне)
+    if rentals:
+        save_rentals(rentals)
+    if busy_accounts and not await persist_busy_accounts(busy_accounts):
+        inventory_warnings.append("⚠️ Не удалось сохранить занятость аккаунтов в базе, проверьте /accounts.")
+    if inventory_warnings:
+        await update.message.reply_text("\n".join(inventory_warnings))
     
-    # Отправляем админу
-    await update.message.reply_text(final_message)
-
-    # Сохраняем результат в Firebase
-    save_rental_to_firebase(final_message)
+    # Очищаем обработанные заказы
+    context.user_data['pending_orders'] = remaining_orders
+    
+    if len(pending_orders) > 1 or problems or len(blocks) > len(pending_orders):
+        summary = [f"Оформлено заказов: {len(cards)} из {len(pending_orders)}."]
+        summary += problems
+        unpaired = len(pending_orders) - len(blocks)
+        if unpaired > 0:
+            summary.append(f"• Не хватило данных аккаунтов для заказов: {unpaired}")
+        elif unpaired < 0:
+            summary.append(f"• Лишних блоков аккаунтов (не использованы): {-unpaired}")
+        if remaining_orders:
+            summary.append(f"\nОставшиеся заказы ({len(remaining_orders)}) ждут данных аккаунтов в том же порядке.")
+        await update.message.reply_text(
+            "\n".join(summary),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("❌ Отмена", callback_data="cancel_order_parsing")]
+            ]) if remaining_orders else None
+        )
+    
+    if remaining_orders:
+        return WAITING_FOR_ACCOUNT_DATA
+    return ConversationHandler.END
 
-    # Очищаем данные
-    del context.user_data['pending_order']
+# --- Напоминания об окончании аренды ---
+# Поле заказа «Ник в Telegram или Вконтакте»: клиентом считаем только целиком указанный
+# Telegram-ник (@nick, t.me/nick или nick без пробелов). Ссылки VK и имена не подходят —
+# иначе напоминание с игрой и датами ушло бы постороннему пользователю с похожим ником
+TELEGRAM_NICK_RE = re.compile(r'(?:@|(?:https?://)?(?:www\.)?t(?:elegram)?\.me/)?([A-Za-z][A-Za-z0-9_]{4,31})/?')
+
+async def resolve_customer(telegram_nick):
+    """chat_id клиента по нику из заказа, если клиент писал боту; None — если не найден"""
+    match = TELEGRAM_NICK_RE.fullmatch((telegram_nick or '').strip())
+    if not match:
+        return None
+    return await repo.get_user_id_by_username(match.group(1).lower())
+
+async def notify_rental(app, key: str, rental: dict, stage: int):
+    """Уведомляет клиента (если он найден по нику) и админов о скором или наступившем окончании аренды"""
+    game_name = rental.get('game_name', 'Игра')
+    end_text = format_msk(rental['end_ts'], '%d.%m.%Y в %H:%M')
+    if stage == STAGE_REMINDED:
+        customer_text = (f"⏰ Аренда «{game_name}» заканчивается завтра, {end_text} (МСК).\n\n"
+                         "Игру можно продлить со скидкой или сдать — выбери вариант:")
+        customer_markup = END_RENTAL_KEYBOARD
+        title = "⏰ Завтра заканчиваются аренды"
+    else:
+        customer_text = f"⏰ Срок аренды «{game_name}» закончился.\n\n{RENTAL_EXPIRED_TEXT}"
+        customer_markup = CONSOLE_KEYBOARD
+        title = "⌛ Закончились аренды"
 
-    return ConversationHandler.END
+    chat_id = await resolve_customer(rental.get('telegram_nick'))
+    delivered = False
+    if chat_id:
+        try:
+            await call_with_retries(chat_id, lambda: app.bot.send_message(
+                chat_id=chat_id, text=customer_text, reply_markup=customer_markup
+            ))
+            delivered = True
+        except Exception as e:
+            logging.error(f"Не удалось уведомить клиента {chat_id} об аренде {key}: {e}")
+
+    customer = rental.get('telegram_nick') or rental.get('customer_name') or 'клиент'
+    line = (f"№{rental.get('order_number', '?')} «{game_name}», {rental.get('platform', '')}, "
+            f"акк. {rental.get('account_number', '?')} — {customer} "
+            f"({'уведомлен' if delivered else 'не найден в боте'})")
+    notify_admin_digest(title, f"{title}:\n• {line}\nОкончание: {end_text} (МСК)", line)
+
+rental_reminders = RentalReminders(
+    load_window=rental_outbox.get_rentals_ending,
+    notify=notify_rental,
+    mark=lambda key, stage: rental_outbox.set_field(key, 'reminder_stage', stage),
+)
 
 # --- Команда /schedule ---
 def convert_utc3_to_unix_timestamp(date_str: str) -> int:
@@ -1170,7 +1448,7 @@ async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     args = context.args
     if len(args) < 4:
-        await update.message.reply_text("Использование: /schedule <user_id> <YYYY-MM-DD> <HH:MM> <текст сообщения>")
+        await update.message.reply_text("Использование: /schedule <user_id> <YYYY-MM-DD> <HH:MM> <текст сообщения> [photo_url] [кнопки]")
         return
 
     try:
@@ -1183,301 +1461,342 @@ async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Ошибка при обработке даты и времени: {e}")
         return
 
-    message_text = " ".join(args[3:])
-    ref = db.reference('scheduled_messages')
-    ref.push({
+    payload = MessagePayload.parse(" ".join(args[3:]))
+    key = await repo.push_scheduled_message({
         'target_user_id': target_user_id,
-        'message_text': message_text,
+        'message_text': payload.text,
+        'photo_url': payload.photo_url,
+        'buttons': [list(button) for button in payload.buttons],
         'send_at': send_at_timestamp,
         'status': 'pending'
     })
+    message_scheduler.add(key, send_at_timestamp)
 
     await update.message.reply_text(f"Сообщение запланировано для пользователя {target_user_id} на {date_time_str} по UTC+3.")
     await notify_admin(context.application, f"✅ Сообщение добавлено в расписание для пользователя {target_user_id} админом {user_id}.")
 
-# --- Фоновый воркер отправки отложенных сообщений ---
-async def scheduled_messages_worker(app):
-    while True:
-        try:
-            ref = db.reference('scheduled_messages')
-            all_messages = ref.order_by_child('status').equal_to('pending').get()
-            if all_messages:
-                now_ts = int(datetime.now(timezone.utc).timestamp())
-                for key, msg_data in all_messages.items():
-                    send_at = msg_data.get('send_at', 0)
-                    if send_at <= now_ts:
-                        target_user_id = msg_data.get('target_user_id')
-                        message_text = msg_data.get('message_text')
-                        try:
-                            await app.bot.send_message(chat_id=target_user_id, text=message_text)
-                            ref.child(key).update({'status': 'sent'})
-                            logging.info(f"Отложенное сообщение отправлено пользователю {target_user_id}")
-                            # Отправляем операционное уведомление админам
-                            await notify_admin(app, f"✅ Отложенное сообщение отправлено пользователю {target_user_id}")
-                        except Exception as e:
-                            logging.error(f"Ошибка при отправке отложенного сообщения: {e}")
-            await asyncio.sleep(30)
-        except Exception as e:
-            logging.error(f"Ошибка в воркере отложенных сообщений: {e}")
-            await asyncio.sleep(30)
+# --- Отправка отложенных сообщений ---
+async def load_pending_scheduled_messages():
+    messages = await repo.get_pending_scheduled_messages()
+    return {key: msg_data.get('send_at', 0) for key, msg_data in (messages or {}).items()}
+
+async def deliver_scheduled_message(app, key: str, msg_data: dict):
+    target_user_id = msg_data.get('target_user_id')
+    payload = MessagePayload.from_dict(msg_data)
+    await payload.send(app.bot, target_user_id, payload.reply_markup(), media_cache)
+    logging.info(f"Отложенное сообщение отправлено пользователю {target_user_id}")
+    # Операционное уведомление админам — через сводку, чтобы пачка отправок не давала пачку сообщений
+    notify_admin_digest("✅ Отложенных сообщений отправлено",
+                        f"✅ Отложенное сообщение отправлено пользователю {target_user_id}",
+                        f"пользователю {target_user_id}")
+
+async def archive_sent_scheduled_message(key: str, msg_data: dict):
+    await repo.archive_scheduled_message(key, msg_data, 'sent')
+
+# Воркер спит до ближайшего сообщения, /schedule будит его сразу
+message_scheduler = MessageScheduler(
+    load_pending=load_pending_scheduled_messages,
+    claim=repo.claim_scheduled_message,
+    deliver=deliver_scheduled_message,
+    release=repo.release_scheduled_message,
+    archive=archive_sent_scheduled_message,
+)
+
+# --- Кнопки: статичные экраны и маршрутизация ---
+# Экраны собираются один раз при импорте. Сообщение нельзя отредактировать с reply-клавиатурой,
+# поэтому экраны для inline-кнопок ее не содержат
+FUNCTIONS_TEXT = (
+    "Привет! 👋\n"
+    "Я помогу найти игры для PlayStation: просто напиши название игры или её часть, и я пришлю ссылку на аренду или покупку.\n"
+    "Кроме того, я могу:\n"
+    "🎮 Посоветовать интересные игры, если не знаешь, во что поиграть\n"
+    "📚 Хранить твою библиотеку пройденных и сыгранных игр, чтобы не советовать их повторно\n"
+    "🆕 Показывать последние новинки — их всегда можно арендовать у нас!\n\n"
+    "Выбери действие или напиши любое название игры:"
+)
+LIBRARY_SCREEN = Screen("📚 **Моя библиотека игр**\n\nВыбери категорию:", LIBRARY_KEYBOARD)
+RENTAL_SCREEN = Screen("🏠 **Аренда игр**\n\nВыбери действие:", RENTAL_KEYBOARD)
+PURCHASE_SCREEN = Screen("🛒 **Покупка игр**\n\nВыбери категорию:", PURCHASE_KEYBOARD)
+FUNCTIONS_SCREEN = Screen(FUNCTIONS_TEXT)
+CONSOLE_SCREEN = Screen("**Как правильно сдать игру?**", CONSOLE_KEYBOARD)
+
+async def edit_screen(update: Update, screen: Screen):
+    await update.callback_query.edit_message_text(screen.text, reply_markup=screen.reply_markup)
+
+async def reply_screen(update: Update, screen: Screen):
+    await update.message.reply_text(screen.text, reply_markup=screen.reply_markup)
+
+# Inline-кнопки: callback_data -> экран или обработчик
+callback_router = Router(render=edit_screen)
+
+callback_router.screen("search_game", Screen(
+    "🔍 **Поиск игры**\n\nНапиши название игры или её часть, и я пришлю ссылку на аренду или покупку.\n\nПримеры:\n• God of War\n• FIFA\n• Spider-Man"
+))
+callback_router.screen("library", LIBRARY_SCREEN)
+callback_router.screen("rental", RENTAL_SCREEN)
+callback_router.screen("functions", FUNCTIONS_SCREEN)
+callback_router.screen("help", Screen(
+    "❓ Помощь:\n\n"
+    "🎮 **Дать совет** - получить персональную рекомендацию игры\n"
+    "🆕 **Новинки** - показать последние 25 игр\n"
+    "📚 **Моя библиотека** - посмотреть пройденные, сыгранные и неинтересные игры\n\n"
+    "💡 **Советы по использованию:**\n"
+    "• Напиши название игры для поиска\n"
+    "• Используй кнопки для быстрой навигации\n"
+    "• Отмечай игры, чтобы получать более точные рекомендации\n\n"
+    "🔗 **Полезные ссылки:**\n"
+    "• Сайт: https://arenapsgm.ru/P2P3\n"
+    "• Группа: @StorePSGM"
+))
+callback_router.screen("back_to_main", Screen("Главное меню:\n\nВыбери действие или напиши любое название игры:"))
+
+# Аренда
+callback_router.screen("rent_game", Screen(
+    "🎮 **Арендовать игру**\n\n"
+    "Напиши название игры или её часть и я пришлю ссылку на аренду. "
+    "Перейдя по ссылке выбери срок и позицию, после оплаты я передам чек админу и он всё пришлёт.\n\n"
+    "Также все игры представлены на https://arenapsgm.ru/",
+    RENTAL_KEYBOARD
+))
+callback_router.screen("rent_ps_plus", Screen(
+    "🎯 **Арендовать PS Plus**\n\n"
+    "Переходи по ссылке для аренды PS Plus:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎮 Арендовать PS Plus", url="https://arenapsgm.ru/playstationplus/tproduct/199915107972-arenda-ps-plus-ps4ps5")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="rental")]
+    ])
+))
+callback_router.screen("extend_rental_profile", Screen(
+    "✅ **Продлить аренду профиля**\n\n"
+    "Для продления аренды используй промокод: `ARENALOVE`\n\n"
+    "Напиши название или часть из названия игры, которую нужно продлить:",
+    RENTAL_KEYBOARD
+))
+callback_router.screen("end_rental", Screen("✅ **Завершить аренду**\n\nВыбери вариант:", END_RENTAL_KEYBOARD))
+callback_router.screen("get_2fa", Screen(
+    "🔐 **Получить код 2FA**\n\n"
+    "Сейчас я это делать не умею, но скоро научусь! Спроси код у @ArenaPSGMadmin",
+    RENTAL_KEYBOARD
+))
+callback_router.screen("rental_expired", Screen(RENTAL_EXPIRED_TEXT, CONSOLE_KEYBOARD))
+callback_router.screen("early_return", Screen(
+    "📤 **Сдать игру досрочно**\n\n"
+    "За досрочную сдачу аккаунта как правило полагается скидка на следующую игру около 30%\n"
+    "• Скидка активна в течение недели\n"
+    "• Скидка не действует на позиции дешевле 290₽\n"
+    "• Скидка идёт от 14 дней\n"
+    "• Скидка не действует на скидку и на новинки первые 2-3 месяца\n\n"
+    "Промокод на скидку за досрочную сдачу проси у @ArenaPSGMadmin",
+    EARLY_RETURN_CONFIRM_KEYBOARD
+))
+callback_router.screen("early_return_confirm", CONSOLE_SCREEN)
+callback_router.screen("extend_rental", Screen(
+    "💳 **Продлить игру со скидкой**\n\n"
+    "Для продления игры со скидкой используй промокод: `ARENALOVE`\n\n"
+    "Напиши название или часть из названия игры, которую нужно продлить:",
+    RENTAL_KEYBOARD
+))
+callback_router.screen("ps4_guide", Screen(
+    "🎮 **Инструкция для PS4:**\n\n"
+    "• Заходите в Настройки → Управление учетной записью → Активация как основная система PS4\n"
+    "• Нажимаете \"Деактивировать\"\n\n"
+    "После чего пришлите фото деактивации админу @ArenaPSGMadmin\n"
+    "За это уважение и респект 🫡",
+    CONSOLE_KEYBOARD
+))
+callback_router.screen("ps5_guide", Screen(
+    "🎮 **Инструкция для PS5:**\n\n"
+    "• Заходите в Настройки → Пользователи и учётные записи → Другое → Общий доступ к консоли и офлайн-игра\n"
+    "• Нажимаете \"Отключить\"\n\n"
+    "После чего пришлите фото выключения общего доступа админу @ArenaPSGMadmin\n"
+    "За это уважение и респект 🫡",
+    CONSOLE_KEYBOARD
+))
+
+# Покупка
+callback_router.screen("purchase", PURCHASE_SCREEN)
+callback_router.screen("buy_games", Screen("🎮 **Купить игры**\n\nВыбери вариант:", BUY_GAMES_KEYBOARD))
+callback_router.screen("buy_cheaper", Screen(
+    "💰 **Купить дешевле**\n\n"
+    "Переходи по ссылке для покупки игр по выгодным ценам:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("💰 Купить дешевле", url="https://arenapsgm.ru/P2P3")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="buy_games")]
+    ])
+))
+callback_router.screen("buy_full", Screen("💎 **Полная покупка**\n\nВыбери варианты:", BUY_FULL_KEYBOARD))
+callback_router.screen("buy_sale", Screen(
+    "🔥 **Распродажа**\n\n"
+    "Переходи по ссылке для покупки игр со скидками:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔥 Распродажа", url="https://arenapsgm.ru/whattobuysale")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="buy_full")]
+    ])
+))
+callback_router.screen("buy_outside_sale", Screen(
+    "🎯 **Игра вне распродажи**\n\n"
+    "Для уточнения стоимости игры, которой нет в распродаже, свяжитесь с администратором:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("💬 Связаться с админом", url="https://t.me/ArenaPSGMadmin")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="buy_full")]
+    ])
+))
+callback_router.screen("buy_subscription", Screen("📱 **Купить Подписку**\n\nВыбери подписку:", BUY_SUBSCRIPTION_KEYBOARD))
+callback_router.screen("buy_ps_plus", Screen(
+    "🎮 **Купить PS Plus**\n\n"
+    "Переходи по ссылке для покупки PS Plus:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎮 Купить PS Plus", url="https://arenapsgm.ru/playstationplus")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="buy_subscription")]
+    ])
+))
+callback_router.screen("buy_ea_play", Screen(
+    "🎯 **Купить EA Play**\n\n"
+    "Переходи по ссылке для покупки EA Play:",
+    InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎯 Купить EA Play", url="https://arenapsgm.ru/eaplay")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="buy_subscription")]
+    ])
+))
+
+# Списки библиотеки (как /passed, /played, /notinterested)
+callback_router.on("completed")(passed_command)
+callback_router.on("played")(played_command)
+callback_router.on("not_interested")(not_interested_command)
+callback_router.on("new_releases")(new_releases_command)
+
+@callback_router.on("advice")
+async def advice_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['last_recommended_game'] = None  # Сбрасываем для новой рекомендации
+    await send_advice(update, context)
+
+@callback_router.on_prefix("results")
+async def results_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, offset: str):
+    await results_page_callback(update, context, int(offset))
+
+# Кнопки в режиме рекомендаций: отметить игру и дать новую рекомендацию
+ADVICE_MARKS = {
+    "advice_played": ('played_games', "Отлично, отметил как сыгранную. Вот новая рекомендация:"),
+    "advice_completed": ('completed_games', "Отлично, отметил как пройденную. Вот новая рекомендация:"),
+    "advice_not_interested": ('not_interested_games', "Понял, отмечаю как неинтересную. Вот новая рекомендация:"),
+}
+
+@callback_router.on(*ADVICE_MARKS)
+async def advice_mark_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    last_game = context.user_data.get('last_recommended_game')
+    if not last_game:
+        return
+    mark_type, text = ADVICE_MARKS[update.callback_query.data]
+    await add_game_mark(update.effective_user.id, last_game, mark_type)
+    await update.callback_query.edit_message_text(text, reply_markup=NEW_ADVICE_KEYBOARD)
+    context.user_data['last_recommended_game'] = None
+    await send_advice(update, context)
+
+@callback_router.on("cancel_order_parsing")
+async def cancel_order_parsing_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Отменяем парсинг заказа и возвращаемся к началу
+    context.user_data.pop('pending_orders', None)
+    await update.callback_query.edit_message_text(
+        "❌ **Парсинг заказа отменен**\n\n"
+        "Бот перезагружен. Используйте команду /start для начала работы."
+    )
+    return ConversationHandler.END
 
-# Обработчик callback'ов для кнопок
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    
+    return await callback_router.dispatch(query.data, update, context)
+
+# Кнопки закрепленной reply-клавиатуры: текст кнопки -> экран или обработчик, остальное — поиск игры
+button_router = Router(render=reply_screen, fallback=search_game)
+
+button_router.screen("📚 Мои игры", LIBRARY_SCREEN)
+button_router.screen("🏠 Аренда", RENTAL_SCREEN)
+button_router.screen("🛒 Покупка", PURCHASE_SCREEN)
+button_router.screen("⚙️ Функции бота", FUNCTIONS_SCREEN)
+button_router.screen("❓ Помощь", Screen(
+    "❓ **Помощь:**\n\n"
+    "🎮 **Во что поиграть?** - получить персональную рекомендацию игры\n"
+    "🆕 **Новинки** - показать последние 25 игр\n"
+    "📚 **Мои игры** - посмотреть пройденные, сыгранные и неинтересные игры\n"
+    "🏠 **Аренда** - аренда игр, PS Plus, продление аренды\n"
+    "🛒 **Покупка** - купить игры и подписки навсегда\n"
+    "⚙️ **Функции бота** - описание всех возможностей\n\n"
+    "💡 **Советы по использованию:**\n"
+    "• Напиши название игры для поиска\n"
+    "• Используй кнопки для быстрой навигации\n"
+    "• Отмечай игры, чтобы получать более точные рекомендации\n"
+    "• В разделе 'Аренда' можно продлить игру промокодом ARENALOVE\n"
+    "• В разделе 'Покупка' можно купить игры дешевле или навсегда\n\n"
+    "🔗 **Полезные ссылки:**\n"
+    "• Купить навсегда: https://arenapsgm.ru/P2P3\n"
+    "• Группа покупки: @StorePSGM\n"
+    "• Группа аренды: @ArenaPSGMrent\n"
+    "• По вопросам: @ArenaPSGMadmin"
+))
+button_router.on("🆕 Новинки")(new_releases_command)
+button_router.on("🎮 Во что поиграть?")(advice_callback)
+
+# --- Обновление каталога ---
+async def reload_catalog(force=False):
+    """Собирает новую версию каталога вне event loop и атомарно подменяет текущую"""
+    old_catalog = catalog.get_catalog()
+    result = await asyncio.to_thread(catalog.reload_catalog, force)
+    if result is None:
+        return None
+    new_catalog, parse_ms = result
+    catalog.set_catalog(new_catalog)
+    logging.info(f"Каталог заменен: {len(old_catalog)} -> {len(new_catalog)} игр (версия {new_catalog.version})")
+    return old_catalog, new_catalog, parse_ms
+
+async def catalog_refresh_worker(app):
+    while True:
+        try:
+            await reload_catalog()
+        except Exception as e:
+            logging.error(f"Ошибка обновления каталога: {e}")
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+
+# --- Команда /reloadcatalog ---
+async def reloadcatalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Принудительно перезагружает каталог"""
     user_id = update.effective_user.id
-    data = query.data
-    
-    if data == "search_game":
-        await query.edit_message_text(
-            "🔍 **Поиск игры**\n\nНапиши название игры или её часть, и я пришлю ссылку на аренду или покупку.\n\nПримеры:\n• God of War\n• FIFA\n• Spider-Man",
-            reply_markup=get_main_keyboard()
-        )
-    elif data == "advice":
-        context.user_data['last_recommended_game'] = None  # Сбрасываем для новой рекомендации
-        await send_advice(update, context)
-    elif data == "new_releases":
-        await new_releases_command(update, context)
-    elif data == "library":
-        await query.edit_message_text(
-            "📚 **Моя библиотека игр**\n\nВыбери категорию:",
-            reply_markup=get_library_keyboard()
-        )
-    elif data == "rental":
-        await query.edit_message_text(
-            "🏠 **Аренда игр**\n\nВыбери действие:",
-            reply_markup=get_rental_keyboard()
-        )
-    elif data == "functions":
-        await query.edit_message_text(
-            "Привет! 👋\n"
-            "Я помогу найти игры для PlayStation: просто напиши название игры или её часть, и я пришлю ссылку на аренду или покупку.\n"
-            "Кроме того, я могу:\n"
-            "🎮 Посоветовать интересные игры, если не знаешь, во что поиграть\n"
-            "📚 Хранить твою библиотеку пройденных и сыгранных игр, чтобы не советовать их повторно\n"
-            "🆕 Показывать последние новинки — их всегда можно арендовать у нас!\n\n"
-            "Выбери действие или напиши любое название игры:",
-            reply_markup=get_main_keyboard()
-        )
-    elif data == "help":
-        await query.edit_message_text(
-            "❓ Помощь:\n\n"
-            "🎮 **Дать совет** - получить персональную рекомендацию игры\n"
-            "🆕 **Новинки** - показать последние 25 игр\n"
-            "📚 **Моя библиотека** - посмотреть пройденные, сыгранные и неинтересные игры\n\n"
-            "💡 **Советы по использованию:**\n"
-            "• Напиши название игры для поиска\n"
-            "• Используй кнопки для быстрой навигации\n"
-            "• Отмечай игры, чтобы получать более точные рекомендации\n\n"
-            "🔗 **Полезные ссылки:**\n"
-            "• Сайт: https://arenapsgm.ru/P2P3\n"
-            "• Группа: @StorePSGM",
-            reply_markup=get_main_keyboard()
-        )
-    elif data == "completed":
-        # Всегда показывать список пройденных игр (как /passed)
-        await passed_command(update, context)
-    elif data == "played":
-        # Всегда показывать список сыгранных игр (как /played)
-        await played_command(update, context)
-    elif data == "not_interested":
-        # Всегда показывать список неинтересных игр (как /notinterested)
-        await not_interested_command(update, context)
-    elif data == "back_to_main":
-        await query.edit_message_text(
-            "Главное меню:\n\nВыбери действие или напиши любое название игры:"
-        )
-    
-    # Обработчики для кнопок в режиме рекомендаций
-    elif data == "advice_played" and context.user_data.get('last_recommended_game'):
-        # Отметить игру как сыгранную и дать новую рекомендацию
-        last_game = context.user_data.get('last_recommended_game')
-        add_game_mark(user_id, last_game, 'played_games')
-        await query.edit_message_text("Отлично, отметил как сыгранную. Вот новая рекомендация:", reply_markup=get_new_advice_keyboard())
-        context.user_data['last_recommended_game'] = None
-        await send_advice(update, context)
-    elif data == "advice_completed" and context.user_data.get('last_recommended_game'):
-        # Отметить игру как пройденную и дать новую рекомендацию
-        last_game = context.user_data.get('last_recommended_game')
-        add_game_mark(user_id, last_game, 'completed_games')
-        await query.edit_message_text("Отлично, отметил как пройденную. Вот новая рекомендация:", reply_markup=get_new_advice_keyboard())
-        context.user_data['last_recommended_game'] = None
-        await send_advice(update, context)
-    elif data == "advice_not_interested" and context.user_data.get('last_recommended_game'):
-        # Отметить игру как неинтересную и дать новую рекомендацию
-        last_game = context.user_data.get('last_recommended_game')
-        add_game_mark(user_id, last_game, 'not_interested_games')
-        await query.edit_message_text("Понял, отмечаю как неинтересную. Вот новая рекомендация:", reply_markup=get_new_advice_keyboard())
-        context.user_data['last_recommended_game'] = None
-        await send_advice(update, context)
-    
-    # Обработчики для аренды
-    elif data == "rent_game":
-        await query.edit_message_text(
-            "🎮 **Арендовать игру**\n\n"
-            "Напиши название игры или её часть и я пришлю ссылку на аренду. "
-            "Перейдя по ссылке выбери срок и позицию, после оплаты я передам чек админу и он всё пришлёт.\n\n"
-            "Также все игры представлены на https://arenapsgm.ru/",
-            reply_markup=get_rental_keyboard()
-        )
-    elif data == "rent_ps_plus":
-        await query.edit_message_text(
-            "🎯 **Арендовать PS Plus**\n\n"
-            "Переходи по ссылке для аренды PS Plus:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎮 Арендовать PS Plus", url="https://arenapsgm.ru/playstationplus/tproduct/199915107972-arenda-ps-plus-ps4ps5")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="rental")]
-            ])
-        )
-    elif data == "extend_rental_profile":
-        await query.edit_message_text(
-            "✅ **Продлить аренду профиля**\n\n"
-            "Для продления аренды используй промокод: `ARENALOVE`\n\n"
-            "Напиши название или часть из названия игры, которую нужно продлить:",
-            reply_markup=get_rental_keyboard()
-        )
-    elif data == "end_rental":
-        await query.edit_message_text(
-            "✅ **Завершить аренду**\n\nВыбери вариант:",
-            reply_markup=get_end_rental_keyboard()
-        )
-    elif data == "get_2fa":
-        await query.edit_message_text(
-            "🔐 **Получить код 2FA**\n\n"
-            "Сейчас я это делать не умею, но скоро научусь! Спроси код у @ArenaPSGMadmin",
-            reply_markup=get_rental_keyboard()
-        )
-    elif data == "rental_expired":
-        await query.edit_message_text(
-            "📌 **Важно!** Если при деактивации или выключении общего доступа вы видите QR-код и запрос на вход в сеть – это значит, что консоль или аккаунт были офлайн.\n\n"
-            "✅ В таком случае сначала подключитесь к интернету и войдите в аккаунт, а потом повторите процедуру деактивации.\n"
-            "❌ Просто удалить аккаунт с консоли недостаточно – это может привести к проблемам с системой и консолью!\n\n"
-            "**Как правильно сдать игру?**",
-            reply_markup=get_console_keyboard()
-        )
-    elif data == "early_return":
-        await query.edit_message_text(
-            "📤 **Сдать игру досрочно**\n\n"
-            "За досрочную сдачу аккаунта как правило полагается скидка на следующую игру около 30%\n"
-            "• Скидка активна в течение недели\n"
-            "• Скидка не действует на позиции дешевле 290₽\n"
-            "• Скидка идёт от 14 дней\n"
-            "• Скидка не действует на скидку и на новинки первые 2-3 месяца\n\n"
-            "Промокод на скидку за досрочную сдачу проси у @ArenaPSGMadmin",
-            reply_markup=get_early_return_confirm_keyboard()
-        )
-    elif data == "early_return_confirm":
-        await query.edit_message_text(
-            "**Как правильно сдать игру?**",
-            reply_markup=get_console_keyboard()
-        )
-    elif data == "extend_rental":
-        await query.edit_message_text(
-            "💳 **Продлить игру со скидкой**\n\n"
-            "Для продления игры со скидкой используй промокод: `ARENALOVE`\n\n"
-            "Напиши название или часть из названия игры, которую нужно продлить:",
-            reply_markup=get_rental_keyboard()
-        )
-    elif data == "ps4_guide":
-        await query.edit_message_text(
-            "🎮 **Инструкция для PS4:**\n\n"
-            "• Заходите в Настройки → Управление учетной записью → Активация как основная система PS4\n"
-            "• Нажимаете \"Деактивировать\"\n\n"
-            "После чего пришлите фото деактивации админу @ArenaPSGMadmin\n"
-            "За это уважение и респект 🫡",
-            reply_markup=get_console_keyboard()
-        )
-    elif data == "ps5_guide":
-        await query.edit_message_text(
-            "🎮 **Инструкция для PS5:**\n\n"
-            "• Заходите в Настройки → Пользователи и учётные записи → Другое → Общий доступ к консоли и офлайн-игра\n"
-            "• Нажимаете \"Отключить\"\n\n"
-            "После чего пришлите фото выключения общего доступа админу @ArenaPSGMadmin\n"
-            "За это уважение и респект 🫡",
-            reply_markup=get_console_keyboard()
-        )
-    
-    # Обработчики для покупки
-    elif data == "purchase":
-        await query.edit_message_text(
-            "🛒 **Покупка игр**\n\nВыбери категорию:",
-            reply_markup=get_purchase_keyboard()
-        )
-    elif data == "buy_games":
-        await query.edit_message_text(
-            "🎮 **Купить игры**\n\nВыбери вариант:",
-            reply_markup=get_buy_games_keyboard()
-        )
-    elif data == "buy_cheaper":
-        await query.edit_message_text(
-            "💰 **Купить дешевле**\n\n"
-            "Переходи по ссылке для покупки игр по выгодным ценам:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💰 Купить дешевле", url="https://arenapsgm.ru/P2P3")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="buy_games")]
-            ])
-        )
-    elif data == "buy_full":
-        await query.edit_message_text(
-            "💎 **Полная покупка**\n\nВыбери варианты:",
-            reply_markup=get_buy_full_keyboard()
-        )
-    elif data == "buy_sale":
-        await query.edit_message_text(
-            "🔥 **Распродажа**\n\n"
-            "Переходи по ссылке для покупки игр со скидками:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔥 Распродажа", url="https://arenapsgm.ru/whattobuysale")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="buy_full")]
-            ])
-        )
-    elif data == "buy_outside_sale":
-        await query.edit_message_text(
-            "🎯 **Игра вне распродажи**\n\n"
-            "Для уточнения стоимости игры, которой нет в распродаже, свяжитесь с администратором:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💬 Связаться с админом", url="https://t.me/ArenaPSGMadmin")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="buy_full")]
-            ])
-        )
-    elif data == "buy_subscription":
-        await query.edit_message_text(
-            "📱 **Купить Подписку**\n\nВыбери подписку:",
-            reply_markup=get_buy_subscription_keyboard()
-        )
-    elif data == "buy_ps_plus":
-        await query.edit_message_text(
-            "🎮 **Купить PS Plus**\n\n"
-            "Переходи по ссылке для покупки PS Plus:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎮 Купить PS Plus", url="https://arenapsgm.ru/playstationplus")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="buy_subscription")]
-            ])
-        )
-    elif data == "buy_ea_play":
-        await query.edit_message_text(
-            "🎯 **Купить EA Play**\n\n"
-            "Переходи по ссылке для покупки EA Play:",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎯 Купить EA Play", url="https://arenapsgm.ru/eaplay")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="buy_subscription")]
-            ])
-        )
-    elif data == "cancel_order_parsing":
-        # Отменяем парсинг заказа и возвращаемся к началу
-        if 'pending_order' in context.user_data:
-            del context.user_data['pending_order']
-        
-        await query.edit_message_text(
-            "❌ **Парсинг заказа отменен**\n\n"
-            "Бот перезагружен. Используйте команду /start для начала работы.",
-            reply_markup=get_main_keyboard()
-        )
-        return ConversationHandler.END
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("У тебя нет прав для этой команды.")
+        return
+
+    try:
+        old_catalog, new_catalog, parse_ms = await reload_catalog(force=True)
+    except Exception as e:
+        await update.message.reply_text(f"Ошибка при обновлении каталога: {e}")
+        return
+
+    delta = len(new_catalog) - len(old_catalog)
+    await update.message.reply_text(
+        f"Каталог обновлен: было {len(old_catalog)}, стало {len(new_catalog)} игр ({delta:+d}).\n"
+        f"Разбор таблицы: {parse_ms:.0f} мс. Версия: {new_catalog.version}"
+    )
 
 async def on_startup(app):
-    app.create_task(scheduled_messages_worker(app))
+    app.create_task(message_scheduler.run(app))
+    app.create_task(catalog_refresh_worker(app))
+    app.create_task(write_buffer.run())
+    app.create_task(resume_broadcasts(app))
+    app.create_task(admin_digest_worker(app))
+    app.create_task(channel_mirror.run(app.bot))
+    app.create_task(rental_outbox.run())
+    app.create_task(run_account_pool())
+    app.create_task(rental_reminders.run(app))
+
+async def on_shutdown(app):
+    for task in list(broadcast_tasks):
+        task.cancel()
+    await asyncio.gather(*broadcast_tasks, return_exceptions=True)
+    await flush_admin_digest(app)
+    await channel_mirror.flush(app.bot)
+    await rental_outbox.close()
+    await write_buffer.flush()
+    repo.shutdown()
 
 if __name__ == '__main__':
     TOKEN = os.getenv('BOT_TOKEN')
@@ -1489,7 +1808,10 @@ if __name__ == '__main__':
         ],
         states={
             ASKING_IF_WANT_NEW: [MessageHandler(filters.TEXT & (~filters.COMMAND), handle_button_press)],
-            WAITING_FOR_ACCOUNT_DATA: [MessageHandler(filters.TEXT & (~filters.COMMAND), handle_account_data)],
+            WAITING_FOR_ACCOUNT_DATA: [
+                MessageHandler(filters.FORWARDED & filters.CAPTION, handle_forwarded_message),
+                MessageHandler(filters.TEXT & (~filters.COMMAND), handle_account_data),
+            ],
         },
         fallbacks=[]
     )
@@ -1505,13 +1827,20 @@ if __name__ == '__main__':
     app.add_handler(CommandHandler('newreleases', new_releases_command))
     app.add_handler(CommandHandler('sendto', sendto_command))
     app.add_handler(CommandHandler('sendtoall', sendtoall_command))
+    app.add_handler(CommandHandler('resumebroadcast', resumebroadcast_command))
     app.add_handler(CommandHandler('deletebroadcast', deletebroadcast_command))
     app.add_handler(CommandHandler('listbroadcasts', listbroadcasts_command))
     app.add_handler(CommandHandler('schedule', schedule_command))
+    app.add_handler(CommandHandler('reloadcatalog', reloadcatalog_command))
+    app.add_handler(CommandHandler('dbstats', dbstats_command))
+    app.add_handler(CommandHandler('addaccount', addaccount_command))
+    app.add_handler(CommandHandler('accounts', accounts_command))
+    app.add_handler(CommandHandler('releaseaccount', releaseaccount_command))
     app.add_handler(CallbackQueryHandler(button_callback))
     app.add_handler(conv_handler)
 
     app.post_init = on_startup
+    app.post_stop = on_shutdown
 
     logging.info("Бот запущен...")
     app.run_polling()
@@ -0,0 +1,487 @@
+import re
+import time
+import hashlib
+import random
+import logging
+import asyncio
+from collections import deque
+
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import RetryAfter, TimedOut, NetworkError, BadRequest, Forbidden
+
+# Движок массовых операций с сообщениями (рассылки, удаление рассылок):
+# общий ограничитель скорости под лимиты Telegram, пул параллельных отправок,
+# повторы с экспоненциальной задержкой и отчет о прогрессе правкой одного сообщения
+
+GLOBAL_RATE_PER_SECOND = 25  # Telegram разрешает ~30 сообщений в секунду на бота, оставляем запас
+PER_CHAT_INTERVAL = 1.0  # не чаще одного сообщения в секунду в один чат
+BROADCAST_CONCURRENCY = 10  # одновременных запросов к Bot API
+MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0  # секунд, удваивается с каждой попыткой
+PROGRESS_INTERVAL = 3.0  # секунд между обновлениями статуса
+CHECKPOINT_SIZE = 100  # получателей между сохранениями прогресса рассылки
+DELETE_WINDOW = 48 * 3600  # Telegram позволяет боту удалять свои сообщения только в течение 48 часов
+CHANNEL_BATCH_INTERVAL = 3.0  # секунд между постами в канал
+CHANNEL_MAX_PENDING = 1000  # записей в очереди канала, старые отбрасываются
+MAX_MESSAGE_LENGTH = 4096
+
+BUTTON_PATTERN = re.compile(r'\[([^\]]+)\|([^\]]+)\]')
+URL_PATTERN = re.compile(r'https?://[^\s]+')
+SPACES_PATTERN = re.compile(r'\s+')
+# Ответы Telegram на устаревший или чужой file_id
+STALE_FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file_id')
+
+
+class FloodLimiter:
+    """Token bucket на все запросы бота плюс минимальный интервал между сообщениями в один чат.
+    RetryAfter от Telegram приостанавливает весь поток запросов"""
+
+    def __init__(self, rate=GLOBAL_RATE_PER_SECOND, per_chat_interval=PER_CHAT_INTERVAL):
+        self._rate = rate
+        self._capacity = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._per_chat_interval = per_chat_interval
+        self._chat_next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, chat_id):
+        # Интервал для конкретного чата резервируем сразу, чтобы параллельные задачи не сталкивались
+        now = time.monotonic()
+        slot = max(now, self._chat_next_slot.get(chat_id, 0.0))
+        self._chat_next_slot[chat_id] = slot + self._per_chat_interval
+        if len(self._chat_next_slot) > 10000:
+            self._chat_next_slot = {chat: t for chat, t in self._chat_next_slot.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Общий ограничитель для всех массовых операций бота
+limiter = FloodLimiter()
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def call_with_retries(chat_id, call, attempts=MAX_ATTEMPTS):
+    """Вызов Bot API через ограничитель: RetryAfter соблюдается, сетевые ошибки повторяются
+    с экспоненциальной задержкой, Forbidden/BadRequest (бот заблокирован, чат удален) — сразу наверх"""
+    for attempt in range(attempts):
+        await limiter.wait(chat_id)
+        try:
+            return await call()
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            logging.warning(f"Telegram попросил подождать {delay:.0f} с")
+            limiter.pause(delay)
+            if attempt == attempts - 1:
+                raise
+        except (BadRequest, Forbidden):
+            raise
+        except (TimedOut, NetworkError):
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt + random.random())
+
+
+async def run_concurrently(items, handler, concurrency=BROADCAST_CONCURRENCY):
+    """Обрабатывает элементы (обычный или асинхронный итератор) пулом из concurrency задач.
+    Элементы читаются по мере обработки, поэтому источник не загружается в память целиком"""
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    done = object()
+
+    async def produce():
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        for _ in range(concurrency):
+            await queue.put(done)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            await handler(item)
+
+    producer = asyncio.create_task(produce())
+    try:
+        await asyncio.gather(producer, *(consume() for _ in range(concurrency)))
+    finally:
+        producer.cancel()
+
+
+class ProgressReporter:
+    """Периодически правит одно статусное сообщение админа текстом из render()"""
+
+    def __init__(self, message, render, interval=PROGRESS_INTERVAL):
+        self._message = message
+        self._render = render
+        self._interval = interval
+        self._last_text = None
+        self._task = None
+
+    async def _update(self):
+        text = self._render()
+        if text == self._last_text:
+            return
+        try:
+            await self._message.edit_text(text)
+            self._last_text = text
+        except Exception as e:
+            logging.warning(f"Не удалось обновить статус: {e}")
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self._update()
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def finish(self):
+        if self._task:
+            self._task.cancel()
+        await self._update()
+
+
+class MediaCache:
+    """URL картинки -> file_id Telegram. Картинка загружается в Telegram один раз,
+    дальше во всех рассылках, /sendto и /schedule отправляется по file_id.
+    load_file_id(key) — корутина чтения из постоянного хранилища, save_file_id(key, record) — запись"""
+
+    def __init__(self, load_file_id, save_file_id):
+        self._load_file_id = load_file_id
+        self._save_file_id = save_file_id
+        self._file_ids = {}
+
+    @staticmethod
+    def key(url):
+        # URL нельзя использовать как ключ Firebase напрямую (точки, слэши)
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+
+    async def get(self, url):
+        if url in self._file_ids:
+            return self._file_ids[url]
+        try:
+            file_id = await self._load_file_id(self.key(url))
+        except Exception as e:
+            logging.error(f"Не удалось прочитать file_id для {url}: {e}")
+            return None
+        if file_id:
+            self._file_ids[url] = file_id
+        return file_id
+
+    def remember(self, url, file_id):
+        self._file_ids[url] = file_id
+        self._save_file_id(self.key(url), {'url': url, 'file_id': file_id})
+
+    def forget(self, url):
+        self._file_ids.pop(url, None)
+
+
+class MessagePayload:
+    """Текст, необязательное фото и inline-кнопки для /sendto и /sendtoall"""
+
+    __slots__ = ('text', 'photo_url', 'buttons')
+
+    def __init__(self, text, photo_url=None, buttons=()):
+        self.text = text
+        self.photo_url = photo_url
+        self.buttons = [tuple(button) for button in buttons]  # (текст, url или callback_data)
+
+    @classmethod
+    def parse(cls, message_text):
+        """Разбирает аргументы команды: кнопки [Текст|URL] / [Текст|callback] и URL фото"""
+        buttons = BUTTON_PATTERN.findall(message_text)
+
+        # Убираем кнопки из текста сообщения
+        message_text = BUTTON_PATTERN.sub('', message_text).strip()
+        message_text = SPACES_PATTERN.sub(' ', message_text)
+
+        # URL фото — первый URL, который не является кнопкой
+        button_urls = {data for _, data in buttons if data.startswith('http')}
+        photo_url = None
+        for url in URL_PATTERN.findall(message_text):
+            if url not in button_urls:
+                photo_url = url
+                break
+
+        if photo_url:
+            message_text = message_text.replace(photo_url, '').strip()
+            message_text = SPACES_PATTERN.sub(' ', message_text)
+
+        return cls(message_text, photo_url, buttons)
+
+    def to_dict(self):
+        return {'message_text': self.text, 'photo_url': self.photo_url,
+                'buttons': [list(button) for button in self.buttons]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('message_text', ''), data.get('photo_url'), data.get('buttons') or ())
+
+    def reply_markup(self):
+        if not self.buttons:
+            return None
+        # Размещаем кнопки по одной в ряд
+        keyboard = []
+        for button_text, button_data in self.buttons:
+            if button_data.startswith('http'):
+                keyboard.append([InlineKeyboardButton(button_text, url=button_data)])
+            else:
+                keyboard.append([InlineKeyboardButton(button_text, callback_data=button_data)])
+        return InlineKeyboardMarkup(keyboard)
+
+    async def send(self, bot, chat_id, reply_markup=None, media_cache=None):
+        if not self.photo_url:
+            return await bot.send_message(chat_id=chat_id, text=self.text, reply_markup=reply_markup)
+
+        file_id = await media_cache.get(self.photo_url) if media_cache else None
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=self.text,
+                                            reply_markup=reply_markup)
+            except BadRequest as e:
+                if not is_stale_file_id_error(e):
+                    raise
+                # file_id больше не действителен — загружаем картинку заново по URL
+                logging.warning(f"file_id для {self.photo_url} не принят Telegram: {e}")
+                media_cache.forget(self.photo_url)
+
+        sent_message = await bot.send_photo(chat_id=chat_id, photo=self.photo_url, caption=self.text,
+                                            reply_markup=reply_markup)
+        if media_cache and sent_message.photo:
+            media_cache.remember(self.photo_url, sent_message.photo[-1].file_id)
+        return sent_message
+
+
+def is_stale_file_id_error(error):
+    """Telegram отверг сохраненный file_id (а не подпись, клавиатуру или чат)"""
+    message = str(error).lower()
+    return any(marker in message for marker in STALE_FILE_ID_ERRORS)
+
+
+class BroadcastJob:
+    """Рассылка одного сообщения с ограничением скорости и прогрессом.
+    Получатели приходят страницами (обычный или асинхронный итератор списков). После каждой
+    страницы вызывается checkpoint(job, last_recipient, sent_to) — корутина, сохраняющая прогресс,
+    поэтому после перезапуска рассылку можно продолжить со следующей страницы.
+    last_recipient — последний элемент страницы, поэтому страницы должны идти в порядке источника"""
+
+    def __init__(self, bot, payload, pages, status_message=None, media_cache=None, checkpoint=None,
+                 sent_count=0, failed_count=0):
+        self.bot = bot
+        self.payload = payload
+        self.pages = pages
+        self.status_message = status_message
+        self.media_cache = media_cache
+        self.checkpoint = checkpoint
+        self.reply_markup = payload.reply_markup()
+        # Пока file_id картинки неизвестен, отправки идут по одной: первая загружает картинку,
+        # остальные получат уже готовый file_id
+        self._media_lock = asyncio.Lock()
+        self._media_ready = not payload.photo_url or media_cache is None
+        self.sent_to = []  # отправленные после последней контрольной точки
+        self.sent_count = sent_count
+        self.failed_count = failed_count
+        self.started_at = time.monotonic()
+
+    def render_progress(self):
+        elapsed = time.monotonic() - self.started_at
+        return (f"📤 Рассылка идет: отправлено {self.sent_count}, ошибок {self.failed_count}, "
+                f"прошло {elapsed:.0f} с")
+
+    async def _send_one(self, target_user_id):
+        if not self._media_ready:
+            async with self._media_lock:
+                if not self._media_ready:
+                    await self._deliver(target_user_id)
+                    self._media_ready = await self.media_cache.get(self.payload.photo_url) is not None
+                    return
+        await self._deliver(target_user_id)
+
+    async def _deliver(self, target_user_id):
+        try:
+            sent_message = await call_with_retries(
+                target_user_id,
+                lambda: self.payload.send(self.bot, target_user_id, self.reply_markup, self.media_cache)
+            )
+        except Exception as e:
+            self.failed_count += 1
+            logging.error(f"Ошибка отправки сообщения пользователю {target_user_id}: {e}")
+            return
+        # Сохраняем информацию о сообщении для возможности удаления
+        self.sent_to.append({
+            'user_id': target_user_id,
+            'message_id': sent_message.message_id,
+            'chat_id': target_user_id
+        })
+        self.sent_count += 1
+
+    async def run(self):
+        reporter = None
+        if self.status_message:
+            reporter = ProgressReporter(self.status_message, self.render_progress)
+            reporter.start()
+        try:
+            if hasattr(self.pages, '__aiter__'):
+                async for page in self.pages:
+                    await self._run_page(page)
+            else:
+                for page in self.pages:
+                    await self._run_page(page)
+        finally:
+            if reporter:
+                await reporter.finish()
+        return self
+
+    async def _run_page(self, page):
+        if not page:
+            return
+        await run_concurrently(page, self._send_one)
+        sent_to, self.sent_to = self.sent_to, []
+        if self.checkpoint:
+            await self.checkpoint(self, page[-1], sent_to)
+
+
+class DeletionJob:
+    """Параллельное удаление сообщений рассылки через общий ограничитель.
+    messages — список (ключ, chat_id, message_id). После каждой страницы вызывается
+    checkpoint(job, deleted_keys), чтобы повторный запуск удалял только оставшиеся.
+    После deadline (unix-время) запросы не отправляются — Telegram их все равно отклонит"""
+
+    def __init__(self, bot, messages, deadline, status_message=None, checkpoint=None):
+        self.bot = bot
+        self.messages = messages
+        self.deadline = deadline
+        self.status_message = status_message
+        self.checkpoint = checkpoint
+        self.deleted_keys = []  # удаленные после последней контрольной точки
+        self.deleted_count = 0
+        self.failed_count = 0
+        self.expired_count = 0
+        self.started_at = time.monotonic()
+
+    def render_progress(self):
+        elapsed = time.monotonic() - self.started_at
+        return (f"🗑️ Удаление идет: удалено {self.deleted_count} из {len(self.messages)}, "
+                f"ошибок {self.failed_count}, прошло {elapsed:.0f} с")
+
+    async def _delete_one(self, message):
+        key, chat_id, message_id = message
+        if time.time() >= self.deadline:
+            self.expired_count += 1
+            return
+        try:
+            await call_with_retries(chat_id, lambda: self.bot.delete_message(chat_id=chat_id, message_id=message_id))
+        except BadRequest as e:
+            if 'not found' not in str(e).lower():
+                self.failed_count += 1
+                logging.error(f"Ошибка удаления сообщения {message_id} у пользователя {chat_id}: {e}")
+                return
+            # Пользователь уже удалил сообщение сам — повторять нечего
+        except Exception as e:
+            self.failed_count += 1
+            logging.error(f"Ошибка удаления сообщения {message_id} у пользователя {chat_id}: {e}")
+            return
+        self.deleted_keys.append(key)
+        self.deleted_count += 1
+
+    async def run(self):
+        reporter = None
+        if self.status_message:
+            reporter = ProgressReporter(self.status_message, self.render_progress)
+            reporter.start()
+        try:
+            for start in range(0, len(self.messages), CHECKPOINT_SIZE):
+                await run_concurrently(self.messages[start:start + CHECKPOINT_SIZE], self._delete_one)
+                deleted_keys, self.deleted_keys = self.deleted_keys, []
+                if self.checkpoint and deleted_keys:
+                    await self.checkpoint(self, deleted_keys)
+        finally:
+            if reporter:
+                await reporter.finish()
+        return self
+
+
+class ChannelMirror:
+    """Очередь записей для служебного канала: накопленное за interval секунд уходит одним постом
+    (или несколькими, если не влезает в лимит длины) через общий ограничитель"""
+
+    def __init__(self, chat_id, interval=CHANNEL_BATCH_INTERVAL, max_pending=CHANNEL_MAX_PENDING):
+        self._chat_id = chat_id
+        self._interval = interval
+        self._pending = deque()
+        self._max_pending = max_pending
+        self.posted = 0
+        self.posts = 0
+        self.dropped = 0
+
+    def put(self, text):
+        self._pending.append(text[:MAX_MESSAGE_LENGTH])
+        self._trim()
+
+    def _trim(self):
+        """При переполнении очереди отбрасывает самые старые записи и пишет об этом в лог"""
+        overflow = len(self._pending) - self._max_pending
+        if overflow <= 0:
+            return
+        for _ in range(overflow):
+            self._pending.popleft()
+        self.dropped += overflow
+        logging.warning(f"Очередь канала переполнена: отброшено старых записей {overflow} (всего {self.dropped})")
+
+    def _take_post(self):
+        parts = [self._pending.popleft()]
+        length = len(parts[0])
+        while self._pending and length + 2 + len(self._pending[0]) <= MAX_MESSAGE_LENGTH:
+            text = self._pending.popleft()
+            parts.append(text)
+            length += 2 + len(text)
+        return parts
+
+    async def flush(self, bot):
+        while self._pending:
+            parts = self._take_post()
+            text = "\n\n".join(parts)
+            try:
+                await call_with_retries(self._chat_id, lambda: bot.send_message(chat_id=self._chat_id, text=text))
+            except Exception as e:
+                # Записи возвращаются в начало очереди и уйдут при следующей отправке
+                self._pending.extendleft(reversed(parts))
+                self._trim()
+                logging.error(f"Ошибка отправки в канал ({len(parts)} записей, отложены): {e}")
+                return
+            self.posted += len(parts)
+            self.posts += 1
+
+    async def run(self, bot):
+        """Фоновый цикл отправки в канал"""
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.flush(bot)
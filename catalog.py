@@ -0,0 +1,189 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+import pandas as pd
+import requests
+
+from search_index import SearchIndex
+
+# Каталог игр: локальный снимок таблицы Title/Url и фоновое обновление с GitHub
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CATALOG_URL = 'https://github.com/chekoli911/AGSGM_BOT/raw/main/store-8370478-Vse_igri-202507290225_fixed.xlsx'
+BUNDLED_XLSX_PATH = os.path.join(BASE_DIR, 'store-8370478-Vse_igri-202507290225_fixed.xlsx')
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'catalog_snapshot.pkl')
+
+CATALOG_COLUMNS = ['Title', 'Url']
+CATALOG_HTTP_TIMEOUT = 30  # секунд на скачивание XLSX
+CATALOG_REMAP_DEPTH = 3  # для скольких прошлых версий храним пересчет номеров строк
+
+# Валидаторы последней загруженной версии (ETag / Last-Modified)
+_validators = {'etag': None, 'last_modified': None}
+# Периодическое и ручное обновление не должны идти одновременно
+_reload_lock = threading.Lock()
+
+
+def read_catalog_xlsx(source):
+    """Читает XLSX (путь или байты) в DataFrame с колонками Title/Url"""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    df = pd.read_excel(source, usecols=CATALOG_COLUMNS)
+    return df.dropna(subset=['Title']).reset_index(drop=True)
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """Загружает локальный снимок каталога, None если его нет или он поврежден"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        snapshot['df'] = pd.DataFrame({'Title': snapshot.pop('titles'), 'Url': snapshot.pop('urls')})
+        return snapshot
+    except Exception as e:
+        logging.error(f"Не удалось прочитать снимок каталога {path}: {e}")
+        return None
+
+
+def save_snapshot(df, etag=None, last_modified=None, path=SNAPSHOT_PATH):
+    """Атомарно сохраняет снимок каталога (списки вместо DataFrame, чтобы не зависеть от версии pandas)"""
+    snapshot = {
+        'titles': df['Title'].tolist(),
+        'urls': df['Url'].tolist(),
+        'etag': etag,
+        'last_modified': last_modified,
+        'saved_at': int(time.time()),
+    }
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить снимок каталога: {e}")
+
+
+class Catalog:
+    """Версия каталога вместе со всеми производными индексами.
+    После сборки не изменяется, обновление — только заменой целиком через set_catalog()"""
+
+    __slots__ = ('df', 'titles', 'urls', 'entries', 'row_by_title', 'version', 'loaded_at', 'search_index',
+                 'remaps')
+
+    def __init__(self, df, previous=None):
+        self.df = df
+        self.titles = df['Title'].astype(str).tolist()
+        self.urls = df['Url'].astype(str).tolist()
+        # Готовые строки "название\nссылка" для выдачи результатов
+        self.entries = (df['Title'].astype(str) + '\n' + df['Url'].astype(str)).tolist()
+        # Название -> номер строки (для дубликатов — первая)
+        self.row_by_title = {}
+        for row, title in enumerate(self.titles):
+            self.row_by_title.setdefault(title, row)
+        self.version = hashlib.sha1('\n'.join(self.titles).encode('utf-8')).hexdigest()[:12]
+        self.loaded_at = int(time.time())
+        self.search_index = SearchIndex(self.titles)
+
+        # Версия прошлого каталога -> список "старый номер строки -> новый (или -1)".
+        # Нужен, чтобы сохраненные курсоры рекомендаций пережили обновление каталога
+        self.remaps = {}
+        if previous is not None:
+            if previous.version == self.version:
+                self.remaps = dict(previous.remaps)
+            else:
+                remap = [self.row_by_title.get(title, -1) for title in previous.titles]
+                self.remaps[previous.version] = remap
+                for version, old_remap in list(previous.remaps.items())[:CATALOG_REMAP_DEPTH - 1]:
+                    self.remaps[version] = [remap[row] if row >= 0 else -1 for row in old_remap]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def rows_for_titles(self, titles):
+        """Множество номеров строк для названий; названий, которых нет в каталоге, пропускаются"""
+        row_by_title = self.row_by_title
+        return {row_by_title[title] for title in titles if title in row_by_title}
+
+
+_current = None
+
+
+def get_catalog():
+    """Текущая версия каталога. Обработчик берет ее один раз и работает только с ней"""
+    return _current
+
+
+def set_catalog(new_catalog):
+    """Атомарная замена каталога: одна операция присваивания ссылки"""
+    global _current
+    _current = new_catalog
+
+
+def load_catalog():
+    """Быстрый старт: снимок -> XLSX из репозитория -> скачивание с GitHub"""
+    started = time.perf_counter()
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        df = snapshot['df']
+        _validators['etag'] = snapshot.get('etag')
+        _validators['last_modified'] = snapshot.get('last_modified')
+        source = 'снимок'
+    elif os.path.exists(BUNDLED_XLSX_PATH):
+        df = read_catalog_xlsx(BUNDLED_XLSX_PATH)
+        save_snapshot(df)
+        source = 'XLSX из репозитория'
+    else:
+        response = requests.get(CATALOG_URL, timeout=CATALOG_HTTP_TIMEOUT)
+        response.raise_for_status()
+        df = read_catalog_xlsx(response.content)
+        _validators['etag'] = response.headers.get('ETag')
+        _validators['last_modified'] = response.headers.get('Last-Modified')
+        save_snapshot(df, _validators['etag'], _validators['last_modified'])
+        source = 'GitHub'
+
+    new_catalog = Catalog(df)
+    set_catalog(new_catalog)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logging.info(f"Каталог загружен ({source}): {len(new_catalog)} игр за {elapsed_ms:.1f} мс")
+    return new_catalog
+
+
+def reload_catalog(force=False):
+    """Скачивает и собирает новую версию каталога, не подменяя текущую.
+    Без force делает условный запрос и возвращает None, если каталог не изменился (304).
+    Возвращает (Catalog, время разбора в мс). Функция блокирующая — вызывать вне event loop"""
+    with _reload_lock:
+        return _reload_catalog(force)
+
+
+def _reload_catalog(force):
+    headers = {}
+    if not force:
+        if _validators['etag']:
+            headers['If-None-Match'] = _validators['etag']
+        if _validators['last_modified']:
+            headers['If-Modified-Since'] = _validators['last_modified']
+
+    response = requests.get(CATALOG_URL, headers=headers, timeout=CATALOG_HTTP_TIMEOUT)
+    if response.status_code == 304:
+        logging.info("Каталог на GitHub не изменился (304)")
+        return None
+    response.raise_for_status()
+
+    started = time.perf_counter()
+    df = read_catalog_xlsx(response.content)
+    new_catalog = Catalog(df, previous=_current)
+    parse_ms = (time.perf_counter() - started) * 1000
+
+    _validators['etag'] = response.headers.get('ETag')
+    _validators['last_modified'] = response.headers.get('Last-Modified')
+    save_snapshot(df, _validators['etag'], _validators['last_modified'])
+
+    logging.info(f"Собрана новая версия каталога {new_catalog.version}: {len(new_catalog)} игр, разбор {parse_ms:.1f} мс")
+    return new_catalog, parse_ms
@@ -0,0 +1,511 @@
+import os
+import re
+import time
+import random
+import logging
+import asyncio
+import threading
+from datetime import datetime, timezone
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import db
+
+# Асинхронный слой доступа к Firebase Realtime Database.
+# firebase_admin.db синхронный, поэтому все вызовы идут через ограниченный пул потоков
+# и не блокируют event loop бота
+
+FIREBASE_POOL_SIZE = int(os.getenv('FIREBASE_POOL_SIZE', 8))
+SLOW_CALL_MS = 1000  # вызовы дольше этого логируются как медленные
+
+WRITE_BUFFER_FLUSH_MS = int(os.getenv('WRITE_BUFFER_FLUSH_MS', 2000))  # период сброса буфера записи
+WRITE_BUFFER_BATCH = 200  # столько путей уходит одним multi-path update
+WRITE_BUFFER_MAX = 10000  # больше путей в памяти не держим, новые записи отбрасываются
+
+SCHEDULE_LOAD_HORIZON = 1800  # секунд вперед, на которые загружаются отложенные сообщения
+# Захват сообщения — аренда на это время: если бот упал между захватом и архивом,
+# сообщение по истечении срока снова считается ожидающим и забирается повторно
+SCHEDULE_CLAIM_LEASE = 600
+
+SUBSCRIBERS_PAGE_SIZE = 500  # id получателей рассылки за один запрос к базе
+
+LIBRARY_CACHE_SIZE = int(os.getenv('LIBRARY_CACHE_SIZE', 5000))  # пользователей в кэше библиотек
+LIBRARY_CACHE_TTL = int(os.getenv('LIBRARY_CACHE_TTL', 600))  # секунд до повторного чтения из базы
+
+# Генерация push-ключей на клиенте (тот же алгоритм, что у Firebase SDK):
+# 8 символов времени в мс + 12 случайных, ключи сортируются по времени создания
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_state = {'last_ms': 0, 'last_random': [0] * 12}
+_push_lock = threading.Lock()
+
+
+def generate_push_id():
+    """Push-ключ Firebase без обращения к серверу, нужен для multi-path update"""
+    with _push_lock:
+        now_ms = int(time.time() * 1000)
+        last_random = _push_state['last_random']
+        if now_ms == _push_state['last_ms']:
+            # В ту же миллисекунду увеличиваем случайную часть, чтобы сохранить порядок
+            for i in range(11, -1, -1):
+                if last_random[i] != 63:
+                    last_random[i] += 1
+                    break
+                last_random[i] = 0
+        else:
+            for i in range(12):
+                last_random[i] = random.randrange(64)
+        _push_state['last_ms'] = now_ms
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now_ms % 64])
+            now_ms //= 64
+        return ''.join(reversed(time_chars)) + ''.join(PUSH_CHARS[i] for i in last_random)
+
+
+# Сервер упорядочивает ключи так: сначала те, что читаются как 32-битное целое (по числу),
+# затем остальные (как строки). firebase_admin пересортировывает результат order_by_key
+# просто как строки, поэтому последний ключ страницы (курсор) берется после firebase_key_order
+_INT_KEY_RE = re.compile(r'-?0*\d{1,10}')
+_INT32_MIN, _INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def firebase_key_order(key):
+    """Ключ сортировки, повторяющий порядок order_by_key на сервере Firebase"""
+    key = str(key)
+    if _INT_KEY_RE.fullmatch(key):
+        number = int(key)
+        if _INT32_MIN <= number <= _INT32_MAX:
+            return 0, number, len(key), ''
+    return 1, 0, 0, key
+
+
+class FirebaseRepository:
+    """Awaitable-методы поверх firebase_admin.db с замером времени каждого вызова"""
+
+    def __init__(self, max_workers=FIREBASE_POOL_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firebase')
+        # операция -> [вызовов, ошибок, суммарное время мс, максимальное время мс]
+        self.stats = {}
+        self._subscribers_ready = False
+        self._scheduled_compacted = False
+
+    async def _call(self, name, func, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(name, (time.perf_counter() - started) * 1000, failed)
+
+    def _record(self, name, elapsed_ms, failed):
+        stat = self.stats.setdefault(name, [0, 0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += int(failed)
+        stat[2] += elapsed_ms
+        stat[3] = max(stat[3], elapsed_ms)
+        if elapsed_ms > SLOW_CALL_MS:
+            logging.warning(f"Медленный вызов Firebase {name}: {elapsed_ms:.0f} мс")
+
+    def format_stats(self):
+        if not self.stats:
+            return "Обращений к Firebase еще не было."
+        lines = ["📊 Firebase: вызовов / ошибок / среднее / максимум"]
+        for name, (count, errors, total_ms, max_ms) in sorted(self.stats.items()):
+            lines.append(f"• {name}: {count} / {errors} / {total_ms / count:.0f} мс / {max_ms:.0f} мс")
+        return "\n".join(lines)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    async def update_paths(self, updates):
+        """Multi-path update: одна запись в базу для множества путей"""
+        await self._call('update_paths', lambda: db.reference('/').update(updates))
+
+    # --- Библиотека пользователя ---
+    async def add_game_mark(self, user_id, game_title, mark_type):
+        await self._call('add_game_mark', lambda: db.reference(f'users/{user_id}/{mark_type}').update({game_title: True}))
+
+    async def get_marked_games(self, user_id, mark_type):
+        data = await self._call('get_marked_games', lambda: db.reference(f'users/{user_id}/{mark_type}').get())
+        return list(data.keys()) if data else []
+
+    async def get_advice_cursor(self, user_id):
+        return await self._call('get_advice_cursor', lambda: db.reference(f'users/{user_id}/advice_cursor').get())
+
+    # --- Получатели рассылок ---
+    # subscribers/{user_id}: true — компактный индекс пользователей. Узел users с логами запросов
+    # и библиотеками для перечисления получателей целиком не читается
+    async def get_subscribers_page(self, start_after=None, limit=SUBSCRIBERS_PAGE_SIZE):
+        """Следующие limit id подписчиков после start_after в серверном порядке ключей"""
+        def read():
+            query = db.reference('subscribers').order_by_key()
+            if start_after is not None:
+                # start_at включает сам ключ, поэтому берем на один больше
+                return query.start_at(start_after).limit_to_first(limit + 1).get()
+            return query.limit_to_first(limit).get()
+
+        data = await self._call('get_subscribers_page', read)
+        keys = sorted(data, key=firebase_key_order) if data else []
+        if start_after is not None and keys and keys[0] == str(start_after):
+            keys = keys[1:]
+        return keys
+
+    async def iter_subscriber_pages(self, start_after=None, page_size=SUBSCRIBERS_PAGE_SIZE):
+        """Асинхронный генератор страниц id подписчиков после start_after,
+        в памяти не больше одной страницы"""
+        await self.ensure_subscribers_index()
+        keys = await self.get_subscribers_page(start_after, page_size)
+        while keys:
+            yield keys
+            keys = await self.get_subscribers_page(keys[-1], page_size)
+
+    async def ensure_subscribers_index(self):
+        """Один раз заполняет индекс по пользователям, появившимся до его введения"""
+        if self._subscribers_ready:
+            return
+        backfilled = await self._call('get_subscribers_meta', lambda: db.reference('meta/subscribers_backfilled').get())
+        if not backfilled:
+            await self.backfill_subscribers()
+            await self.update_paths({'meta/subscribers_backfilled': True})
+        self._subscribers_ready = True
+
+    async def backfill_subscribers(self):
+        """Заполняет subscribers по ключам users (shallow-чтение, без вложенных данных)"""
+        user_keys = await self._call('get_user_keys', lambda: db.reference('users').get(shallow=True))
+        if not user_keys:
+            return 0
+        keys = list(user_keys)
+        for start in range(0, len(keys), WRITE_BUFFER_BATCH):
+            await self.update_paths({f'subscribers/{key}': True for key in keys[start:start + WRITE_BUFFER_BATCH]})
+        logging.info(f"Индекс подписчиков заполнен: {len(keys)} пользователей")
+        return len(keys)
+
+    # --- Рассылки ---
+    # broadcast_summaries/{admin_id}/{id} — краткая запись для /listbroadcasts
+    #   (индекс timestamp на broadcast_summaries/$admin_id — database.rules.json)
+    # broadcast_recipients/{id}/{user_id} — message_id отправленного сообщения
+    # broadcast_jobs/{id} — состояние незавершенной рассылки (status: running или paused после ошибок)
+    async def get_broadcast_summary(self, admin_id, broadcast_id):
+        return await self._call(
+            'get_broadcast_summary', lambda: db.reference(f'broadcast_summaries/{admin_id}/{broadcast_id}').get()
+        )
+
+    async def get_broadcast_recipients(self, broadcast_id):
+        data = await self._call(
+            'get_broadcast_recipients', lambda: db.reference(f'broadcast_recipients/{broadcast_id}').get()
+        )
+        return data or {}
+
+    async def delete_broadcast(self, admin_id, broadcast_id):
+        await self.update_paths({
+            f'broadcast_summaries/{admin_id}/{broadcast_id}': None,
+            f'broadcast_recipients/{broadcast_id}': None,
+            f'broadcast_jobs/{broadcast_id}': None,
+        })
+
+    async def get_recent_broadcasts(self, admin_id, limit=10):
+        """Последние limit рассылок админа, новые первыми — один индексированный запрос"""
+        data = await self._call(
+            'get_recent_broadcasts',
+            lambda: db.reference(f'broadcast_summaries/{admin_id}').order_by_child('timestamp').limit_to_last(limit).get()
+        )
+        return list(reversed(list(data.items()))) if data else []
+
+    async def get_broadcast_job(self, broadcast_id):
+        return await self._call('get_broadcast_job', lambda: db.reference(f'broadcast_jobs/{broadcast_id}').get())
+
+    async def get_broadcast_jobs(self):
+        """Незавершенные рассылки: broadcast_jobs/{id} — состояние задачи без списка получателей"""
+        return await self._call('get_broadcast_jobs', lambda: db.reference('broadcast_jobs').get())
+
+    async def migrate_legacy_broadcasts(self):
+        """Один раз переносит старые записи broadcasts/{id} (со списком sent_to внутри)
+        в broadcast_summaries и broadcast_recipients"""
+        migrated = await self._call('get_broadcasts_meta', lambda: db.reference('meta/broadcasts_migrated').get())
+        if migrated:
+            return 0
+        legacy = await self._call('get_legacy_broadcasts', lambda: db.reference('broadcasts').get()) or {}
+        skipped = []
+        for broadcast_id, info in legacy.items():
+            if not info.get('admin_id'):
+                # Без admin_id запись не попадет ни в чей /listbroadcasts — оставляем ее в broadcasts
+                skipped.append(broadcast_id)
+                continue
+            sent_to = info.get('sent_to') or {}
+            if isinstance(sent_to, dict):
+                recipients = {str(user_id): message_id for user_id, message_id in sent_to.items()
+                              if not isinstance(message_id, dict)}
+            else:
+                recipients = {str(entry['chat_id']): entry['message_id'] for entry in sent_to if entry}
+            summary = {key: info.get(key) for key in ('admin_id', 'timestamp', 'message_text', 'photo_url', 'has_buttons')}
+            summary['status'] = info.get('status', 'done')
+            summary['sent_count'] = info.get('sent_count', len(recipients))
+            await self.update_paths({
+                f'broadcast_summaries/{info.get("admin_id")}/{broadcast_id}': summary,
+                f'broadcast_recipients/{broadcast_id}': recipients or None,
+                f'broadcasts/{broadcast_id}': None,
+            })
+        await self.update_paths({'meta/broadcasts_migrated': True})
+        if skipped:
+            logging.warning(f"Старые рассылки без admin_id не перенесены и остались в broadcasts: {', '.join(skipped)}")
+        migrated_count = len(legacy) - len(skipped)
+        if migrated_count:
+            logging.info(f"Перенесено старых рассылок: {migrated_count}")
+        return migrated_count
+
+    async def get_media_file_id(self, key):
+        record = await self._call('get_media_file_id', lambda: db.reference(f'media_cache/{key}').get())
+        return record.get('file_id') if record else None
+
+    async def get_user_id_by_username(self, username):
+        """usernames/{ник в нижнем регистре} -> id пользователя (пишется при запросах пользователя)"""
+        return await self._call('get_user_id_by_username', lambda: db.reference(f'usernames/{username}').get())
+
+    # --- Инвентарь аккаунтов ---
+    # accounts/{id} — аккаунты для аренды; индексы для выдачи строятся в памяти (accounts.AccountPool)
+    async def get_accounts(self):
+        """Все аккаунты одним запросом — для перестройки индекса при запуске"""
+        return await self._call('get_accounts', lambda: db.reference('accounts').get()) or {}
+
+    async def save_account(self, account_id, record):
+        await self._call('save_account', lambda: db.reference(f'accounts/{account_id}').set(record))
+
+    async def set_accounts_busy(self, busy):
+        """busy: {id аккаунта: (busy_until, номер заказа)} — одной записью"""
+        updates = {}
+        for account_id, (busy_until, order_number) in busy.items():
+            updates[f'accounts/{account_id}/busy_until'] = busy_until
+            updates[f'accounts/{account_id}/order_number'] = order_number
+        if updates:
+            await self.update_paths(updates)
+
+    # --- Отложенные сообщения ---
+    # scheduled_messages/{key} — только ожидающие отправки (индексы send_at и status — database.rules.json),
+    # отправленные и неотправляемые переносятся в scheduled_archive/{yyyy-mm}/{key}
+    async def push_scheduled_message(self, message):
+        ref = await self._call('push_scheduled_message', lambda: db.reference('scheduled_messages').push(message))
+        return ref.key
+
+    async def get_pending_scheduled_messages(self, horizon=SCHEDULE_LOAD_HORIZON):
+        """Сообщения со временем отправки не позже now + horizon. Архив в выборку не попадает,
+        поэтому стоимость зависит только от числа ближайших сообщений"""
+        await self.compact_scheduled_messages()
+        until = int(time.time()) + horizon
+        data = await self._call(
+            'get_pending_scheduled_messages',
+            lambda: db.reference('scheduled_messages').order_by_child('send_at').end_at(until).get()
+        )
+        now = int(time.time())
+        return {key: message for key, message in (data or {}).items() if _is_claimable(message, now)}
+
+    async def compact_scheduled_messages(self):
+        """Один раз переносит в архив отправленные сообщения, накопленные до введения архива,
+        и возвращает в ожидание сообщения, застрявшие в sending с истекшим захватом"""
+        if self._scheduled_compacted:
+            return
+        compacted = await self._call('get_scheduled_meta', lambda: db.reference('meta/scheduled_compacted').get())
+        if not compacted:
+            sent = await self._call(
+                'get_sent_scheduled_messages',
+                lambda: db.reference('scheduled_messages').order_by_child('status').equal_to('sent').get()
+            ) or {}
+            items = list(sent.items())
+            for start in range(0, len(items), WRITE_BUFFER_BATCH):
+                updates = {}
+                for key, message in items[start:start + WRITE_BUFFER_BATCH]:
+                    updates.update(_archive_paths(key, message))
+                await self.update_paths(updates)
+            await self.update_paths({'meta/scheduled_compacted': True})
+            if items:
+                logging.info(f"Перенесено в архив отправленных отложенных сообщений: {len(items)}")
+        await self.reclaim_stale_scheduled_messages()
+        self._scheduled_compacted = True
+
+    async def reclaim_stale_scheduled_messages(self):
+        """Возвращает в pending сообщения, захват которых истек (бот упал до отправки или архива)"""
+        sending = await self._call(
+            'get_sending_scheduled_messages',
+            lambda: db.reference('scheduled_messages').order_by_child('status').equal_to('sending').get()
+        ) or {}
+        now = int(time.time())
+        updates = {}
+        for key, message in sending.items():
+            if _is_claimable(message, now):
+                updates[f'scheduled_messages/{key}/status'] = 'pending'
+                updates[f'scheduled_messages/{key}/claimed_at'] = None
+                updates[f'scheduled_messages/{key}/attempts'] = message.get('attempts', 0) + 1
+        if updates:
+            await self.update_paths(updates)
+            logging.info(f"Возвращено в ожидание зависших отложенных сообщений: {len(updates) // 3}")
+
+    async def claim_scheduled_message(self, key):
+        """Атомарно переводит сообщение из pending (или sending с истекшим захватом) в sending.
+        Возвращает данные сообщения или None, если его уже забрал другой экземпляр бота"""
+        def update(current):
+            now = int(time.time())
+            if not current or not _is_claimable(current, now):
+                raise _AlreadyClaimed()
+            claimed = {**current, 'status': 'sending', 'claimed_at': now}
+            if current.get('status') == 'sending':
+                # Предыдущий захват не завершился — считаем это неудачной попыткой
+                claimed['attempts'] = current.get('attempts', 0) + 1
+            return claimed
+
+        def claim():
+            try:
+                return db.reference(f'scheduled_messages/{key}').transaction(update)
+            except _AlreadyClaimed:
+                return None
+
+        return await self._call('claim_scheduled_message', claim)
+
+    async def release_scheduled_message(self, key, message, attempts, retry_at):
+        """Возвращает сообщение в ожидание до retry_at или переносит в архив как неотправленное (retry_at=None)"""
+        if retry_at is None:
+            await self.archive_scheduled_message(key, {**message, 'attempts': attempts}, 'failed')
+            return
+        changes = {'status': 'pending', 'attempts': attempts, 'send_at': retry_at}
+        await self._call('release_scheduled_message', lambda: db.reference(f'scheduled_messages/{key}').update(changes))
+
+    async def archive_scheduled_message(self, key, message, status):
+        """Одной записью удаляет сообщение из очереди и кладет в архив месяца отправки"""
+        await self.update_paths(_archive_paths(key, {**message, 'status': status, 'finished_at': int(time.time())}))
+
+
+def _is_claimable(message, now):
+    """Ожидает отправки или захвачено, но захват истек"""
+    status = message.get('status')
+    if status == 'pending':
+        return True
+    return status == 'sending' and (message.get('claimed_at') or 0) + SCHEDULE_CLAIM_LEASE <= now
+
+
+def _archive_paths(key, message):
+    month = datetime.fromtimestamp(message.get('send_at', 0), timezone.utc).strftime('%Y-%m')
+    return {f'scheduled_messages/{key}': None, f'scheduled_archive/{month}/{key}': message}
+
+
+class _AlreadyClaimed(Exception):
+    """Прерывает транзакцию захвата отложенного сообщения"""
+
+
+class WriteBehindBuffer:
+    """Отложенная запись некритичных данных (лог запросов и т.п.).
+    Пути копятся в памяти и сбрасываются пачками по таймеру или при накоплении пачки.
+    Повторная запись того же пути до сброса просто заменяет значение"""
+
+    def __init__(self, repo, flush_interval_ms=WRITE_BUFFER_FLUSH_MS, batch_size=WRITE_BUFFER_BATCH,
+                 max_pending=WRITE_BUFFER_MAX):
+        self._repo = repo
+        self._flush_interval = flush_interval_ms / 1000
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def put(self, path, value):
+        if path not in self._pending and len(self._pending) >= self._max_pending:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logging.warning(f"Буфер записи переполнен, отброшено записей: {self.dropped}")
+            return
+        self._pending[path] = value
+        if len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+
+    async def run(self):
+        """Фоновый цикл сброса буфера"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Записывает все накопленное. При ошибке пачка возвращается в буфер до следующей попытки"""
+        async with self._flush_lock:
+            while self._pending:
+                paths = list(islice(self._pending, self._batch_size))
+                batch = {path: self._pending.pop(path) for path in paths}
+                try:
+                    await self._repo.update_paths(batch)
+                except Exception as e:
+                    logging.error(f"Ошибка сброса буфера записи ({len(batch)} путей): {e}")
+                    for path, value in batch.items():
+                        # Более свежие значения, пришедшие во время записи, не перетираем
+                        self._pending.setdefault(path, value)
+                    return
+                self.written += len(batch)
+                self.batches += 1
+
+    def format_stats(self):
+        return (f"📝 Буфер записи: в очереди {len(self._pending)}, записано {self.written} "
+                f"за {self.batches} запросов, отброшено {self.dropped}")
+
+
+class LibraryCache:
+    """LRU/TTL-кэш отметок пользователя (пройденные, сыгранные, неинтересные).
+    Запись идет сразу в базу и затем в кэш, поэтому повторные чтения не ходят в Firebase"""
+
+    def __init__(self, repo, max_users=LIBRARY_CACHE_SIZE, ttl=LIBRARY_CACHE_TTL):
+        self._repo = repo
+        self._max_users = max_users
+        self._ttl = ttl
+        # user_id -> {'loaded_at': время, 'marks': {mark_type: {название: True}}}
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['loaded_at'] > self._ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    async def get(self, user_id, mark_type):
+        """Список отмеченных игр в порядке, в котором их вернула база"""
+        entry = self._entry(user_id)
+        if entry is not None and mark_type in entry['marks']:
+            self.hits += 1
+            return list(entry['marks'][mark_type])
+
+        self.misses += 1
+        titles = await self._repo.get_marked_games(user_id, mark_type)
+        entry = self._entry(user_id)
+        if entry is None:
+            entry = {'loaded_at': time.monotonic(), 'marks': {}}
+            self._entries[user_id] = entry
+            while len(self._entries) > self._max_users:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        entry['marks'].setdefault(mark_type, dict.fromkeys(titles, True))
+        return list(entry['marks'][mark_type])
+
+    async def add(self, user_id, game_title, mark_type):
+        await self._repo.add_game_mark(user_id, game_title, mark_type)
+        entry = self._entries.get(user_id)
+        if entry is not None and mark_type in entry['marks']:
+            entry['marks'][mark_type][game_title] = True
+
+    def format_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        return (f"📚 Кэш библиотек: {len(self._entries)}/{self._max_users} пользователей, "
+                f"попаданий {self.hits} ({hit_rate:.0f}%), промахов {self.misses}, вытеснено {self.evictions}")
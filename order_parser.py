@@ -0,0 +1,231 @@
+import re
+
+# Разбор пересланных заказов магазина и данных аккаунтов.
+# Все шаблоны компилируются один раз при импорте, текст просматривается построчно за один проход,
+# регулярные выражения запускаются только на строках, прошедших дешевую проверку подстроки
+
+ORDER_NUMBER_RE = re.compile(r'Заказ №(\d+)')
+ITEM_LINE_RE = re.compile(r'\s*\d+\.\s*')
+# Название — все до цены ": 1290 (" (в самом названии могут быть двоеточия)
+ITEM_TITLE_RE = re.compile(r'(.*?):\s*\d+\s*\(')
+ITEM_PLATFORM_RE = re.compile(r'Платформа\s*:\s*([^,\n]+)', re.IGNORECASE)
+ITEM_POSITION_RE = re.compile(r'(П[23])\s*(\d+)\s*дн', re.IGNORECASE)
+# Поля "Ключ: значение" из блока покупателя; значение может оказаться на следующей строке
+ORDER_FIELD_RE = re.compile(r'(\w+)\s*:\s*(.*)')
+ORDER_FIELD_KEYS = {'Промокод': 'promo_code', 'Скидка': 'discount', 'Ник_в_Telegram_или_Вконтакте': 'telegram_nick'}
+ORDER_FIELD_KEYS_CASEFREE = {'name': 'customer_name', 'date': 'order_date'}
+DIGITS_RE = re.compile(r'\d+')
+
+ACCOUNT_NUMBER_RE = re.compile(r'Аккаунт\s*:\s*(\S*)', re.IGNORECASE)
+LOT_RE = re.compile(r'Л[Оо]т\s*(\d+)', re.IGNORECASE)
+ACCOUNT_START_RE = re.compile(r'\s*(?:Аккаунт\s*:|Л[Оо]т\s*\d)', re.IGNORECASE)
+EMAIL_RE = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-zА-Яа-я]{2,}')
+WHITESPACE_RE = re.compile(r'\s')
+
+# Уверенность в значении поля: найдено по явной метке или угадано по косвенным признакам
+CONFIDENT = 1.0
+LIKELY = 0.8
+GUESSED = 0.5
+
+
+class ParsedRecord:
+    """Результат разбора: поля как атрибуты, confidence — уверенность по каждому найденному полю.
+    get() повторяет интерфейс словаря, поэтому запись можно передавать туда, где ждали dict"""
+
+    __slots__ = ('confidence',)
+    FIELDS = ()
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.confidence = {}
+
+    def _set(self, field, value, confidence=CONFIDENT):
+        setattr(self, field, value)
+        self.confidence[field] = confidence
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None) if field in self.FIELDS else None
+        return default if value is None else value
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class OrderInfo(ParsedRecord):
+    FIELDS = ('order_number', 'game_name', 'platform', 'rental_type', 'days', 'customer_name',
+              'order_date', 'promo_code', 'discount', 'telegram_nick')
+    __slots__ = FIELDS
+
+
+class AccountInfo(ParsedRecord):
+    FIELDS = ('account_number', 'platform', 'email', 'password', 'activation')
+    __slots__ = FIELDS
+
+
+def _parse_item_line(order, line, title_start):
+    """Строка позиции заказа: "1. Название: 1290 (Платформа: PS5, П3 7 дн.)" """
+    title_match = ITEM_TITLE_RE.match(line, title_start)
+    if title_match:
+        order._set('game_name', title_match.group(1).strip())
+    else:
+        order._set('game_name', line[title_start:].split(':')[0].strip(), GUESSED)
+
+    platform_match = ITEM_PLATFORM_RE.search(line)
+    if platform_match:
+        order._set('platform', platform_match.group(1).strip())
+
+    position_match = ITEM_POSITION_RE.search(line)
+    if position_match:
+        order._set('rental_type', position_match.group(1).upper())
+        order._set('days', int(position_match.group(2)))
+
+
+def _order_field_value(field, value):
+    if field == 'discount':
+        digits = DIGITS_RE.match(value)
+        return digits.group(0) if digits else None
+    return value or None
+
+
+def _field_for_line(line):
+    """Поле заказа, которому соответствует строка "Ключ: значение", и сам match"""
+    field_match = ORDER_FIELD_RE.search(line) if ':' in line else None
+    if not field_match:
+        return None
+    key = field_match.group(1)
+    field = ORDER_FIELD_KEYS.get(key) or ORDER_FIELD_KEYS_CASEFREE.get(key.lower())
+    return (field, field_match) if field else None
+
+
+def parse_order_info(text):
+    """Разбирает пересланное сообщение с заказом в OrderInfo"""
+    order = OrderInfo()
+    if not text:
+        return order
+
+    pending_field = None  # поле, значение которого ждем на следующей строке
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if pending_field:
+            if not stripped:
+                continue
+            # Следующая строка сама оказалась полем — значит, значение было пустым
+            if not _field_for_line(line):
+                value = _order_field_value(pending_field, stripped)
+                if value is not None:
+                    order._set(pending_field, value, LIKELY)
+            pending_field = None
+
+        if order.order_number is None and '№' in line:
+            number_match = ORDER_NUMBER_RE.search(line)
+            if number_match:
+                order._set('order_number', number_match.group(1))
+                continue
+
+        if order.game_name is None and stripped[:1].isdigit():
+            item_match = ITEM_LINE_RE.match(line)
+            if item_match:
+                _parse_item_line(order, line, item_match.end())
+                continue
+
+        field_line = _field_for_line(line)
+        if field_line:
+            field, field_match = field_line
+            if getattr(order, field) is not None:
+                continue
+            value = field_match.group(2).strip()
+            if value:
+                value = _order_field_value(field, value)
+                if value is not None:
+                    order._set(field, value)
+            else:
+                pending_field = field
+    return order
+
+
+def is_order_text(text):
+    return bool(text) and 'Заказ №' in text and 'Информация о покупателе:' in text
+
+
+def split_account_blocks(text):
+    """Делит вставленный текст с несколькими аккаунтами на блоки по одному аккаунту:
+    по строкам, начинающимся с "Аккаунт:" или "Лот N", а если такая строка одна — по пустым строкам"""
+    if not text:
+        return []
+    blocks = []
+    for line in text.split('\n'):
+        if not blocks or ACCOUNT_START_RE.match(line):
+            blocks.append([])
+        blocks[-1].append(line)
+    if len(blocks) > 1:
+        return ['\n'.join(block).strip() for block in blocks if ''.join(block).strip()]
+    return [block.strip() for block in re.split(r'\n\s*\n', text) if block.strip()]
+
+
+def _is_password_candidate(line):
+    # "@" в пароле допустим, почта паролем не считается
+    return (len(line) >= 4 and not WHITESPACE_RE.search(line)
+            and ('@' not in line or not EMAIL_RE.search(line)))
+
+
+def parse_account_info(text):
+    """Разбирает данные аккаунта (номер или лот, платформа, почта, пароль) в AccountInfo"""
+    account = AccountInfo()
+    if not text:
+        return account
+
+    lot_number = None
+    pending_account = False
+    has_ps5 = has_ps4 = False
+    last_candidate = None
+    for line in text.split('\n'):
+        stripped = line.strip()
+        lowered = line.lower()
+
+        if account.account_number is None:
+            if pending_account and stripped:
+                account._set('account_number', stripped.split()[0], LIKELY)
+            elif 'аккаунт' in lowered:
+                account_match = ACCOUNT_NUMBER_RE.search(line)
+                if account_match:
+                    if account_match.group(1):
+                        account._set('account_number', account_match.group(1))
+                    else:
+                        pending_account = True
+        if lot_number is None and 'лот' in lowered:
+            lot_match = LOT_RE.search(line)
+            if lot_match:
+                lot_number = lot_match.group(1)
+
+        if 'ps' in lowered:
+            has_ps5 = has_ps5 or 'ps5' in lowered
+            has_ps4 = has_ps4 or 'ps4' in lowered
+
+        if account.email is None and '@' in line:
+            email_match = EMAIL_RE.search(line)
+            if email_match:
+                account._set('email', email_match.group(0))
+                # Пароль ищем после почты, начиная с остатка той же строки
+                stripped = line[email_match.end():].strip()
+        if _is_password_candidate(stripped):
+            if account.email is not None and account.password is None:
+                account._set('password', stripped, LIKELY)
+            last_candidate = stripped
+
+        if account.activation is None and 'активация' in line:
+            account._set('activation', '✅')
+
+    if account.account_number is None and lot_number is not None:
+        account._set('account_number', f"ЛОТ {lot_number}", LIKELY)
+    if has_ps5:
+        account._set('platform', 'PS5')
+    elif has_ps4:
+        account._set('platform', 'PS4')
+    if account.email is None and last_candidate is not None:
+        # Почты нет — паролем считаем последнюю подходящую строку
+        account._set('password', last_candidate, GUESSED)
+    return account
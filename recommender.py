@@ -0,0 +1,117 @@
+import random
+import logging
+from collections import OrderedDict
+
+# Выбор случайной игры для рекомендаций. Работает по номерам строк каталога,
+# без фильтрации и копирования DataFrame на каждый запрос
+
+REJECTION_MAX_DENSITY = 0.5  # при большей доле исключенных игр сразу строим явное дополнение
+REJECTION_ATTEMPTS = 32
+
+
+def sample_row(size, excluded_rows, rng=random):
+    """Случайная строка из [0, size), не входящая в excluded_rows, или None.
+    Пока исключений немного — выборка с отклонением за O(1) в среднем,
+    при плотных исключениях — выбор из явного списка оставшихся строк"""
+    if size <= 0:
+        return None
+    if len(excluded_rows) < size * REJECTION_MAX_DENSITY:
+        for _ in range(REJECTION_ATTEMPTS):
+            row = rng.randrange(size)
+            if row not in excluded_rows:
+                return row
+    allowed = [row for row in range(size) if row not in excluded_rows]
+    return rng.choice(allowed) if allowed else None
+
+
+# --- Поток рекомендаций без повторов ---
+# Для каждого пользователя храним только (seed, позиция, размер, версия каталога):
+# порядок показа задается псевдослучайной перестановкой номеров строк (сеть Фейстеля),
+# поэтому список уже показанных игр хранить не нужно
+
+FEISTEL_ROUNDS = 4
+STREAM_MAX_SKIPS = 64  # столько подряд исключенных игр пропускаем, потом берем случайную
+STREAM_CACHE_SIZE = 5000  # курсоров пользователей в памяти
+
+
+def _feistel_round(value, seed, round_index, mask):
+    h = (value * 0x9E3779B1 + seed + round_index * 0x7F4A7C15) & 0xFFFFFFFF
+    h ^= h >> 15
+    h = (h * 0x2C1B3C6D) & 0xFFFFFFFF
+    h ^= h >> 12
+    return h & mask
+
+
+def permute(index, size, seed):
+    """index-й элемент псевдослучайной перестановки чисел [0, size), задаваемой seed.
+    Сеть Фейстеля на ближайшей степени двойки + cycle walking обратно в [0, size)"""
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_index in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _feistel_round(right, seed, round_index, mask)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
+
+
+def new_cursor(cat, rng=random):
+    return {'s': rng.getrandbits(32), 'p': 0, 'n': len(cat), 'v': cat.version}
+
+
+class RecommendationStreams:
+    """Курсоры пользователей по перестановке каталога.
+    load_cursor(user_id) — корутина чтения сохраненного курсора, save_cursor(user_id, cursor) — запись"""
+
+    def __init__(self, load_cursor, save_cursor, max_users=STREAM_CACHE_SIZE):
+        self._load_cursor = load_cursor
+        self._save_cursor = save_cursor
+        self._max_users = max_users
+        self._cursors = OrderedDict()
+
+    async def _get_cursor(self, user_id, cat):
+        cursor = self._cursors.get(user_id)
+        if cursor is None:
+            try:
+                cursor = await self._load_cursor(user_id)
+            except Exception as e:
+                logging.error(f"Не удалось загрузить курсор рекомендаций пользователя {user_id}: {e}")
+                cursor = None
+            if not isinstance(cursor, dict) or not {'s', 'p', 'n', 'v'} <= cursor.keys():
+                cursor = new_cursor(cat)
+            self._cursors[user_id] = cursor
+            while len(self._cursors) > self._max_users:
+                self._cursors.popitem(last=False)
+        self._cursors.move_to_end(user_id)
+        # Курсор по версии каталога, для которой нет таблицы пересчета, начинает новый круг
+        if cursor['v'] != cat.version and cursor['v'] not in cat.remaps:
+            cursor.update(new_cursor(cat))
+        return cursor
+
+    async def next_row(self, user_id, cat, excluded_rows):
+        """Следующая строка каталога для пользователя без повторов в пределах круга или None"""
+        cursor = await self._get_cursor(user_id, cat)
+        row = self._advance(cursor, cat, excluded_rows)
+        self._save_cursor(user_id, dict(cursor))
+        return row
+
+    def _advance(self, cursor, cat, excluded_rows):
+        fresh_cycle = cursor['p'] == 0 and cursor['v'] == cat.version
+        for _ in range(STREAM_MAX_SKIPS):
+            if cursor['p'] >= cursor['n']:
+                if fresh_cycle:
+                    # Прошли целый круг и не нашли ни одной подходящей игры
+                    return None
+                cursor.update(new_cursor(cat))
+                fresh_cycle = True
+            row = permute(cursor['p'], cursor['n'], cursor['s'])
+            cursor['p'] += 1
+            if cursor['v'] != cat.version:
+                # Курсор построен по прошлой версии каталога — переводим номер строки
+                row = cat.remaps[cursor['v']][row]
+            if row >= 0 and row not in excluded_rows:
+                return row
+        # Исключенных игр слишком много подряд — берем любую подходящую
+        return sample_row(len(cat), excluded_rows)
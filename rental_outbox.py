@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import logging
+import asyncio
+import sqlite3
+
+import httpx
+
+from firebase_repo import generate_push_id
+
+# Запись результатов аренды в базу arenarental. Записи сначала попадают в локальный
+# SQLite-outbox и только потом, в фоне, уходят в Firebase одним PATCH на пачку.
+# Ответ админу запись не ждет, а при недоступности базы ничего не теряется.
+# Записи аренды структурированы: кроме текста карточки в них есть end_ts — по нему
+# (индекс в правилах базы arenarental — rentals.rules.json) выбираются заканчивающиеся аренды
+
+RENTALS_DB_URL = "https://arenarental-8eb7f-default-rtdb.firebaseio.com"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTBOX_PATH = os.getenv('RENTAL_OUTBOX_PATH', os.path.join(BASE_DIR, 'rental_outbox.sqlite3'))
+OUTBOX_BATCH = 50  # записей в одном запросе
+OUTBOX_MAX_BACKOFF = 300  # секунд между попытками при долгой недоступности базы
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=60)
+
+
+class RentalOutbox:
+    """Надежная очередь записей rentals/{push_id} с повторами в фоне.
+    Строка outbox — либо запись целиком (ключ push_id), либо одно поле уже отправленной записи
+    (ключ push_id/поле): PATCH в /rentals.json принимает оба вида путей"""
+
+    def __init__(self, path=OUTBOX_PATH, base_url=RENTALS_DB_URL):
+        self._base_url = base_url
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' key TEXT PRIMARY KEY, data TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0)'
+        )
+        self._client = None
+        self._wakeup = asyncio.Event()
+        self.written = 0
+        self.failures = 0
+
+    def add(self, rental):
+        """Сохраняет запись локально и будит фоновую отправку. Возвращает ключ записи в rentals"""
+        return self.add_many([rental])[0]
+
+    def add_many(self, rentals):
+        """rentals — словари {'text': карточка, 'end_ts': ..., ...}; timestamp добавляется здесь"""
+        # Ключ генерируется на клиенте, поэтому повторная отправка той же записи не создает дубль
+        timestamp = int(time.time() * 1000)  # timestamp в миллисекундах
+        rows = [(generate_push_id(), json.dumps({**rental, 'timestamp': timestamp}, ensure_ascii=False))
+                for rental in rentals]
+        with self._db:
+            self._db.executemany('INSERT INTO outbox (key, data) VALUES (?, ?)', rows)
+        self._wakeup.set()
+        return [key for key, _ in rows]
+
+    def set_field(self, key, field, value):
+        """Меняет поле записи: пока запись в outbox — прямо в ней, иначе отдельной строкой key/field
+        (поэтому запись и ее поле никогда не попадают в один PATCH)"""
+        with self._db:
+            updated = self._db.execute(
+                'UPDATE outbox SET data = json_set(data, ?, json(?)) WHERE key = ?',
+                (f'$.{field}', json.dumps(value), key)
+            ).rowcount
+            if not updated:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO outbox (key, data) VALUES (?, ?)',
+                    (f'{key}/{field}', json.dumps(value))
+                )
+        self._wakeup.set()
+
+    async def get_rentals_ending(self, start, end):
+        """Аренды с end_ts в [start, end] одним запросом по индексу, с учетом еще не отправленного из outbox"""
+        response = await self._http().get('/rentals.json', params={
+            'orderBy': '"end_ts"', 'startAt': start, 'endAt': end,
+        })
+        response.raise_for_status()
+        rentals = response.json() or {}
+
+        fields = []
+        for key, data in self._db.execute('SELECT key, data FROM outbox').fetchall():
+            if '/' in key:
+                fields.append((key, json.loads(data)))
+                continue
+            rental = json.loads(data)
+            if start <= (rental.get('end_ts') or 0) <= end:
+                rentals[key] = rental
+        for path, value in fields:
+            key, field = path.split('/', 1)
+            if key in rentals:
+                rentals[key][field] = value
+        return rentals
+
+    def pending_count(self):
+        return self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def _due_batch(self):
+        return self._db.execute(
+            'SELECT key, data, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY key LIMIT ?',
+            (time.time(), OUTBOX_BATCH)
+        ).fetchall()
+
+    def _next_attempt_delay(self):
+        row = self._db.execute('SELECT MIN(next_attempt_at) FROM outbox').fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self._base_url, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        return self._client
+
+    async def _send(self, batch):
+        response = await self._http().patch('/rentals.json', json={key: json.loads(data) for key, data, _ in batch})
+        response.raise_for_status()
+
+    async def flush(self):
+        """Отправляет все записи, время повтора которых наступило. False — если база недоступна"""
+        while True:
+            batch = self._due_batch()
+            if not batch:
+                return True
+            try:
+                await self._send(batch)
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Ошибка записи аренды в Firebase ({len(batch)} записей), повторим позже: {e}")
+                with self._db:
+                    self._db.executemany(
+                        'UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE key = ?',
+                        [(attempts + 1, time.time() + min(OUTBOX_MAX_BACKOFF, 2 ** attempts), key)
+                         for key, _, attempts in batch]
+                    )
+                return False
+            # Запись, измененная через set_field во время отправки, остается и уйдет еще раз
+            with self._db:
+                self._db.executemany('DELETE FROM outbox WHERE key = ? AND data = ?',
+                                     [(key, data) for key, data, _ in batch])
+            self.written += len(batch)
+            logging.info(f"Результат аренды сохранен в Firebase (arenarental-8eb7f): {len(batch)} записей")
+
+    async def run(self):
+        """Фоновый цикл отправки"""
+        while True:
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка в очереди записи аренды: {e}")
+            delay = self._next_attempt_delay()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Последняя попытка отправки при остановке; неотправленное останется в outbox до следующего запуска"""
+        try:
+            await self.flush()
+        finally:
+            if self._client is not None:
+                await self._client.aclose()
+            self._db.close()
+
+    def format_stats(self):
+        return (f"🧾 Очередь аренды: в outbox {self.pending_count()}, записано {self.written}, "
+                f"неудачных попыток {self.failures}")
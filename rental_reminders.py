@@ -0,0 +1,129 @@
+import time
+import logging
+import asyncio
+
+# Напоминания об окончании аренды: хешированное колесо таймеров с ячейкой в REMINDER_TICK секунд.
+# В памяти лежат только аренды, заканчивающиеся в ближайшие сутки с небольшим, — они подгружаются
+# из базы запросом по индексу end_ts, поэтому число активных аренд на стоимость тика не влияет
+
+REMINDER_TICK = 60  # секунд на ячейку колеса (точность срабатывания)
+REMINDER_LEAD = 24 * 3600  # за сколько до окончания напоминаем «аренда заканчивается завтра»
+REMINDER_RESYNC_INTERVAL = 3600  # секунд между подгрузками следующего окна из базы
+REMINDER_GRACE = 6 * 3600  # пропущенные за время простоя уведомления отправляются, если опоздали не больше
+
+# Этапы уведомлений по аренде (поле reminder_stage записи)
+STAGE_NONE = 0
+STAGE_REMINDED = 1  # «аренда заканчивается завтра»
+STAGE_EXPIRED = 2  # срок закончился
+
+
+class RentalReminders:
+    """load_window(start, end) — корутина, возвращающая {key: запись аренды} с end_ts в [start, end],
+    notify(app, key, rental, stage) — корутина уведомления клиента и админов,
+    mark(key, stage) — сохранение пройденного этапа, чтобы после перезапуска не уведомлять повторно"""
+
+    def __init__(self, load_window, notify, mark, tick=REMINDER_TICK, resync_interval=REMINDER_RESYNC_INTERVAL):
+        self._load_window = load_window
+        self._notify = notify
+        self._mark = mark
+        self._tick = tick
+        self._resync_interval = resync_interval
+        self._wheel = {}  # номер ячейки -> {key: этап}
+        self._slots = {}  # key -> номер ячейки, в которой ждет аренда
+        self._rentals = {}  # key -> запись аренды
+        self._cursor = int(time.time() // tick)  # первая необработанная ячейка
+        self._app = None
+        self.sent = 0
+
+    def __len__(self):
+        return len(self._rentals)
+
+    def _next_stage(self, rental, now):
+        """Ближайший неотправленный этап и время его срабатывания или None"""
+        stage = rental.get('reminder_stage') or STAGE_NONE
+        end_ts = rental.get('end_ts')
+        if end_ts is None:
+            return None
+        started_at = (rental.get('timestamp') or 0) / 1000
+        remind_at = end_ts - REMINDER_LEAD
+        # Аренды короче суток не напоминаем: «завтра» пришло бы сразу после выдачи
+        if stage < STAGE_REMINDED and remind_at > started_at and remind_at + REMINDER_GRACE > now:
+            return STAGE_REMINDED, remind_at
+        if stage < STAGE_EXPIRED and end_ts + REMINDER_GRACE > now:
+            return STAGE_EXPIRED, end_ts
+        return None
+
+    def add(self, key, rental):
+        """Добавляет или обновляет аренду; O(1), опоздавшие этапы срабатывают на ближайшем тике"""
+        self._unschedule(key)
+        next_stage = self._next_stage(rental, time.time())
+        if next_stage is None:
+            self._rentals.pop(key, None)
+            return
+        stage, fire_at = next_stage
+        slot = max(self._cursor, int(fire_at // self._tick))
+        self._rentals[key] = rental
+        self._slots[key] = slot
+        self._wheel.setdefault(slot, {})[key] = stage
+
+    def _unschedule(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return
+        entries = self._wheel.get(slot)
+        if entries:
+            entries.pop(key, None)
+            if not entries:
+                del self._wheel[slot]
+
+    async def sync(self):
+        """Подгружает аренды, заканчивающиеся до следующей подгрузки (с запасом на напоминание)"""
+        now = int(time.time())
+        try:
+            rentals = await self._load_window(now - REMINDER_GRACE,
+                                              now + REMINDER_LEAD + self._resync_interval + self._tick)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки аренд для напоминаний: {e}")
+            return
+        for key, rental in (rentals or {}).items():
+            if key not in self._rentals:
+                self.add(key, rental)
+
+    async def run(self, app):
+        """Фоновый цикл: раз в тик обрабатывает наступившие ячейки колеса"""
+        self._app = app
+        await self.sync()
+        last_sync = time.monotonic()
+        while True:
+            await asyncio.sleep(self._tick - time.time() % self._tick)
+            current = int(time.time() // self._tick)
+            while self._cursor < current:
+                entries = self._wheel.pop(self._cursor, None)
+                self._cursor += 1
+                for key, stage in (entries or {}).items():
+                    self._slots.pop(key, None)
+                    await self._fire(key, stage)
+            if time.monotonic() - last_sync >= self._resync_interval:
+                await self.sync()
+                last_sync = time.monotonic()
+
+    async def _fire(self, key, stage):
+        rental = self._rentals.get(key)
+        if rental is None:
+            return
+        try:
+            await self._notify(self._app, key, rental, stage)
+            self.sent += 1
+        except Exception as e:
+            logging.error(f"Ошибка уведомления об аренде {key}: {e}")
+        # Этап считается пройденным и при ошибке: повтор уведомления хуже пропуска
+        rental['reminder_stage'] = stage
+        try:
+            self._mark(key, stage)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения этапа уведомления аренды {key}: {e}")
+        self.add(key, rental)
+
+    def format_stats(self):
+        return (f"⏰ Напоминания об аренде: в колесе {len(self._rentals)} аренд, "
+                f"ячеек {len(self._wheel)}, отправлено {self.sent}")
@@ -0,0 +1,58 @@
+from typing import NamedTuple
+
+# Маршрутизация нажатий кнопок: callback_data (или текст кнопки reply-клавиатуры) ищется
+# в словаре за O(1) вместо цепочки сравнений. Статичные экраны собираются один раз при импорте
+
+
+class Screen(NamedTuple):
+    """Неизменяемый экран: текст и клавиатура"""
+    text: str
+    reply_markup: object = None
+
+
+class Router:
+    """Таблица обработчиков нажатий.
+    Точный ключ -> Screen или корутина handler(update, context);
+    ключ вида "prefix:param" без точного совпадения -> корутина handler(update, context, param).
+    render(update, screen) — корутина показа экрана (редактирование сообщения или новый ответ),
+    fallback(update, context) — корутина для ключей, которых нет в таблице"""
+
+    def __init__(self, render, fallback=None):
+        self._render = render
+        self._fallback = fallback
+        self._exact = {}
+        self._prefixes = {}
+
+    def screen(self, key, screen):
+        self._exact[key] = screen
+
+    def on(self, *keys):
+        """Декоратор: обработчик для одного или нескольких точных ключей"""
+        def register(handler):
+            for key in keys:
+                self._exact[key] = handler
+            return handler
+        return register
+
+    def on_prefix(self, prefix):
+        """Декоратор: обработчик ключей "prefix:param", параметр передается третьим аргументом"""
+        def register(handler):
+            self._prefixes[prefix] = handler
+            return handler
+        return register
+
+    async def dispatch(self, key, update, context):
+        """Вызывает обработчик ключа; возвращает его результат (состояние диалога) или None"""
+        target = self._exact.get(key)
+        if target is None and key and ':' in key:
+            prefix, param = key.split(':', 1)
+            handler = self._prefixes.get(prefix)
+            if handler is not None:
+                return await handler(update, context, param)
+        if target is None:
+            if self._fallback is not None:
+                return await self._fallback(update, context)
+            return None
+        if isinstance(target, Screen):
+            return await self._render(update, target)
+        return await target(update, context)
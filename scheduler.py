@@ -0,0 +1,134 @@
+import time
+import heapq
+import logging
+import asyncio
+
+# Планировщик отложенных сообщений: min-heap времен отправки в памяти.
+# Воркер спит ровно до ближайшего сообщения, новые сообщения будят его сразу,
+# каждое сообщение перед отправкой захватывается транзакцией в базе
+
+SCHEDULE_RESYNC_INTERVAL = 900  # секунд между сверками с базой (меньше горизонта загрузки в firebase_repo)
+SCHEDULE_RETRY_DELAY = 60  # секунд до повторной попытки после ошибки отправки
+SCHEDULE_MAX_ATTEMPTS = 5
+
+
+class MessageScheduler:
+    """load_pending() — корутина, возвращающая {key: send_at} ожидающих сообщений,
+    claim(key) — корутина атомарного захвата, возвращает данные сообщения или None, если его уже забрали,
+    deliver(app, key, data) — корутина отправки; исключение означает неудачную попытку,
+    release(key, data, attempts, retry_at) — корутина возврата сообщения в ожидание до retry_at
+    (retry_at=None — попытки исчерпаны, сообщение помечается неотправляемым),
+    archive(key, data) — корутина переноса отправленного сообщения в архив. Ошибка архива
+    не делает отправку неудачной: повторяется только запись архива, сообщение повторно не уходит"""
+
+    def __init__(self, load_pending, claim, deliver, release, archive, resync_interval=SCHEDULE_RESYNC_INTERVAL):
+        self._load_pending = load_pending
+        self._claim = claim
+        self._deliver = deliver
+        self._release = release
+        self._archive = archive
+        self._resync_interval = resync_interval
+        self._heap = []
+        self._due = {}  # key -> send_at; записи кучи с другим временем устарели
+        self._unarchived = {}  # key -> данные отправленных сообщений, архив которых не записался
+        self._wakeup = asyncio.Event()
+        self._app = None
+        self.delivered = 0
+
+    def add(self, key, send_at):
+        """Добавляет или переносит сообщение; будит воркер, если оно раньше текущего ближайшего"""
+        if self._due.get(key) == send_at:
+            return
+        self._due[key] = send_at
+        heapq.heappush(self._heap, (send_at, key))
+        if self._heap[0][1] == key:
+            self._wakeup.set()
+
+    async def sync(self):
+        """Сверяет кучу с базой"""
+        try:
+            pending = await self._load_pending()
+        except Exception as e:
+            logging.error(f"Ошибка загрузки отложенных сообщений: {e}")
+            return
+        for key, send_at in (pending or {}).items():
+            self.add(key, send_at)
+
+    def _next_delay(self):
+        while self._heap:
+            send_at, key = self._heap[0]
+            if self._due.get(key) != send_at:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, send_at - time.time())
+        return None
+
+    async def run(self, app):
+        """Фоновый цикл: сон до ближайшего сообщения, затем отправка всех наступивших"""
+        self._app = app
+        await self.sync()
+        last_sync = time.monotonic()
+        while True:
+            delay = self._next_delay()
+            until_sync = max(0.0, self._resync_interval - (time.monotonic() - last_sync))
+            timeout = until_sync if delay is None else min(delay, until_sync)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            if time.monotonic() - last_sync >= self._resync_interval:
+                await self.sync()
+                last_sync = time.monotonic()
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                send_at, key = heapq.heappop(self._heap)
+                if self._due.get(key) != send_at:
+                    continue
+                del self._due[key]
+                await self._process(key)
+
+    async def _process(self, key):
+        if key in self._unarchived:
+            await self._archive_sent(key, self._unarchived.pop(key))
+            return
+        try:
+            data = await self._claim(key)
+        except Exception as e:
+            logging.error(f"Ошибка захвата отложенного сообщения {key}: {e}")
+            self.add(key, time.time() + SCHEDULE_RETRY_DELAY)
+            return
+        if data is None:
+            # Сообщение уже отправлено или забрано другим экземпляром бота
+            return
+
+        try:
+            await self._deliver(self._app, key, data)
+        except Exception as e:
+            logging.error(f"Ошибка при отправке отложенного сообщения {key}: {e}")
+        else:
+            self.delivered += 1
+            await self._archive_sent(key, data)
+            return
+
+        attempts = data.get('attempts', 0) + 1
+        retry_at = int(time.time()) + SCHEDULE_RETRY_DELAY if attempts < SCHEDULE_MAX_ATTEMPTS else None
+        try:
+            await self._release(key, data, attempts, retry_at)
+        except Exception as e:
+            logging.error(f"Ошибка возврата отложенного сообщения {key} в очередь: {e}")
+            return
+        if retry_at is not None:
+            self.add(key, retry_at)
+
+    async def _archive_sent(self, key, data):
+        """Архивирует отправленное сообщение, при ошибке повторяет только запись архива"""
+        try:
+            await self._archive(key, data)
+        except Exception as e:
+            logging.error(f"Ошибка архивации отправленного сообщения {key}, повтор через {SCHEDULE_RETRY_DELAY} с: {e}")
+            self._unarchived[key] = data
+            self.add(key, time.time() + SCHEDULE_RETRY_DELAY)
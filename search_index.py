@@ -0,0 +1,243 @@
+import re
+import html
+import heapq
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+# Поисковый индекс по названиям игр. Строится один раз на версию каталога,
+# запросы пользователя никогда не интерпретируются как регулярные выражения
+
+_TRADEMARKS_RE = re.compile(r'[™®©]')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]|_')
+_SPACES_RE = re.compile(r'\s+')
+
+# Транслитерация кириллица -> латиница (для запросов вроде "гта" или "киберпанк")
+_CYR_TO_LAT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+# Обратное направление (для запросов вроде "metro" к "Метро 2033"), сначала двухбуквенные сочетания
+_LAT_TO_CYR_PAIRS = [('sch', 'щ'), ('sh', 'ш'), ('ch', 'ч'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'),
+                     ('ya', 'я'), ('yu', 'ю'), ('ck', 'к'), ('ph', 'ф')]
+_LAT_TO_CYR = str.maketrans({
+    'a': 'а', 'b': 'б', 'c': 'к', 'd': 'д', 'e': 'е', 'f': 'ф', 'g': 'г', 'h': 'х',
+    'i': 'и', 'j': 'дж', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п',
+    'q': 'к', 'r': 'р', 's': 'с', 't': 'т', 'u': 'у', 'v': 'в', 'w': 'в', 'x': 'кс',
+    'y': 'и', 'z': 'з',
+})
+# Фонетический ключ: сглаживает разницу написаний ("kiberpank" ~ "cyberpunk")
+_PHONETIC_RULES = [('ck', 'k'), ('ph', 'f'), ('c', 'k'), ('q', 'k'), ('w', 'v'), ('y', 'i'),
+                   ('x', 'ks'), ('z', 's')]
+_CYRILLIC_RE = re.compile(r'[а-я]')
+_LATIN_RE = re.compile(r'[a-z]')
+
+FUZZY_MIN_SIMILARITY = 0.5  # доля триграмм запроса, которые должны найтись в названии
+FUZZY_STOP_FRACTION = 0.3  # триграммы, встречающиеся чаще, не участвуют в отборе кандидатов
+
+
+def _strip_accents(text):
+    """Убирает диакритику у латиницы (ö -> o), не трогая й и ё"""
+    if text.isascii():
+        return text
+    return ''.join(
+        ch if ch in 'йё' or ch.isascii() else
+        ''.join(c for c in unicodedata.normalize('NFKD', ch) if not unicodedata.combining(c))
+        for ch in text
+    )
+
+
+def normalize_title(text):
+    """Нормализует название или запрос: casefold, ё -> е, без ™/® и пунктуации"""
+    text = _strip_accents(html.unescape(str(text)).casefold()).replace('ё', 'е')
+    text = _TRADEMARKS_RE.sub('', text)
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def transliterate(text):
+    """Кириллица -> латиница для нормализованного текста"""
+    return text.translate(_CYR_TO_LAT)
+
+
+def _latin_to_cyrillic(text):
+    for latin, cyrillic in _LAT_TO_CYR_PAIRS:
+        text = text.replace(latin, cyrillic)
+    return text.translate(_LAT_TO_CYR)
+
+
+def query_variants(text):
+    """Нормализованный запрос и его транслитерации, исходный вариант первым"""
+    text = normalize_title(text)
+    if not text:
+        return []
+    variants = [text]
+    if _CYRILLIC_RE.search(text):
+        variants.append(transliterate(text))
+    if _LATIN_RE.search(text):
+        variants.append(_latin_to_cyrillic(text))
+    return variants
+
+
+def phonetic_key(normalized):
+    """Латинский фонетический ключ нормализованного текста"""
+    key = transliterate(normalized)
+    for src, dst in _PHONETIC_RULES:
+        key = key.replace(src, dst)
+    return key
+
+
+def trigrams(key):
+    """Множество триграмм по словам, с маркерами начала и конца слова"""
+    grams = set()
+    for word in key.split():
+        padded = f"${word}$"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _find_rows(haystack, line_starts, needle):
+    """Номера строк склеенного текста, в которых встречается needle (по порядку каталога)"""
+    rows = []
+    pos = haystack.find(needle)
+    while pos != -1:
+        row = bisect_right(line_starts, pos) - 1
+        rows.append(row)
+        # Следующее вхождение ищем уже со следующей строки
+        if row + 1 >= len(line_starts):
+            break
+        pos = haystack.find(needle, line_starts[row + 1])
+    return rows
+
+
+def _join_lines(lines):
+    starts = []
+    offset = 0
+    for line in lines:
+        starts.append(offset)
+        offset += len(line) + 1
+    return '\n'.join(lines), starts
+
+
+class SearchIndex:
+    """Нормализованные названия, постинги по словам и подстрочный поиск"""
+
+    __slots__ = ('normalized', '_haystack', '_line_starts', '_compact_haystack',
+                 '_compact_starts', '_postings', '_sorted_titles', '_sorted_keys',
+                 '_sorted_acronyms', '_trigram_postings', '_trigram_counts', '_stop_limit')
+
+    def __init__(self, titles):
+        self.normalized = [normalize_title(title) for title in titles]
+        self._haystack, self._line_starts = _join_lines(self.normalized)
+        self._compact_haystack, self._compact_starts = _join_lines(
+            [title.replace(' ', '') for title in self.normalized]
+        )
+
+        self._postings = {}
+        for row, title in enumerate(self.normalized):
+            for token in set(title.split()):
+                self._postings.setdefault(token, []).append(row)
+
+        self._sorted_titles = sorted((title, row) for row, title in enumerate(self.normalized))
+
+        # Индексы для нечеткого поиска строятся по фонетическим ключам
+        keys = [phonetic_key(title) for title in self.normalized]
+        self._sorted_keys = sorted((key, row) for row, key in enumerate(keys))
+        self._sorted_acronyms = sorted(
+            (''.join(word[0] for word in key.split()), row) for row, key in enumerate(keys) if key
+        )
+        self._trigram_postings = {}
+        self._trigram_counts = []
+        for row, key in enumerate(keys):
+            grams = trigrams(key)
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_postings.setdefault(gram, []).append(row)
+        self._stop_limit = max(1, int(len(keys) * FUZZY_STOP_FRACTION))
+
+    def search(self, query, limit=None):
+        """Номера строк каталога по запросу: подстрока, затем подстрока без пробелов,
+        затем все слова запроса в любом порядке. Пробует транслитерацию запроса.
+        Названия, начинающиеся с запроса, идут первыми"""
+        for needle in query_variants(query):
+            rows = self._exact_rows(needle)
+            if rows:
+                starts = [row for row in rows if self.normalized[row].startswith(needle)]
+                if starts:
+                    first = set(starts)
+                    rows = starts + [row for row in rows if row not in first]
+                return rows if limit is None else rows[:limit]
+        return []
+
+    def _exact_rows(self, needle):
+        rows = _find_rows(self._haystack, self._line_starts, needle)
+        if rows:
+            return rows
+
+        compact = needle.replace(' ', '')
+        rows = _find_rows(self._compact_haystack, self._compact_starts, compact)
+        if rows:
+            return rows
+
+        postings = [self._postings.get(token) for token in set(needle.split())]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        return sorted(set(postings[0]).intersection(*postings[1:]))
+
+    def prefix(self, query):
+        """Номера строк, названия которых начинаются с запроса (по порядку каталога)"""
+        for needle in query_variants(query):
+            rows = _prefix_rows(self._sorted_titles, needle)
+            if rows:
+                return sorted(rows)
+        return []
+
+    def suggest(self, query, limit=10):
+        """Приблизительные совпадения для запросов с опечатками, лучшие первыми:
+        совпадение начала названия, аббревиатура ("гта", "gow"), затем похожесть по триграммам"""
+        needle = normalize_title(query)
+        key = phonetic_key(needle)
+        if not key:
+            return []
+
+        ranked = _prefix_rows(self._sorted_keys, key)
+        compact = key.replace(' ', '')
+        if ' ' not in key and 2 <= len(compact) <= 6:
+            ranked += _prefix_rows(self._sorted_acronyms, compact)
+
+        query_grams = trigrams(key)
+        postings = [self._trigram_postings[gram] for gram in query_grams if gram in self._trigram_postings]
+        selective = [rows for rows in postings if len(rows) <= self._stop_limit]
+        counts = Counter()
+        for rows in (selective or postings):
+            counts.update(rows)
+
+        min_common = len(query_grams) * FUZZY_MIN_SIMILARITY
+        candidates = [
+            (common / len(query_grams), 2 * common / (len(query_grams) + self._trigram_counts[row]), -row)
+            for row, common in counts.items() if common >= min_common
+        ]
+        ranked += [-row for _, _, row in heapq.nlargest(limit, candidates)]
+
+        result = []
+        seen = set()
+        for row in ranked:
+            if row not in seen:
+                seen.add(row)
+                result.append(row)
+                if len(result) >= limit:
+                    break
+        return result
+
+
+def _prefix_rows(sorted_pairs, needle):
+    """Строки из отсортированного списка (ключ, строка), ключ которых начинается с needle"""
+    rows = []
+    for value, row in sorted_pairs[bisect_left(sorted_pairs, (needle,)):]:
+        if not value.startswith(needle):
+            break
+        rows.append(row)
+    return rows
@@ -0,0 +1,216 @@
+"""Регрессионные тесты разбора заказов и данных аккаунтов (order_parser).
+
+Тексты обезличены, но повторяют форматы, в которых админы пересылают заказы и вставляют аккаунты.
+"""
+import pytest
+
+from order_parser import (
+    parse_order_info, parse_account_info, is_order_text, split_account_blocks,
+    CONFIDENT, LIKELY, GUESSED,
+)
+
+ORDER_CORPUS = [
+    # Полный заказ со всеми полями покупателя
+    ("""Заказ №1547382901
+Оплата: Банковская карта
+Состав заказа:
+1. God of War Ragnarök: 1290 (Платформа: PS5, Позиция: П3 7 дн.)
+Сумма: 1290
+Промокод: LETO25
+Скидка: 10
+Информация о покупателе:
+Name: Алексей
+Email: client1@example.com
+Phone: +7 900 000-00-01
+Ник_в_Telegram_или_Вконтакте: @client_one
+Date: 29.07.2025
+Дополнительные данные: Payment ID 0000000001""",
+     {'order_number': '1547382901', 'game_name': 'God of War Ragnarök', 'platform': 'PS5',
+      'rental_type': 'П3', 'days': 7, 'customer_name': 'Алексей', 'order_date': '29.07.2025',
+      'promo_code': 'LETO25', 'discount': '10', 'telegram_nick': '@client_one'}),
+    # Двоеточие в названии игры
+    ("""Заказ №2001
+Состав заказа:
+1. Marvel's Spider-Man 2: Deluxe Edition: 990 (Платформа: PS5, П2 14 дн)
+Сумма: 990
+Информация о покупателе:
+Name: Мария
+Phone: +7 900 000-00-02
+Date: 01.08.2025 12:30""",
+     {'order_number': '2001', 'game_name': "Marvel's Spider-Man 2: Deluxe Edition", 'platform': 'PS5',
+      'rental_type': 'П2', 'days': 14, 'customer_name': 'Мария', 'order_date': '01.08.2025 12:30'}),
+    # Позиция без цены, ключи полей в другом регистре
+    ("""Новый заказ! Заказ №77
+  2. FIFA 23 (П3 30дн)
+Информация о покупателе:
+name:   Иван П.
+DATE: 2025-08-03""",
+     {'order_number': '77', 'game_name': 'FIFA 23 (П3 30дн)', 'rental_type': 'П3', 'days': 30,
+      'customer_name': 'Иван П.', 'order_date': '2025-08-03'}),
+    # Значение поля на следующей строке
+    ("""Заказ №90210
+1. Silent Hill f: 1490 (Платформа: PS5, П3 30 дн.)
+Информация о покупателе:
+Name:
+Ольга
+Ник_в_Telegram_или_Вконтакте: @client_four
+Date: 05.10.2025""",
+     {'order_number': '90210', 'game_name': 'Silent Hill f', 'platform': 'PS5', 'rental_type': 'П3',
+      'days': 30, 'customer_name': 'Ольга', 'order_date': '05.10.2025', 'telegram_nick': '@client_four'}),
+    # PS4, скидка со знаком процента, ник ВКонтакте
+    ("""Заказ №31337
+Состав заказа:
+1. The Last of Us Part II: 690 (Платформа: PS4, П2 7 дн.)
+Промокод: ARENALOVE
+Скидка: 15%
+Информация о покупателе:
+Name: Сергей
+Ник_в_Telegram_или_Вконтакте: vk.com/id000000
+Date: 12.09.2025""",
+     {'order_number': '31337', 'game_name': 'The Last of Us Part II', 'platform': 'PS4', 'rental_type': 'П2',
+      'days': 7, 'customer_name': 'Сергей', 'order_date': '12.09.2025', 'promo_code': 'ARENALOVE',
+      'discount': '15', 'telegram_nick': 'vk.com/id000000'}),
+    # Только номер и блок покупателя: позиции нет
+    ("""Заказ №5
+Информация о покупателе:
+Name: Анна""",
+     {'order_number': '5', 'customer_name': 'Анна'}),
+    # Пустые значения полей не подхватывают чужие строки-метки
+    ("""Заказ №6006
+1. Mafia: Definitive Edition: 390 (Платформа: PS5, П3 3 дн.)
+Промокод:
+Скидка: нет
+Информация о покупателе:
+Name: Павел
+Date: 02.02.2025""",
+     {'order_number': '6006', 'game_name': 'Mafia: Definitive Edition', 'platform': 'PS5', 'rental_type': 'П3',
+      'days': 3, 'customer_name': 'Павел', 'order_date': '02.02.2025'}),
+    # Строчные буквы позиции и платформы
+    ("""Заказ №8080
+1. Cyberpunk 2077: 890 (платформа: PS5, п3 14 дн.)
+Информация о покупателе:
+Name: Дмитрий""",
+     {'order_number': '8080', 'game_name': 'Cyberpunk 2077', 'platform': 'PS5', 'rental_type': 'П3',
+      'days': 14, 'customer_name': 'Дмитрий'}),
+]
+
+ACCOUNT_CORPUS = [
+    ("""Аккаунт: 15
+PS5
+mail15@example.com
+Qwerty123
+✅ активация""",
+     {'account_number': '15', 'platform': 'PS5', 'email': 'mail15@example.com', 'password': 'Qwerty123',
+      'activation': '✅'}),
+    # Лот вместо номера аккаунта, пароль после метки-строки
+    ("""ЛОТ 42 ps4
+почта: lot42@example.ru
+пароль: abc
+Zx9!pass""",
+     {'account_number': 'ЛОТ 42', 'platform': 'PS4', 'email': 'lot42@example.ru', 'password': 'Zx9!pass'}),
+    # Почта и пароль в одной строке
+    ("""Аккаунт: A-7 PS5
+acc7@example.com Passw0rd""",
+     {'account_number': 'A-7', 'platform': 'PS5', 'email': 'acc7@example.com', 'password': 'Passw0rd'}),
+    # Без почты: паролем считается последняя подходящая строка
+    ("""Лот 3
+ps4
+secretpass""",
+     {'account_number': 'ЛОТ 3', 'platform': 'PS4', 'password': 'secretpass'}),
+    # Номер аккаунта на следующей строке
+    ("""Аккаунт:
+204
+PS5
+user204@example.com
+hunter2hunter""",
+     {'account_number': '204', 'platform': 'PS5', 'email': 'user204@example.com', 'password': 'hunter2hunter'}),
+    # Лот с другим регистром, обе платформы — приоритет у PS5
+    ("""лот 9 (PS4/PS5)
+lot9@example.org
+P@ss-9999""",
+     {'account_number': 'ЛОТ 9', 'platform': 'PS5', 'email': 'lot9@example.org', 'password': 'P@ss-9999'}),
+    # Нет ни номера, ни лота, ни платформы
+    ("""someone@example.com
+LongPassword1""",
+     {'email': 'someone@example.com', 'password': 'LongPassword1'}),
+    # Только почта, пароля нет
+    ("""Аккаунт: 301
+onlymail@example.com""",
+     {'account_number': '301', 'email': 'onlymail@example.com'}),
+]
+
+
+@pytest.mark.parametrize('text, expected', ORDER_CORPUS, ids=[f'order{i}' for i in range(len(ORDER_CORPUS))])
+def test_parse_order_info(text, expected):
+    assert parse_order_info(text).to_dict() == expected
+
+
+@pytest.mark.parametrize('text, expected', ACCOUNT_CORPUS, ids=[f'account{i}' for i in range(len(ACCOUNT_CORPUS))])
+def test_parse_account_info(text, expected):
+    assert parse_account_info(text).to_dict() == expected
+
+
+@pytest.mark.parametrize('text', ['', None])
+def test_empty_input(text):
+    assert parse_order_info(text).to_dict() == {}
+    assert parse_account_info(text).to_dict() == {}
+
+
+def test_missing_fields_default_through_get():
+    order = parse_order_info("Заказ №5\nИнформация о покупателе:\nName: Анна")
+    assert order.game_name is None
+    assert order.get('game_name', 'Игра') == 'Игра'
+    assert order.get('days', 7) == 7
+    assert order.get('unknown_field', 'x') == 'x'
+
+
+def test_order_confidence():
+    order = parse_order_info(ORDER_CORPUS[3][0])
+    assert order.confidence['order_number'] == CONFIDENT
+    assert order.confidence['game_name'] == CONFIDENT
+    # Имя найдено на строке после метки
+    assert order.confidence['customer_name'] == LIKELY
+
+
+def test_order_title_without_price_is_guessed():
+    order = parse_order_info("Заказ №1\n1. Some Game без цены\nИнформация о покупателе:")
+    assert order.game_name == 'Some Game без цены'
+    assert order.confidence['game_name'] == GUESSED
+
+
+def test_account_confidence():
+    account = parse_account_info(ACCOUNT_CORPUS[0][0])
+    assert account.confidence['account_number'] == CONFIDENT
+    assert account.confidence['email'] == CONFIDENT
+    assert account.confidence['password'] == LIKELY
+
+    lot = parse_account_info(ACCOUNT_CORPUS[3][0])
+    assert lot.confidence['account_number'] == LIKELY
+    assert lot.confidence['password'] == GUESSED
+
+
+def test_is_order_text():
+    assert is_order_text(ORDER_CORPUS[0][0])
+    assert not is_order_text("Заказ №1 без блока покупателя")
+    assert not is_order_text("Информация о покупателе: без номера")
+    assert not is_order_text('')
+    assert not is_order_text(None)
+
+
+def test_split_account_blocks_by_marker_lines():
+    text = "\n".join(text for text, _ in ACCOUNT_CORPUS[:4])
+    blocks = split_account_blocks(text)
+    assert len(blocks) == 4
+    assert [parse_account_info(block).to_dict() for block in blocks] == [expected for _, expected in ACCOUNT_CORPUS[:4]]
+
+
+def test_split_account_blocks_by_blank_lines():
+    text = "a1@example.com\nPassOne1\n\n\na2@example.com\nPassTwo2\n   \na3@example.com\nPassThree3"
+    blocks = split_account_blocks(text)
+    assert blocks == ["a1@example.com\nPassOne1", "a2@example.com\nPassTwo2", "a3@example.com\nPassThree3"]
+
+
+def test_split_account_blocks_single_and_empty():
+    assert split_account_blocks(ACCOUNT_CORPUS[0][0]) == [ACCOUNT_CORPUS[0][0]]
+    assert split_account_blocks('') == []
+    assert split_account_blocks(None) == []
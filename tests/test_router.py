@@ -0,0 +1,76 @@
+"""Тесты маршрутизации нажатий кнопок (router.Router): точный ключ, префикс с параметром, fallback."""
+import asyncio
+
+from router import Router, Screen
+
+
+def make_router(calls, fallback=True):
+    async def render(update, screen):
+        calls.append(('render', screen.text))
+        return 'rendered'
+
+    async def missing(update, context):
+        calls.append(('fallback', update))
+        return 'fallback'
+
+    router = Router(render=render, fallback=missing if fallback else None)
+    router.screen('menu', Screen('Главное меню'))
+
+    @router.on('help', 'about')
+    async def show_help(update, context):
+        calls.append(('help', update))
+        return 'help'
+
+    @router.on_prefix('game')
+    async def show_game(update, context, param):
+        calls.append(('game', param))
+        return 'game'
+
+    return router
+
+
+def dispatch(router, key, update='update'):
+    return asyncio.run(router.dispatch(key, update, None))
+
+
+def test_exact_screen_is_rendered():
+    calls = []
+    assert dispatch(make_router(calls), 'menu') == 'rendered'
+    assert calls == [('render', 'Главное меню')]
+
+
+def test_exact_handler_for_every_registered_key():
+    calls = []
+    router = make_router(calls)
+    assert dispatch(router, 'help') == 'help'
+    assert dispatch(router, 'about') == 'help'
+    assert calls == [('help', 'update'), ('help', 'update')]
+
+
+def test_prefix_handler_gets_param_after_first_colon():
+    calls = []
+    assert dispatch(make_router(calls), 'game:42:ps5') == 'game'
+    assert calls == [('game', '42:ps5')]
+
+
+def test_exact_key_wins_over_prefix():
+    calls = []
+    router = make_router(calls)
+    router.screen('game:top', Screen('Топ игр'))
+    assert dispatch(router, 'game:top') == 'rendered'
+    assert calls == [('render', 'Топ игр')]
+
+
+def test_unknown_keys_go_to_fallback():
+    calls = []
+    router = make_router(calls)
+    assert dispatch(router, 'unknown') == 'fallback'
+    assert dispatch(router, 'other:1') == 'fallback'
+    assert dispatch(router, None) == 'fallback'
+    assert [name for name, _ in calls] == ['fallback'] * 3
+
+
+def test_unknown_key_without_fallback_returns_none():
+    calls = []
+    assert dispatch(make_router(calls, fallback=False), 'unknown') is None
+    assert calls == []
@@ -0,0 +1,68 @@
+"""Планировщик отложенных сообщений (scheduler.MessageScheduler): отправка и архив разделены."""
+import asyncio
+
+import scheduler
+from scheduler import MessageScheduler
+
+
+class FakeQueue:
+    def __init__(self, archive_failures=0, deliver_failures=0):
+        self.archive_failures = archive_failures
+        self.deliver_failures = deliver_failures
+        self.delivered = []
+        self.archived = []
+        self.released = []
+
+    async def load_pending(self):
+        return {}
+
+    async def claim(self, key):
+        return {'text': 'hi', 'attempts': 0}
+
+    async def deliver(self, app, key, data):
+        if self.deliver_failures:
+            self.deliver_failures -= 1
+            raise RuntimeError('telegram down')
+        self.delivered.append(key)
+
+    async def release(self, key, data, attempts, retry_at):
+        self.released.append((key, attempts, retry_at))
+
+    async def archive(self, key, data):
+        if self.archive_failures:
+            self.archive_failures -= 1
+            raise RuntimeError('firebase down')
+        self.archived.append(key)
+
+
+def make_scheduler(queue):
+    return MessageScheduler(queue.load_pending, queue.claim, queue.deliver, queue.release, queue.archive)
+
+
+def test_archive_failure_retries_archive_without_resending(monkeypatch):
+    monkeypatch.setattr(scheduler, 'SCHEDULE_RETRY_DELAY', 0)
+    queue = FakeQueue(archive_failures=2)
+    worker = make_scheduler(queue)
+
+    async def run():
+        await worker._process('m1')
+        # Повторы, которые воркер достал бы из кучи
+        while 'm1' in worker._due:
+            del worker._due['m1']
+            await worker._process('m1')
+
+    asyncio.run(run())
+    assert queue.delivered == ['m1']
+    assert queue.archived == ['m1']
+    assert queue.released == []
+    assert worker.delivered == 1
+
+
+def test_failed_send_is_released_for_retry():
+    queue = FakeQueue(deliver_failures=1)
+    worker = make_scheduler(queue)
+    asyncio.run(worker._process('m1'))
+    assert queue.delivered == []
+    assert queue.archived == []
+    assert [(key, attempts) for key, attempts, _ in queue.released] == [('m1', 1)]
+    assert 'm1' in worker._due
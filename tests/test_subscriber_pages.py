@@ -0,0 +1,86 @@
+"""Постраничное чтение подписчиков (firebase_repo): курсор должен идти в серверном порядке ключей."""
+import asyncio
+
+import pytest
+
+import firebase_repo
+from firebase_repo import FirebaseRepository, firebase_key_order
+
+
+class FakeQuery:
+    """order_by_key по правилам сервера; результат, как в firebase_admin, пересортирован строками"""
+
+    def __init__(self, keys):
+        self._keys = sorted(keys, key=firebase_key_order)
+        self._start = None
+        self._limit = None
+
+    def order_by_key(self):
+        return self
+
+    def start_at(self, key):
+        self._start = key
+        return self
+
+    def limit_to_first(self, limit):
+        self._limit = limit
+        return self
+
+    def get(self):
+        keys = self._keys
+        if self._start is not None:
+            keys = [key for key in keys if firebase_key_order(key) >= firebase_key_order(self._start)]
+        return {key: True for key in sorted(keys[:self._limit])}
+
+
+class FakeDb:
+    def __init__(self, keys):
+        self._keys = keys
+
+    def reference(self, path):
+        assert path == 'subscribers'
+        return FakeQuery(self._keys)
+
+
+def collect_pages(keys, page_size, start_after=None):
+    repo = FirebaseRepository(max_workers=1)
+    repo._subscribers_ready = True
+
+    async def collect():
+        pages = []
+        async for page in repo.iter_subscriber_pages(start_after, page_size):
+            pages.append(page)
+            assert len(pages) <= len(keys), "страницы зациклились"
+        return pages
+
+    try:
+        return asyncio.run(collect())
+    finally:
+        repo.shutdown()
+
+
+# Telegram id разной длины: 9-значные, 10-значные в пределах int32, за его пределами и строковые
+MIXED_IDS = ([str(999999000 + i) for i in range(67)] + [str(1000000000 + i) for i in range(67)]
+             + [str(5000000000 + i) for i in range(67)] + ['-100123', '0', 'admin'])
+
+
+def test_key_order_matches_server_rules():
+    assert sorted(['10', '9', 'a', '2147483648', '-1'], key=firebase_key_order) == \
+        ['-1', '9', '10', '2147483648', 'a']
+
+
+@pytest.mark.parametrize('page_size', [1, 7, 50, 500])
+def test_mixed_length_ids_are_read_once_in_server_order(monkeypatch, page_size):
+    monkeypatch.setattr(firebase_repo, 'db', FakeDb(MIXED_IDS))
+    pages = collect_pages(MIXED_IDS, page_size)
+    keys = [key for page in pages for key in page]
+    assert keys == sorted(MIXED_IDS, key=firebase_key_order)
+    assert all(len(page) <= page_size for page in pages)
+
+
+def test_resume_after_cursor_skips_read_keys(monkeypatch):
+    monkeypatch.setattr(firebase_repo, 'db', FakeDb(MIXED_IDS))
+    ordered = sorted(MIXED_IDS, key=firebase_key_order)
+    cursor = ordered[66]  # последний 9-значный id, строкой он больше 10-значных
+    keys = [key for page in collect_pages(MIXED_IDS, 20, start_after=cursor) for key in page]
+    assert keys == ordered[67:]